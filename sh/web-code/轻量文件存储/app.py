@@ -7,141 +7,4018 @@ Jack-Disk - 轻量临时文件存储工具（优化版）
 import os
 import sys
 import json
+import queue
+import atexit
+import math
 import time
 import uuid
 import hashlib
+import hmac
+import gzip
 import logging
+import bisect
+import random
+import shutil
+import marshal
+import operator
+import array
+import heapq
+import pstats
+import cProfile
+import io
+import sqlite3
+import mmap
+import struct
 import threading
+import multiprocessing
+import http.client
+from collections import deque, OrderedDict
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from pathlib import Path
 from functools import wraps
-from typing import Dict, List, Optional, Any
-from logging.handlers import RotatingFileHandler
+from itertools import accumulate, islice
+from typing import Dict, List, Optional, Any, Tuple, Iterable, Callable
+from urllib.parse import quote, urlencode, urlsplit
+from xml.etree import ElementTree
+from logging.handlers import QueueHandler, QueueListener
 
-from flask import Flask, request, jsonify, send_file, render_template, session
+try:
+    import fcntl  # 仅类Unix系统可用，用于跨工作进程加锁
+except ImportError:
+    fcntl = None
+
+try:
+    import brotli  # 可选依赖，安装后静态资源额外提供br压缩版本
+except ImportError:
+    brotli = None
+
+from flask import Flask, Response, request, jsonify, send_file, render_template, redirect, session, g
 from werkzeug.utils import secure_filename
 from werkzeug.exceptions import RequestEntityTooLarge
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 
-# 配置日志系统 - 使用RotatingFileHandler来限制日志文件大小
+from media_probe import process_media, probe_supported, thumbnails_supported
+from content_chunker import ContentChunker
+
+LOG_FILE = 'jack-disk.log'
+
+# 配置日志系统 - 日志记录在请求线程中只入队，由后台QueueListener线程统一写文件
 # 创建自定义日志过滤器，只记录关键信息
 class KeyInfoFilter(logging.Filter):
+    # 关键事件编码，记录日志时通过 extra={'event': ...} 标记
+    KEY_EVENTS = frozenset({
+        'file.upload', 'file.download', 'file.delete', 'upload.checksum', 'cleanup.expired', 'storage.evict',
+        'storage.reject', 'storage.migrate', 'storage.demote', 'storage.compact', 'admin.login',
+        'admin.clear_all', 'config.update', 'scheduler.start'
+    })
+    
     def filter(self, record):
-        # 只记录包含关键信息的日志
-        key_messages = [
-            '文件上传成功', '文件下载', '删除文件', '清理了', '保存元数据失败',
-            '加载元数据失败', '上传失败', '下载失败', '删除失败', '清理过期文件失败',
-            '检查存储空间失败', '初始化分片上传失败', '上传分片失败', '完成分片上传失败',
-            '获取上传状态失败', '获取文件列表失败', '文件预览失败', '批量删除失败',
-            '获取统计信息失败', '管理员登录', '定时任务已启动', '配置已更新', '清空所有文件',
-            '清空文件失败', '更新配置失败', '获取配置失败', '管理员登录失败'
-        ]
+        # 如果是ERROR或CRITICAL级别的日志，总是记录
+        if record.levelno >= logging.ERROR:
+            return True
+        
+        # 按事件编码过滤，只做一次集合查找，不再逐个匹配消息内容
+        return getattr(record, 'event', None) in self.KEY_EVENTS
+
+
+class SafeRotatingFileHandler(logging.FileHandler):
+    """
+    多进程安全的大小限制日志处理器
+    所有工作进程以追加模式（O_APPEND）写同一个文件，超过大小上限时在文件锁保护下原地清空，
+    其他进程的句柄无需重新打开，也不会出现多个进程各自轮转互相覆盖的问题
+    """
+    
+    def __init__(self, filename: str, max_bytes: int, encoding: str = 'utf-8'):
+        super().__init__(filename, mode='a', encoding=encoding)
+        self.max_bytes = max_bytes
+        self.lock_path = f"{self.baseFilename}.lock"
+    
+    def emit(self, record):
+        super().emit(record)
+        try:
+            if self.stream is not None and os.fstat(self.stream.fileno()).st_size > self.max_bytes:
+                self._truncate()
+        except Exception:
+            self.handleError(record)
+    
+    def _truncate(self):
+        """超过大小上限后清空日志文件"""
+        if fcntl is None:
+            self.stream.truncate(0)
+            return
+        with open(self.lock_path, 'a') as lock_fp:
+            fcntl.flock(lock_fp, fcntl.LOCK_EX)
+            try:
+                # 加锁后再检查一次，其他进程可能已经清空过了
+                if os.fstat(self.stream.fileno()).st_size > self.max_bytes:
+                    os.ftruncate(self.stream.fileno(), 0)
+            finally:
+                fcntl.flock(lock_fp, fcntl.LOCK_UN)
+
+
+_log_handlers: List[logging.Handler] = []
+_log_queue_handler: Optional[QueueHandler] = None
+_log_listener: Optional[QueueListener] = None
+
+
+def _start_log_listener():
+    """创建日志队列并启动后台写日志线程"""
+    global _log_listener
+    log_queue = queue.SimpleQueue()
+    _log_queue_handler.queue = log_queue
+    _log_listener = QueueListener(log_queue, *_log_handlers, respect_handler_level=True)
+    _log_listener.start()
+
+
+def _stop_log_listener():
+    """停止后台写日志线程并写完队列中剩余的日志"""
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+
+
+def _setup_logging():
+    global _log_queue_handler
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    
+    # 10MB限制，超过后自动清空；只记录关键信息到文件
+    file_handler = SafeRotatingFileHandler(LOG_FILE, max_bytes=10*1024*1024)
+    file_handler.addFilter(KeyInfoFilter())
+    stream_handler = logging.StreamHandler()
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+        _log_handlers.append(handler)
+    
+    _log_queue_handler = QueueHandler(queue.SimpleQueue())
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    root_logger.addHandler(_log_queue_handler)
+    
+    _start_log_listener()
+    atexit.register(_stop_log_listener)
+    # gunicorn预加载应用后fork工作进程，线程不会被继承，需要在子进程中重新启动写日志线程
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=_start_log_listener)
+
+
+_setup_logging()
+
+logger = logging.getLogger(__name__)
+
+
+def fanout_relpath(file_id: str) -> Path:
+    """计算文件在两级哈希分散目录中的相对路径，例如 ab/cd/<file_id>"""
+    digest = hashlib.md5(file_id.encode('utf-8')).hexdigest()
+    return Path(digest[:2]) / digest[2:4] / file_id
+
+
+def merkle_root(leaf_hashes: List[str]) -> str:
+    """
+    由各分片的SHA-256（十六进制）计算Merkle树根：相邻两个节点拼接后再取SHA-256，
+    奇数个时最后一个直接进入上一层；只有一个分片时树根就是该分片的哈希。前端 main.js 使用相同算法
+    """
+    level = [bytes.fromhex(h) for h in leaf_hashes]
+    if not level:
+        return hashlib.sha256(b'').hexdigest()
+    while len(level) > 1:
+        level = [hashlib.sha256(level[i] + level[i + 1]).digest() if i + 1 < len(level) else level[i]
+                 for i in range(0, len(level), 2)]
+    return level[0].hex()
+
+
+def _is_legacy_date_dir(path: Path) -> bool:
+    """判断是否为旧版按日期命名的存储目录（YYYYMMDD）"""
+    return path.is_dir() and path.name.isdigit() and len(path.name) == 8
+
+
+def _is_fanout_dir(path: Path) -> bool:
+    """判断是否为哈希分散存储的一级目录"""
+    if not path.is_dir() or len(path.name) != 2:
+        return False
+    try:
+        int(path.name, 16)
+        return True
+    except ValueError:
+        return False
+
+
+def migrate_legacy_layout(upload_dir: str, batch_size: int = 500, pause: float = 0.05,
+                          stop_event: Optional[threading.Event] = None,
+                          is_deleted: Optional[Callable[[str], bool]] = None) -> Dict[str, int]:
+    """
+    在线迁移：把旧版日期目录下的文件移动到哈希分散目录
+    同一文件系统内 os.replace 是原子操作，读取路径会同时兼容新旧两种布局，所以迁移期间无需停服。
+    is_deleted 用于在线迁移：移动后再查一次元数据，移动期间被删除的文件从新位置删掉，不留下孤儿文件
+    """
+    result = {'moved': 0, 'skipped': 0, 'failed': 0, 'removed': 0}
+    base = Path(upload_dir)
+    if not base.exists():
+        return result
+
+    known_dirs = set()
+    processed = 0
+    for date_dir in sorted(p for p in base.iterdir() if _is_legacy_date_dir(p)):
+        with os.scandir(date_dir) as entries:
+            names = [entry.name for entry in entries if entry.is_file(follow_symlinks=False)]
+
+        for name in names:
+            if stop_event is not None and stop_event.is_set():
+                return result
+
+            # 旧版文件名格式为 <file_id>_<upload_time>
+            file_id, sep, upload_time = name.rpartition('_')
+            if not sep or not file_id or not upload_time.isdigit():
+                result['skipped'] += 1
+                continue
+
+            target = base / fanout_relpath(file_id)
+            try:
+                if target.parent not in known_dirs:
+                    target.parent.mkdir(parents=True, exist_ok=True)
+                    known_dirs.add(target.parent)
+                if target.exists():
+                    result['skipped'] += 1
+                    continue
+                os.replace(date_dir / name, target)
+                if is_deleted is not None and is_deleted(file_id):
+                    target.unlink(missing_ok=True)
+                    result['removed'] += 1
+                else:
+                    result['moved'] += 1
+            except FileNotFoundError:
+                # 迁移期间文件被删除或过期清理，直接跳过
+                result['skipped'] += 1
+            except Exception as e:
+                result['failed'] += 1
+                logger.error(f"迁移文件失败 {date_dir / name}: {e}")
+
+            processed += 1
+            if batch_size and processed % batch_size == 0 and pause:
+                # 分批迁移，避免与在线流量争抢磁盘
+                time.sleep(pause)
+
+        try:
+            date_dir.rmdir()
+        except OSError:
+            # 目录非空（有跳过的文件）时保留
+            pass
+
+    return result
+
+
+class JackDiskConfig:
+    """配置管理类"""
+    
+    def __init__(self):
+        # 基础配置
+        self.admin_password = os.getenv('TEMPSTORE_ADMIN_PASSWORD', 'admin')  # 默认密码为admin
+        self.upload_dir = os.getenv('TEMPSTORE_UPLOAD_DIR', './uploads')
+        self.log_level = os.getenv('TEMPSTORE_LOG_LEVEL', 'INFO')
+        self.max_storage = self._parse_size(os.getenv('TEMPSTORE_MAX_STORAGE', '20GB'))
+        
+        # 高级配置
+        # 修改：将清理间隔从15分钟改为5分钟，确保文件过期后能更及时被清理
+        self.clean_interval = int(os.getenv('TEMPSTORE_CLEAN_INTERVAL', '3600'))  # 60分钟
+        self.session_timeout = int(os.getenv('TEMPSTORE_SESSION_TIMEOUT', '1800'))  # 30分钟
+        self.max_file_size = self._parse_size(os.getenv('TEMPSTORE_MAX_FILE_SIZE', '1GB'))
+        self.max_files_per_upload = int(os.getenv('TEMPSTORE_MAX_FILES_PER_UPLOAD', '10'))
+        self.file_expire_hours = int(os.getenv('TEMPSTORE_FILE_EXPIRE_HOURS', '24'))
+        self.min_free_space = self._parse_size(os.getenv('TEMPSTORE_MIN_FREE_SPACE', '100MB'))  # 磁盘保留空间
+        self.reservation_ttl = int(os.getenv('TEMPSTORE_RESERVATION_TTL', '7200'))  # 空间预留超时（秒），与临时文件保留时间一致
+        self.chunk_min_size = self._parse_size(os.getenv('TEMPSTORE_CHUNK_MIN_SIZE', '256KB'))  # 分片大小下限（最后一片除外）
+        self.chunk_max_size = self._parse_size(os.getenv('TEMPSTORE_CHUNK_MAX_SIZE', '64MB'))  # 分片大小上限
+        self.chunk_default_size = self._parse_size(os.getenv('TEMPSTORE_CHUNK_DEFAULT_SIZE', '4MB'))  # 客户端没有测得速度时的初始分片大小
+        self.chunk_target_seconds = float(os.getenv('TEMPSTORE_CHUNK_TARGET_SECONDS', '3'))  # 每个分片的目标上传时间，按测得速度换算分片大小
+        self.chunk_max_count = int(os.getenv('TEMPSTORE_CHUNK_MAX_COUNT', '10000'))  # 单个文件最多分片数，大文件的分片下限随之提高
+        self.metrics_dir = os.getenv('TEMPSTORE_METRICS_DIR', os.path.join(self.upload_dir, 'metrics'))  # 多进程指标快照目录
+        self.metrics_token = os.getenv('TEMPSTORE_METRICS_TOKEN', '')  # /metrics 访问令牌，为空时不校验
+        self.max_profiles = int(os.getenv('TEMPSTORE_MAX_PROFILES', '20'))  # 保留的性能分析结果数
+        self.counter_flush_interval = float(os.getenv('TEMPSTORE_COUNTER_FLUSH_INTERVAL', '5'))  # 下载计数批量持久化间隔（秒）
+        self.cleanup_workers = int(os.getenv('TEMPSTORE_CLEANUP_WORKERS', '4'))  # 后台删除线程数
+        self.batch_workers = int(os.getenv('TEMPSTORE_BATCH_WORKERS', '8'))  # 批量操作的并行磁盘操作线程数
+        self.max_batch_items = int(os.getenv('TEMPSTORE_MAX_BATCH_ITEMS', '10000'))  # 单次批量操作的最大文件数
+        self.event_stream_seconds = int(os.getenv('TEMPSTORE_EVENT_STREAM_SECONDS', '25'))  # 单个事件流连接的最长时间，应小于gunicorn超时
+        self.response_cache_ttl = int(os.getenv('TEMPSTORE_RESPONSE_CACHE_TTL', '30'))  # 文件列表/统计响应缓存的最长有效期（秒）
+        self.max_per_page = int(os.getenv('TEMPSTORE_MAX_PER_PAGE', '200'))  # 文件列表每页最多条数
+        self.gzip_min_size = int(os.getenv('TEMPSTORE_GZIP_MIN_SIZE', '1024'))  # JSON响应超过该字节数时gzip压缩
+        self.cleanup_files_per_sec = float(os.getenv('TEMPSTORE_CLEANUP_FILES_PER_SEC', '1000'))  # 每秒最多删除文件数，0为不限
+        self.cleanup_bytes_per_sec = self._parse_size(os.getenv('TEMPSTORE_CLEANUP_BYTES_PER_SEC', '500MB'))  # 每秒最多释放字节数，0为不限
+        
+        # 媒体处理配置（上传后在后台提取媒体信息、生成缩略图）
+        self.media_workers = int(os.getenv('TEMPSTORE_MEDIA_WORKERS', '2'))  # 每个工作进程的媒体处理进程数，0为关闭
+        self.media_max_pending = int(os.getenv('TEMPSTORE_MEDIA_MAX_PENDING', '100'))  # 每个工作进程排队和处理中的任务上限，超出时放弃
+        self.media_max_source = self._parse_size(os.getenv('TEMPSTORE_MEDIA_MAX_SOURCE', '50MB'))  # 超过该大小的图片不生成缩略图
+        self.thumbnail_size = int(os.getenv('TEMPSTORE_THUMBNAIL_SIZE', '256'))  # 缩略图最长边（像素）
+        self.derived_cache_size = self._parse_size(os.getenv('TEMPSTORE_DERIVED_CACHE_SIZE', '512MB'))  # 缩略图缓存上限，超出时淘汰最久未访问的
+        
+        # 存储后端配置（local为本地磁盘，dedup为本地块级去重存储，s3为S3兼容对象存储）
+        self.storage_backend = os.getenv('TEMPSTORE_STORAGE_BACKEND', 'local').lower()
+        self.dedup_avg_block = self._parse_size(os.getenv('TEMPSTORE_DEDUP_AVG_BLOCK', '64KB'))  # 去重存储的平均块大小（取2的幂），最小/最大块为其1/4和4倍
+        self.dedup_workers = int(os.getenv('TEMPSTORE_DEDUP_WORKERS', '2'))  # 每个工作进程查找去重切点的子进程数，为0时在请求线程中计算（会阻塞同进程的其他请求）
+        self.cold_dir = os.getenv('TEMPSTORE_COLD_DIR', '')  # 冷层目录（大容量磁盘），设置后本地存储分为冷热两层，为空时不分层
+        self.tier_hot_age = int(os.getenv('TEMPSTORE_TIER_HOT_AGE', '3600'))  # 文件写入热层超过该秒数后可被迁移到冷层
+        self.tier_hot_downloads = int(os.getenv('TEMPSTORE_TIER_HOT_DOWNLOADS', '10'))  # 下载次数达到该值的文件留在热层（热层超出容量时除外）
+        self.tier_hot_capacity = self._parse_size(os.getenv('TEMPSTORE_TIER_HOT_CAPACITY', '0'))  # 热层容量，超出时按最久未写入的顺序迁移，0为不限
+        self.tier_bytes_per_sec = self._parse_size(os.getenv('TEMPSTORE_TIER_BYTES_PER_SEC', '50MB'))  # 迁移到冷层的限速，0为不限
+        self.tier_interval = int(os.getenv('TEMPSTORE_TIER_INTERVAL', '300'))  # 迁移任务间隔（秒）
+        self.pack_threshold = self._parse_size(os.getenv('TEMPSTORE_PACK_THRESHOLD', '0'))  # 本地存储中不超过该大小的文件打包写入段文件，0为不打包（建议64KB）
+        self.pack_segment_size = self._parse_size(os.getenv('TEMPSTORE_PACK_SEGMENT_SIZE', '64MB'))  # 段文件写满该大小后换新段
+        self.pack_compact_ratio = float(os.getenv('TEMPSTORE_PACK_COMPACT_RATIO', '0.5'))  # 段中有效数据比例低于该值时压缩
+        self.pack_compact_interval = int(os.getenv('TEMPSTORE_PACK_COMPACT_INTERVAL', '600'))  # 压缩任务间隔（秒）
+        self.s3_endpoint = os.getenv('TEMPSTORE_S3_ENDPOINT', '')  # 例如 http://127.0.0.1:9000
+        self.s3_bucket = os.getenv('TEMPSTORE_S3_BUCKET', 'jack-disk')
+        self.s3_region = os.getenv('TEMPSTORE_S3_REGION', 'us-east-1')
+        self.s3_access_key = os.getenv('TEMPSTORE_S3_ACCESS_KEY', '')
+        self.s3_secret_key = os.getenv('TEMPSTORE_S3_SECRET_KEY', '')
+        self.s3_prefix = os.getenv('TEMPSTORE_S3_PREFIX', '')  # 对象键前缀，多个实例共用一个桶时区分
+        self.s3_pool_size = int(os.getenv('TEMPSTORE_S3_POOL_SIZE', '16'))  # 每个工作进程保持的连接数
+        self.s3_part_size = self._parse_size(os.getenv('TEMPSTORE_S3_PART_SIZE', '8MB'))  # 分段上传的段大小，最小5MB
+        
+        # 集群配置（多个节点共同提供服务，文件按一致性哈希分布）
+        self.cluster_nodes = os.getenv('TEMPSTORE_CLUSTER_NODES', '')  # 例如 a=http://10.0.0.1:5000,b=http://10.0.0.2:5000，为空时单机运行
+        self.node_id = os.getenv('TEMPSTORE_NODE_ID', '')  # 本节点在节点列表中的名称
+        self.cluster_routing = os.getenv('TEMPSTORE_CLUSTER_ROUTING', 'proxy').lower()  # 下载/预览访问其他节点的文件时：proxy转发或redirect重定向
+        self.cluster_timeout = float(os.getenv('TEMPSTORE_CLUSTER_TIMEOUT', '3'))  # 汇总查询（文件列表/统计）等待各节点的秒数
+        self.cluster_proxy_timeout = float(os.getenv('TEMPSTORE_CLUSTER_PROXY_TIMEOUT', '60'))  # 转发上传/下载时的套接字超时
+        self.cluster_secret = os.getenv('TEMPSTORE_CLUSTER_SECRET', '')  # 节点间共享密钥（集群模式必填），用于识别其他节点转发的请求
+        self.cluster_max_window = int(os.getenv('TEMPSTORE_CLUSTER_MAX_WINDOW', '5000'))  # 汇总文件列表时每个节点最多返回的条数
+        
+        # 限流配置（按客户端IP，令牌桶）
+        self.rate_limit_enabled = os.getenv('TEMPSTORE_RATE_LIMIT', 'true').lower() in ('1', 'true', 'yes')
+        self.rate_limits = {
+            # 路由组: (每秒请求数, 突发容量)
+            'upload': (float(os.getenv('TEMPSTORE_UPLOAD_RPS', '2')), float(os.getenv('TEMPSTORE_UPLOAD_BURST', '10'))),
+            'chunk': (float(os.getenv('TEMPSTORE_CHUNK_RPS', '20')), float(os.getenv('TEMPSTORE_CHUNK_BURST', '40'))),
+            'download': (float(os.getenv('TEMPSTORE_DOWNLOAD_RPS', '5')), float(os.getenv('TEMPSTORE_DOWNLOAD_BURST', '20'))),
+        }
+        self.client_bandwidth = self._parse_size(os.getenv('TEMPSTORE_CLIENT_BANDWIDTH', '50MB'))  # 每客户端每秒字节数，0为不限
+        self.max_concurrent_downloads = int(os.getenv('TEMPSTORE_MAX_CONCURRENT_DOWNLOADS', '4'))  # 每客户端并发下载数
+        self.trust_proxy = os.getenv('TEMPSTORE_TRUST_PROXY', 'true').lower() in ('1', 'true', 'yes')  # 信任反向代理的X-Forwarded-For
+        
+        # 安全配置
+        self.allowed_extensions = set()
+        self.blocked_extensions = {'.exe', '.bat', '.cmd', '.com', '.scr', '.vbs', '.js'}
+        
+    def _parse_size(self, size_str: str) -> int:
+        """解析文件大小字符串"""
+        size_str = size_str.upper()
+        if size_str.endswith('GB'):
+            return int(size_str[:-2]) * 1024 * 1024 * 1024
+        elif size_str.endswith('MB'):
+            return int(size_str[:-2]) * 1024 * 1024
+        elif size_str.endswith('KB'):
+            return int(size_str[:-2]) * 1024
+        else:
+            return int(size_str)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典"""
+        return {
+            'max_file_size': self.max_file_size,
+            'max_storage': self.max_storage,
+            'file_expire_hours': self.file_expire_hours,
+            'max_files_per_upload': self.max_files_per_upload,
+            'clean_interval': self.clean_interval
+        }
+
+class FileMetadata:
+    """文件元数据管理"""
+    
+    def __init__(self, file_id: str, original_name: str, file_size: int, 
+                 file_type: str, upload_time: int, expire_time: int,
+                 md5_hash: str = "", download_count: int = 0, is_deleted: bool = False, tree_hash: str = "",
+                 media: Optional[Dict[str, Any]] = None):
+        self.file_id = file_id
+        self.original_name = original_name
+        self.file_size = file_size
+        self.file_type = file_type
+        self.upload_time = upload_time
+        self.expire_time = expire_time
+        self.md5_hash = md5_hash
+        self.download_count = download_count
+        self.is_deleted = is_deleted
+        self.tree_hash = tree_hash  # 分片上传的SHA-256 Merkle树根（见 merkle_root）
+        self.media = media  # 媒体处理结果（尺寸、时长、编码、是否有缩略图），见 MediaPipeline
+        self.info_json = None  # 缓存的文件列表JSON片段 (日期, 片段)，任一字段变化时清空
+    
+    def __setattr__(self, name: str, value: Any):
+        owner = self.__dict__.get('_owner') if name in ('file_size', 'is_deleted') else None
+        if owner is not None:
+            # 所属的 LazyMetadataMap 维护未删除文件的总大小
+            owner.apply_size_change(self, name, value)
+        else:
+            object.__setattr__(self, name, value)
+        if name != 'info_json':
+            object.__setattr__(self, 'info_json', None)
+    
+    def stored_size(self) -> int:
+        """计入存储用量的字节数（已删除的文件不计）"""
+        return 0 if self.is_deleted else self.file_size
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'file_id': self.file_id,
+            'original_name': self.original_name,
+            'file_size': self.file_size,
+            'file_type': self.file_type,
+            'upload_time': self.upload_time,
+            'expire_time': self.expire_time,
+            'md5_hash': self.md5_hash,
+            'download_count': self.download_count,
+            'is_deleted': self.is_deleted,
+            'tree_hash': self.tree_hash,
+            'media': self.media
+        }
+
+class MetadataSnapshot:
+    """
+    元数据二进制快照（metadata.snap），启动时直接mmap映射，不解析整个metadata.json
+    布局: 文件头 | 按文件ID排序的定长索引表(ID, 记录偏移, 记录长度) | 列 | 小写文件名 | marshal编码的记录
+    列按记录序号存放上传时间、过期时间、大小、下载次数和删除标记，以及按上传时间、大小、文件名、过期时间排好序的记录序号，
+    文件列表分页和统计直接读列，不解码记录；列按本机字节序存放，快照只在生成它的机器上使用
+    文件头记录生成快照时metadata.json的大小和修改时间，不一致说明快照已过期
+    """
+    
+    MAGIC = b'JDSNAP04'
+    # 魔数, 记录数, ID宽度, 未删除记录数, 未删除文件总大小, metadata.json大小, metadata.json修改时间(ns), 小写文件名总长度
+    HEADER = struct.Struct('<8sIIIQQqQ')
+    ENTRY = struct.Struct('<QI')       # 记录偏移, 记录长度
+    FIELDS = ('original_name', 'file_size', 'file_type', 'upload_time', 'expire_time',
+              'md5_hash', 'download_count', 'is_deleted', 'tree_hash', 'media')
+    COLUMNS = ('upload_time', 'expire_time', 'file_size', 'download_count')
+    ORDERS = ('upload_time', 'size', 'name')  # 文件列表的排序方式，前两种从大到小，文件名从小到大
+    
+    def __init__(self, path: Path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (magic, self.count, self.key_width, self.live_count, self.live_bytes,
+             self.json_size, self.json_mtime_ns, names_size) = self.HEADER.unpack_from(self._mm, 0)
+            if magic != self.MAGIC:
+                raise ValueError('元数据快照格式不正确')
+            self._slot = self.key_width + self.ENTRY.size
+            layout = self._layout(self.count, self.key_width, self.live_count, names_size)
+            if len(self._mm) < layout['records']:
+                raise ValueError('元数据快照不完整')
+        except Exception:
+            self._mm.close()
+            raise
+        self._views = [memoryview(self._mm)]
+        for name in self.COLUMNS:
+            setattr(self, name, self._view(layout[name], self.count, 'q'))
+        self.deleted = self._view(layout['deleted'], self.count, 'B')
+        self.orders = {name: self._view(layout[f'by_{name}'], self.count, 'I') for name in self.ORDERS}
+        self.by_expire = self._view(layout['by_expire'], self.live_count, 'I')  # 只含未删除的记录
+        self._name_offsets = self._view(layout['name_offsets'], self.count + 1, 'Q')
+        self._names_start = layout['names']
+    
+    @classmethod
+    def _layout(cls, count: int, key_width: int, live_count: int, names_size: int) -> Dict[str, int]:
+        """各部分在文件中的起始位置（列按8字节对齐）"""
+        def align(value: int) -> int:
+            return (value + 7) & ~7
+        
+        layout = {}
+        offset = align(cls.HEADER.size + count * (key_width + cls.ENTRY.size))
+        for name in cls.COLUMNS:
+            layout[name] = offset
+            offset += count * 8
+        layout['deleted'] = offset
+        offset = align(offset + count)
+        for name in cls.ORDERS:
+            layout[f'by_{name}'] = offset
+            offset += count * 4
+        layout['by_expire'] = offset
+        offset = align(offset + live_count * 4)
+        layout['name_offsets'] = offset
+        layout['names'] = offset + (count + 1) * 8
+        layout['records'] = layout['names'] + names_size
+        return layout
+    
+    def _view(self, start: int, length: int, fmt: str) -> memoryview:
+        size = struct.calcsize(fmt)
+        view = self._views[0][start:start + length * size].cast(fmt)
+        self._views.append(view)
+        return view
+    
+    @classmethod
+    def open_if_fresh(cls, path: Path, json_stat: os.stat_result) -> Optional['MetadataSnapshot']:
+        """快照存在且与metadata.json一致时打开，否则返回None"""
+        try:
+            snapshot = cls(path)
+        except (OSError, ValueError, TypeError, struct.error):
+            return None
+        if snapshot.json_size != json_stat.st_size or snapshot.json_mtime_ns != json_stat.st_mtime_ns:
+            snapshot.close()
+            return None
+        return snapshot
+    
+    @classmethod
+    def write(cls, path: Path, items: List[Tuple[str, 'FileMetadata']], json_stat: os.stat_result):
+        """生成快照（写临时文件后原子替换）"""
+        entries = sorted((file_id.encode('utf-8'), meta) for file_id, meta in items)
+        values = operator.attrgetter(*cls.FIELDS)
+        rows = [values(meta) for _, meta in entries]
+        count = len(entries)
+        key_width = max((len(key) for key, _ in entries), default=1)
+        slot = key_width + cls.ENTRY.size
+        
+        columns = {}
+        for name in cls.COLUMNS:
+            position = cls.FIELDS.index(name)
+            columns[name] = array.array('q', [int(row[position]) for row in rows])
+        position = cls.FIELDS.index('is_deleted')
+        deleted = bytes([1 if row[position] else 0 for row in rows])
+        original_names = [row[0] for row in rows]
+        upload_times, expire_times, file_sizes = columns['upload_time'], columns['expire_time'], columns['file_size']
+        # sorted 是稳定排序（reverse=True 也是），同值的记录保持文件ID顺序
+        orders = {
+            'upload_time': sorted(range(count), key=upload_times.__getitem__, reverse=True),
+            'size': sorted(range(count), key=file_sizes.__getitem__, reverse=True),
+            'name': sorted(range(count), key=original_names.__getitem__),
+        }
+        by_expire = sorted([index for index in range(count) if not deleted[index]], key=expire_times.__getitem__)
+        live_bytes = sum(file_sizes[index] for index in by_expire)
+        # 小写文件名以\0结尾首尾相接，搜索时在整段上查找
+        names = [name.lower().encode('utf-8') + b'\0' for name in original_names]
+        name_offsets = array.array('Q', accumulate(map(len, names), initial=0))
+        layout = cls._layout(count, key_width, len(by_expire), name_offsets[count])
+        
+        table = bytearray(count * slot)
+        offset = layout['records']
+        tmp_path = path.parent / f"{path.name}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.seek(offset)
+            for i, (key, _) in enumerate(entries):
+                record = marshal.dumps(rows[i])
+                f.write(record)
+                table[i * slot:i * slot + len(key)] = key
+                cls.ENTRY.pack_into(table, i * slot + key_width, offset, len(record))
+                offset += len(record)
+            f.seek(0)
+            f.write(cls.HEADER.pack(cls.MAGIC, count, key_width, len(by_expire), live_bytes,
+                                    json_stat.st_size, json_stat.st_mtime_ns, name_offsets[count]))
+            f.write(table)
+            for name in cls.COLUMNS:
+                f.seek(layout[name])
+                f.write(columns[name].tobytes())
+            f.seek(layout['deleted'])
+            f.write(deleted)
+            for name in cls.ORDERS:
+                f.seek(layout[f'by_{name}'])
+                f.write(array.array('I', orders[name]).tobytes())
+            f.seek(layout['by_expire'])
+            f.write(array.array('I', by_expire).tobytes())
+            f.seek(layout['name_offsets'])
+            f.write(name_offsets.tobytes())
+            f.writelines(names)
+        os.replace(tmp_path, path)
+    
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        self._mm.close()
+    
+    def __len__(self) -> int:
+        return self.count
+    
+    def __getitem__(self, index: int) -> bytes:
+        """第index个（补齐到定长的）文件ID，供bisect二分查找"""
+        start = self.HEADER.size + index * self._slot
+        return self._mm[start:start + self.key_width]
+    
+    def find(self, file_id: str) -> int:
+        """二分查找文件ID，返回序号，不存在时返回-1"""
+        key = file_id.encode('utf-8')
+        if len(key) > self.key_width:
+            return -1
+        key = key.ljust(self.key_width, b'\0')
+        index = bisect.bisect_left(self, key)
+        if index < self.count and self[index] == key:
+            return index
+        return -1
+    
+    def file_id(self, index: int) -> str:
+        return self[index].rstrip(b'\0').decode('utf-8')
+    
+    def record(self, index: int) -> 'FileMetadata':
+        """解码第index条记录"""
+        offset, length = self.ENTRY.unpack_from(self._mm, self.HEADER.size + index * self._slot + self.key_width)
+        values = marshal.loads(self._mm[offset:offset + length])
+        return FileMetadata(self.file_id(index), *values)
+    
+    def stored_size(self, index: int) -> int:
+        return 0 if self.deleted[index] else self.file_size[index]
+    
+    def is_active(self, index: int, now: float) -> bool:
+        return not self.deleted[index] and self.expire_time[index] > now
+    
+    def count_active(self, now: float) -> int:
+        """未删除且未过期的记录数"""
+        return self.live_count - bisect.bisect_right(OrderedColumn(self.by_expire, self.expire_time), now)
+    
+    def first_active_expire(self, now: float, skip: set) -> Optional[int]:
+        """未过期的记录中（跳过skip中的序号）最早的过期时间"""
+        position = bisect.bisect_right(OrderedColumn(self.by_expire, self.expire_time), now)
+        for index in self.by_expire[position:]:
+            if index not in skip:
+                return self.expire_time[index]
+        return None
+    
+    def count_uploaded_since(self, since: float) -> int:
+        """上传时间不早于since的记录数（含已删除和已过期的）"""
+        return bisect.bisect_right(OrderedColumn(self.orders['upload_time'], self.upload_time, -1), -since)
+    
+    def search(self, term: str) -> set:
+        """小写文件名包含term的记录序号"""
+        needle = term.encode('utf-8')
+        matched = set()
+        if b'\0' in needle:
+            return matched
+        start = self._names_start
+        end = start + self._name_offsets[self.count]
+        position = self._mm.find(needle, start, end)
+        while position >= 0:
+            index = bisect.bisect_right(self._name_offsets, position - start) - 1
+            matched.add(index)
+            position = self._mm.find(needle, start + self._name_offsets[index + 1], end)
+        return matched
+
+
+class OrderedColumn:
+    """按记录序号表依次取列值的只读序列（sign为-1时取相反数，用于从大到小的序号表），供bisect二分查找"""
+    
+    def __init__(self, order: memoryview, column: memoryview, sign: int = 1):
+        self.order = order
+        self.column = column
+        self.sign = sign
+    
+    def __len__(self) -> int:
+        return len(self.order)
+    
+    def __getitem__(self, position: int) -> int:
+        return self.sign * self.column[self.order[position]]
+
+
+class LazyMetadataMap(MutableMapping):
+    """
+    以快照为底的元数据字典
+    查询单个文件时只二分查找并解码对应记录，解码或新增的对象缓存在内存中（之后的修改直接作用于缓存对象），
+    删除记为墓碑。文件列表、统计和清理直接读快照的列，只有被缓存或删除遮盖的记录以内存中的对象为准；
+    遍历（items/values）时未缓存的记录解码后不缓存，只能读取，修改要通过 map[file_id] 取得的对象。
+    未删除文件的总大小随写入、删除和缓存对象的修改实时累计
+    """
+    
+    def __init__(self, snapshot: Optional[MetadataSnapshot] = None):
+        self._snapshot = snapshot
+        self._cache: Dict[str, FileMetadata] = {}
+        self._removed: set = set()    # 已删除的快照内ID
+        self._new_keys: set = set()   # 快照之外新增的ID
+        self._shadowed: set = set()   # 已缓存或已删除的快照记录序号，查询时跳过这些记录的列
+        self._size_lock = threading.Lock()
+        self._stored_bytes = snapshot.live_bytes if snapshot is not None else 0
+    
+    def _snapshot_index(self, file_id: str) -> int:
+        if self._snapshot is None or file_id in self._removed:
+            return -1
+        return self._snapshot.find(file_id)
+    
+    def _adopt(self, metadata: FileMetadata):
+        object.__setattr__(metadata, '_owner', self)
+    
+    def apply_size_change(self, metadata: FileMetadata, name: str, value: Any):
+        """修改缓存对象的大小或删除标记，同时更新总大小"""
+        with self._size_lock:
+            before = metadata.stored_size()
+            object.__setattr__(metadata, name, value)
+            self._stored_bytes += metadata.stored_size() - before
+    
+    def __getitem__(self, file_id: str) -> FileMetadata:
+        metadata = self._cache.get(file_id)
+        if metadata is not None:
+            return metadata
+        index = self._snapshot_index(file_id)
+        if index < 0:
+            raise KeyError(file_id)
+        # 并发解码同一条记录时以先缓存的对象为准，避免修改落在被丢弃的对象上
+        record = self._snapshot.record(index)
+        self._adopt(record)
+        metadata = self._cache.setdefault(file_id, record)
+        self._shadowed.add(index)
+        return metadata
+    
+    def __setitem__(self, file_id: str, metadata: FileMetadata):
+        with self._size_lock:
+            previous = self._cache.get(file_id)
+            if previous is not None:
+                before = previous.stored_size()
+                if previous is not metadata:
+                    object.__setattr__(previous, '_owner', None)
+            else:
+                index = self._snapshot.find(file_id) if self._snapshot is not None else -1
+                if index >= 0:
+                    before = 0 if file_id in self._removed else self._snapshot.stored_size(index)
+                    self._removed.discard(file_id)
+                    self._shadowed.add(index)
+                else:
+                    before = 0
+                    self._new_keys.add(file_id)
+            self._adopt(metadata)
+            self._cache[file_id] = metadata
+            self._stored_bytes += metadata.stored_size() - before
+    
+    def __delitem__(self, file_id: str):
+        if file_id not in self:
+            raise KeyError(file_id)
+        with self._size_lock:
+            metadata = self._cache.pop(file_id, None)
+            if file_id in self._new_keys:
+                self._new_keys.discard(file_id)
+            else:
+                index = self._snapshot.find(file_id)
+                self._removed.add(file_id)
+                self._shadowed.add(index)
+                if metadata is None:
+                    self._stored_bytes -= self._snapshot.stored_size(index)
+            if metadata is not None:
+                object.__setattr__(metadata, '_owner', None)
+                self._stored_bytes -= metadata.stored_size()
+    
+    def __contains__(self, file_id) -> bool:
+        return file_id in self._cache or self._snapshot_index(file_id) >= 0
+    
+    def __len__(self) -> int:
+        base = len(self._snapshot) if self._snapshot is not None else 0
+        return base - len(self._removed) + len(self._new_keys)
+    
+    def __iter__(self):
+        if self._snapshot is not None:
+            for index in range(len(self._snapshot)):
+                file_id = self._snapshot.file_id(index)
+                if file_id not in self._removed:
+                    yield file_id
+        yield from list(self._new_keys)
+    
+    def items(self):
+        """按快照顺序遍历，未缓存的记录解码后直接返回（不缓存）"""
+        if self._snapshot is not None:
+            for index in range(len(self._snapshot)):
+                file_id = self._snapshot.file_id(index)
+                if file_id in self._removed:
+                    continue
+                metadata = self._cache.get(file_id)
+                if metadata is None:
+                    metadata = self._snapshot.record(index)
+                yield file_id, metadata
+        for file_id in list(self._new_keys):
+            metadata = self._cache.get(file_id)
+            if metadata is not None:
+                yield file_id, metadata
+    
+    def values(self):
+        for _, metadata in self.items():
+            yield metadata
+    
+    def clear(self):
+        with self._size_lock:
+            for metadata in self._cache.values():
+                object.__setattr__(metadata, '_owner', None)
+            self._snapshot = None
+            self._cache.clear()
+            self._removed.clear()
+            self._new_keys.clear()
+            self._shadowed.clear()
+            self._stored_bytes = 0
+    
+    def stored_bytes(self) -> int:
+        """未删除文件的总大小"""
+        return self._stored_bytes
+    
+    def _overlay(self) -> Tuple[List[Tuple[str, FileMetadata]], set]:
+        """内存中的对象，以及被它们（或删除墓碑）遮盖的快照记录序号"""
+        return list(self._cache.items()), set(self._shadowed)
+    
+    def count_active(self, now: float) -> int:
+        """未删除且未过期的文件数"""
+        cached, shadowed = self._overlay()
+        count = sum(1 for _, metadata in cached if not metadata.is_deleted and metadata.expire_time > now)
+        if self._snapshot is not None:
+            count += self._snapshot.count_active(now)
+            count -= sum(1 for index in shadowed if self._snapshot.is_active(index, now))
+        return count
+    
+    def first_active_expire(self, now: float) -> Optional[int]:
+        """未删除且未过期的文件中最早的过期时间，没有这样的文件时返回None"""
+        cached, shadowed = self._overlay()
+        expire_times = [metadata.expire_time for _, metadata in cached
+                        if not metadata.is_deleted and metadata.expire_time > now]
+        if self._snapshot is not None:
+            expire_time = self._snapshot.first_active_expire(now, shadowed)
+            if expire_time is not None:
+                expire_times.append(expire_time)
+        return min(expire_times, default=None)
+    
+    def count_uploaded_since(self, since: float) -> int:
+        """上传时间不早于since的文件数（含已删除和已过期的）"""
+        cached, shadowed = self._overlay()
+        count = sum(1 for _, metadata in cached if metadata.upload_time >= since)
+        if self._snapshot is not None:
+            count += self._snapshot.count_uploaded_since(since)
+            count -= sum(1 for index in shadowed if self._snapshot.upload_time[index] >= since)
+        return count
+    
+    def active_page(self, now: float, order: str, search: str, start: int,
+                    count: int) -> Tuple[List[Tuple[str, FileMetadata]], int]:
+        """
+        未删除且未过期、小写文件名包含search的文件按order排序（见 MetadataSnapshot.ORDERS，同值按文件ID）后
+        从第start个起的count个，以及符合条件的文件总数。快照记录按排好序的序号表顺序读列筛选，只解码当页的记录
+        """
+        def sort_key(metadata: FileMetadata):
+            if order == 'name':
+                return metadata.original_name
+            return -(metadata.file_size if order == 'size' else metadata.upload_time)
+        
+        cached, shadowed = self._overlay()
+        extra = sorted((sort_key(metadata), file_id, metadata) for file_id, metadata in cached
+                       if not metadata.is_deleted and metadata.expire_time > now
+                       and (not search or search in metadata.original_name.lower()))
+        snapshot = self._snapshot
+        if snapshot is None:
+            return [(file_id, metadata) for _, file_id, metadata in extra[start:start + count]], len(extra)
+        
+        matched = snapshot.search(search) if search else None
+        if matched is None:
+            total = snapshot.count_active(now) - sum(1 for index in shadowed if snapshot.is_active(index, now))
+        else:
+            total = sum(1 for index in matched if index not in shadowed and snapshot.is_active(index, now))
+        
+        def snapshot_rows():
+            for index in snapshot.orders[order]:
+                if index in shadowed or not snapshot.is_active(index, now):
+                    continue
+                if matched is not None and index not in matched:
+                    continue
+                yield index
+        
+        if not extra:
+            rows = [(snapshot.file_id(index), snapshot.record(index))
+                    for index in islice(snapshot_rows(), start, start + count)]
+            return rows, total
+        
+        column = snapshot.file_size if order == 'size' else snapshot.upload_time
+        
+        def keyed_rows():
+            # 与内存中的对象按 (排序值, 文件ID) 归并，和序号表的顺序一致
+            for index in snapshot_rows():
+                key = snapshot.record(index).original_name if order == 'name' else -column[index]
+                yield key, snapshot.file_id(index), index
+        
+        rows = []
+        for _, file_id, item in islice(heapq.merge(keyed_rows(), extra), start, start + count):
+            rows.append((file_id, snapshot.record(item) if isinstance(item, int) else item))
+        return rows, total + len(extra)
+    
+    def active_entries(self, now: float):
+        """依次给出未删除且未过期的文件 (file_id, 上传时间, 下载次数)，不解码快照记录"""
+        cached, shadowed = self._overlay()
+        snapshot = self._snapshot
+        if snapshot is not None:
+            for index in range(snapshot.count):
+                if index not in shadowed and snapshot.is_active(index, now):
+                    yield snapshot.file_id(index), snapshot.upload_time[index], snapshot.download_count[index]
+        for file_id, metadata in cached:
+            if not metadata.is_deleted and metadata.expire_time > now:
+                yield file_id, metadata.upload_time, metadata.download_count
+    
+    def download_counts(self):
+        """依次给出所有文件的 (file_id, 下载次数)，不解码快照记录"""
+        cached, shadowed = self._overlay()
+        snapshot = self._snapshot
+        if snapshot is not None:
+            for index in range(snapshot.count):
+                if index not in shadowed:
+                    yield snapshot.file_id(index), snapshot.download_count[index]
+        for file_id, metadata in cached:
+            yield file_id, metadata.download_count
+    
+    def by_expire_time(self):
+        """按过期时间从早到晚（同值按文件ID）依次给出未删除的文件 (过期时间, file_id, 文件大小)"""
+        cached, shadowed = self._overlay()
+        extra = sorted((metadata.expire_time, file_id, metadata.file_size) for file_id, metadata in cached
+                       if not metadata.is_deleted)
+        snapshot = self._snapshot
+        if snapshot is None:
+            return iter(extra)
+        rows = ((snapshot.expire_time[index], snapshot.file_id(index), snapshot.file_size[index])
+                for index in snapshot.by_expire if index not in shadowed)
+        return heapq.merge(rows, extra)
+
+
+class SpaceReservations:
+    """
+    存储空间预留账本
+    每个预留是 reservations/ 目录下的一个小文件，内容为“预留总字节 待写入字节”，
+    文件修改时间作为心跳，多个gunicorn工作进程共享同一份账本
+    """
+    
+    def __init__(self, base_dir: Path, ttl: int):
+        self.base_dir = base_dir
+        self.ttl = ttl
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        self._thread_lock = threading.Lock()
+        self._lock_file = self.base_dir / '.lock'
+    
+    @contextmanager
+    def locked(self):
+        """进程内和跨进程互斥，保证检查与预留是原子的"""
+        with self._thread_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self._lock_file, 'a') as lock_fp:
+                fcntl.flock(lock_fp, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_fp, fcntl.LOCK_UN)
+    
+    def _path(self, key: str) -> Path:
+        return self.base_dir / secure_filename(key)
+    
+    def totals(self, exclude: Optional[str] = None) -> Tuple[int, int]:
+        """返回未过期预留的 (预留总字节, 待写入字节)，顺带清理超时预留"""
+        reserved = 0
+        outstanding = 0
+        now = time.time()
+        exclude_name = secure_filename(exclude) if exclude else None
+        with os.scandir(self.base_dir) as entries:
+            for entry in entries:
+                if entry.name.startswith('.') or entry.name == exclude_name:
+                    continue
+                try:
+                    if now - entry.stat().st_mtime > self.ttl:
+                        os.unlink(entry.path)
+                        continue
+                    with open(entry.path, 'r') as f:
+                        total_bytes, pending_bytes = (int(v) for v in f.read().split())
+                    reserved += total_bytes
+                    outstanding += pending_bytes
+                except (OSError, ValueError):
+                    continue
+        return reserved, outstanding
+    
+    def put(self, key: str, total_bytes: int, pending_bytes: int):
+        """写入或更新预留，同时刷新心跳（临时文件以点开头且名字唯一，统计时跳过，并发更新互不覆盖）"""
+        tmp_path = self.base_dir / f".{secure_filename(key)}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(f"{total_bytes} {max(pending_bytes, 0)}")
+        os.replace(tmp_path, self._path(key))
+    
+    def get(self, key: str) -> Optional[Tuple[int, int]]:
+        try:
+            with open(self._path(key), 'r') as f:
+                total_bytes, pending_bytes = (int(v) for v in f.read().split())
+            return total_bytes, pending_bytes
+        except (OSError, ValueError):
+            return None
+    
+    def release(self, key: str):
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            pass
+    
+    def clear(self):
+        """清空所有预留"""
+        with os.scandir(self.base_dir) as entries:
+            for entry in entries:
+                if not entry.name.startswith('.'):
+                    try:
+                        os.unlink(entry.path)
+                    except FileNotFoundError:
+                        pass
+
+
+class RateLimiter:
+    """
+    令牌桶限流器
+    状态保存在SQLite（WAL模式）中，所有gunicorn工作进程共享同一份令牌桶，
+    每次检查是一个写事务，保证多进程并发下也不会超发令牌
+    """
+    
+    def __init__(self, db_path: Path, lease_timeout: int = 600):
+        self.db_path = db_path
+        self.lease_timeout = lease_timeout
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_path), timeout=1.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS inflight (lease TEXT PRIMARY KEY, key TEXT, started REAL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_inflight_key ON inflight (key)')
+    
+    def acquire(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        """
+        从令牌桶中扣除cost个令牌，允许时返回0，否则返回建议的重试等待秒数
+        cost大于桶容量时（例如大文件的字节数）只要桶是满的就放行并记为欠账，
+        欠账还清前该客户端的后续请求都会被拒绝，长期速率仍严格受限
+        """
+        if rate <= 0:
+            return 0.0
+        now = time.time()
+        with self._lock:
+            try:
+                self._conn.execute('BEGIN IMMEDIATE')
+                row = self._conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+                tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+                
+                required = min(cost, burst)
+                if tokens < required:
+                    self._conn.execute('ROLLBACK')
+                    return (required - tokens) / rate
+                
+                self._conn.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                                   (key, tokens - cost, now))
+                self._conn.execute('COMMIT')
+                return 0.0
+            except sqlite3.Error as e:
+                # 限流存储异常时放行，避免影响正常服务
+                try:
+                    self._conn.execute('ROLLBACK')
+                except sqlite3.Error:
+                    pass
+                logger.warning(f"限流检查失败: {e}")
+                return 0.0
+    
+    def enter(self, key: str, limit: int) -> Optional[str]:
+        """登记一个并发请求，超过上限时返回None"""
+        lease = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            try:
+                self._conn.execute('BEGIN IMMEDIATE')
+                # 工作进程被杀死时遗留的租约按超时回收
+                self._conn.execute('DELETE FROM inflight WHERE started < ?', (now - self.lease_timeout,))
+                count = self._conn.execute('SELECT COUNT(*) FROM inflight WHERE key = ?', (key,)).fetchone()[0]
+                if count >= limit:
+                    self._conn.execute('ROLLBACK')
+                    return None
+                self._conn.execute('INSERT INTO inflight (lease, key, started) VALUES (?, ?, ?)', (lease, key, now))
+                self._conn.execute('COMMIT')
+                return lease
+            except sqlite3.Error as e:
+                try:
+                    self._conn.execute('ROLLBACK')
+                except sqlite3.Error:
+                    pass
+                logger.warning(f"并发登记失败: {e}")
+                return ''
+    
+    def leave(self, lease: Optional[str]):
+        """释放并发登记"""
+        if not lease:
+            return
+        with self._lock:
+            try:
+                self._conn.execute('DELETE FROM inflight WHERE lease = ?', (lease,))
+            except sqlite3.Error as e:
+                logger.warning(f"释放并发登记失败: {e}")
+    
+    def purge(self, idle_seconds: int = 3600):
+        """清理长时间未使用的令牌桶"""
+        with self._lock:
+            try:
+                self._conn.execute('DELETE FROM buckets WHERE updated < ?', (time.time() - idle_seconds,))
+            except sqlite3.Error as e:
+                logger.warning(f"清理限流状态失败: {e}")
+
+
+class LogReader:
+    """
+    日志尾部读取器
+    从文件末尾按块向前读取，查询代价只与返回的结果数有关，与日志文件大小无关；
+    WARNING及以上的低频级别额外维护一份行偏移索引，可以直接跳到匹配行
+    日志行格式: 2025-12-01 14:53:07,691 - INFO - 消息
+    """
+    
+    BLOCK_SIZE = 64 * 1024
+    INDEXED_LEVELS = ('WARNING', 'ERROR', 'CRITICAL')
+    
+    def __init__(self, log_path: str):
+        self.log_path = log_path
+        self._lock = threading.Lock()
+        self._index_size = 0
+        self._index_head = b''
+        self._index: Dict[str, List[int]] = {level: [] for level in self.INDEXED_LEVELS}
+    
+    @staticmethod
+    def _parse_level(line: bytes) -> Optional[str]:
+        """解析日志行的级别，格式不符时返回None"""
+        # 时间戳固定23个字节，随后是 " - LEVEL - "
+        if len(line) < 27 or line[23:26] != b' - ':
+            return None
+        end = line.find(b' - ', 26)
+        if end < 0:
+            return None
+        return line[26:end].decode('ascii', 'replace')
+    
+    def _refresh_index(self):
+        """增量更新级别索引，日志文件被清空后重建"""
+        with open(self.log_path, 'rb') as f:
+            head = f.read(64)
+            size = os.fstat(f.fileno()).st_size
+            if size < self._index_size or not head.startswith(self._index_head):
+                self._index_size = 0
+                self._index = {level: [] for level in self.INDEXED_LEVELS}
+            self._index_head = head
+            
+            f.seek(self._index_size)
+            offset = self._index_size
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # 最后一行可能还没写完，下次再索引
+                    break
+                level = self._parse_level(line)
+                if level in self._index:
+                    self._index[level].append(offset)
+                offset += len(line)
+            self._index_size = offset
+    
+    def _iter_reverse(self, f, end: int):
+        """从end位置向前逐行读取，返回(行起始偏移, 行内容)"""
+        pos = end
+        tail = b''
+        while pos > 0:
+            read_size = min(self.BLOCK_SIZE, pos)
+            pos -= read_size
+            f.seek(pos)
+            buf = f.read(read_size) + tail
+            lines = buf.split(b'\n')
+            # 第一段可能是不完整的行，留到下一块一起处理
+            tail = lines[0]
+            starts = []
+            offset = pos + len(tail) + 1
+            for line in lines[1:]:
+                starts.append(offset)
+                offset += len(line) + 1
+            for i in range(len(lines) - 1, 0, -1):
+                if lines[i]:
+                    yield starts[i - 1], lines[i]
+        if tail:
+            yield 0, tail
+    
+    def _iter_indexed(self, f, level: str, end: int):
+        """借助级别索引逐行读取指定级别的日志"""
+        offsets = self._index[level]
+        idx = bisect.bisect_left(offsets, end)
+        for i in range(idx - 1, -1, -1):
+            f.seek(offsets[i])
+            yield offsets[i], f.readline().rstrip(b'\n')
+    
+    def query(self, level: Optional[str] = None, keyword: Optional[str] = None,
+              since: Optional[str] = None, until: Optional[str] = None,
+              cursor: Optional[int] = None, limit: int = 100) -> Tuple[List[str], Optional[int]]:
+        """
+        查询日志，按时间倒序返回 (日志行列表, 下一页游标)
+        since/until 为 'YYYY-MM-DD HH:MM:SS' 格式的时间字符串，cursor 为上一页返回的游标
+        """
+        if not Path(self.log_path).exists():
+            return [], None
+        
+        keyword_bytes = keyword.encode('utf-8') if keyword else None
+        since_bytes = since.encode('ascii') if since else None
+        until_bytes = until.encode('ascii') if until else None
+        
+        with self._lock:
+            use_index = level in self.INDEXED_LEVELS
+            if use_index:
+                self._refresh_index()
+            
+            with open(self.log_path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                end = size if cursor is None or cursor > size else cursor
+                if use_index:
+                    end = min(end, self._index_size)
+                lines = self._iter_indexed(f, level, end) if use_index else self._iter_reverse(f, end)
+                
+                logs = []
+                for offset, line in lines:
+                    line_level = self._parse_level(line)
+                    if line_level is not None:
+                        timestamp = line[:19]
+                        if until_bytes and timestamp > until_bytes:
+                            continue
+                        if since_bytes and timestamp < since_bytes:
+                            # 日志按时间顺序写入，更早的行都不满足条件
+                            return logs, None
+                    if level and line_level != level:
+                        continue
+                    if keyword_bytes and keyword_bytes not in line:
+                        continue
+                    
+                    logs.append(line.decode('utf-8', 'replace').strip())
+                    if len(logs) >= limit:
+                        return logs, (offset if offset > 0 else None)
+                
+                return logs, None
+
+
+class MetricsRegistry:
+    """
+    多进程指标收集器（Prometheus文本格式）
+    每个工作进程在内存中累加指标，由后台线程每秒写入 metrics/<pid>.json；
+    /metrics 请求时合并所有进程的快照：计数器和直方图求和，仪表盘只统计仍存活的进程，
+    已退出进程（gunicorn按max_requests回收）的计数器会并入 archive.json 后删除其快照
+    """
+    
+    # 指标名: (类型, 说明)
+    METRICS = {
+        'jackdisk_http_requests_total': ('counter', '按路由、方法和状态码统计的请求数'),
+        'jackdisk_http_request_duration_seconds': ('histogram', '按路由统计的请求处理耗时'),
+        'jackdisk_http_received_bytes_total': ('counter', '按路由统计的请求体字节数'),
+        'jackdisk_http_sent_bytes_total': ('counter', '按路由统计的响应体字节数'),
+        'jackdisk_uploads_in_flight': ('gauge', '正在处理的上传请求数'),
+        'jackdisk_chunked_uploads_active': ('gauge', '未完成的分片上传任务数'),
+        'jackdisk_chunks_total': ('counter', '接收的分片数'),
+        'jackdisk_chunk_bytes_total': ('counter', '接收的分片字节数'),
+        'jackdisk_chunk_checksum_failures_total': ('counter', '按阶段（单个分片/整体Merkle树根）统计的校验失败次数'),
+        'jackdisk_task_duration_seconds': ('histogram', '后台任务和存储检查耗时'),
+        'jackdisk_evicted_files_total': ('counter', '按原因统计的清理文件数'),
+        'jackdisk_metadata_persist_duration_seconds': ('histogram', '元数据持久化耗时'),
+        'jackdisk_response_cache_total': ('counter', '按路由和结果（hit/miss）统计的JSON响应缓存查询数'),
+        'jackdisk_tier_moves_total': ('counter', '按方向（demote降冷/promote提升）统计的冷热分层迁移文件数'),
+        'jackdisk_tier_moved_bytes_total': ('counter', '按方向统计的冷热分层迁移字节数'),
+        'jackdisk_pack_reclaimed_bytes_total': ('counter', '压缩打包段回收的磁盘字节数'),
+    }
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+    
+    def __init__(self, metrics_dir: Path, flush_interval: float = 1.0):
+        self.metrics_dir = metrics_dir
+        self.metrics_dir.mkdir(parents=True, exist_ok=True)
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()  # 后台线程和/metrics请求线程可能同时写快照
+        self._values: Dict[str, Dict[str, Any]] = {}
+        self._dirty = False
+        self._flusher_pid = None
+    
+    @staticmethod
+    def _label_key(labels: Dict[str, Any]) -> str:
+        return json.dumps(sorted((k, str(v)) for k, v in labels.items()), ensure_ascii=False)
+    
+    def _ensure_flusher(self):
+        """按进程启动后台写快照线程；fork出的子进程会丢弃父进程的内存计数"""
+        pid = os.getpid()
+        if self._flusher_pid == pid:
+            return
+        with self._lock:
+            if self._flusher_pid == pid:
+                return
+            if self._flusher_pid is not None:
+                self._values = {}
+            self._flusher_pid = pid
+            self._archive_pid_file(pid)
+        threading.Thread(target=self._flush_loop, name='metrics-flusher', daemon=True).start()
+    
+    def inc(self, name: str, value: float = 1.0, **labels):
+        self._ensure_flusher()
+        key = self._label_key(labels)
+        with self._lock:
+            series = self._values.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+            self._dirty = True
+    
+    def set_gauge(self, name: str, value: float, **labels):
+        self._ensure_flusher()
+        key = self._label_key(labels)
+        with self._lock:
+            self._values.setdefault(name, {})[key] = value
+            self._dirty = True
+    
+    def observe(self, name: str, value: float, **labels):
+        """记录直方图观测值，存储为 [各桶计数..., 总和, 总数]"""
+        self._ensure_flusher()
+        key = self._label_key(labels)
+        with self._lock:
+            series = self._values.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = [0] * len(self.BUCKETS) + [0.0, 0]
+            idx = bisect.bisect_left(self.BUCKETS, value)
+            if idx < len(self.BUCKETS):
+                hist[idx] += 1
+            hist[-2] += value
+            hist[-1] += 1
+            self._dirty = True
+    
+    @contextmanager
+    def time(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+    
+    def _flush_loop(self):
+        pid = os.getpid()
+        while self._flusher_pid == pid:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"写入指标快照失败: {e}")
+    
+    def flush(self):
+        """把本进程的指标写入快照文件（取值和替换在写锁内完成，较旧的快照不会覆盖较新的）"""
+        with self._write_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                data = json.dumps(self._values, ensure_ascii=False)
+                self._dirty = False
+            pid = os.getpid()
+            path = self.metrics_dir / f"{pid}.json"
+            tmp_path = self.metrics_dir / f"{pid}.{uuid.uuid4().hex}.tmp"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError:
+                with self._lock:
+                    self._dirty = True
+                tmp_path.unlink(missing_ok=True)
+                raise
+    
+    @contextmanager
+    def _dir_locked(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self.metrics_dir / '.lock', 'a') as lock_fp:
+            fcntl.flock(lock_fp, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_fp, fcntl.LOCK_UN)
+    
+    def _merge(self, target: Dict[str, Dict[str, Any]], source: Dict[str, Dict[str, Any]], include_gauges: bool):
+        for name, series in source.items():
+            kind = self.METRICS.get(name, ('counter', ''))[0]
+            if kind == 'gauge' and not include_gauges:
+                continue
+            merged = target.setdefault(name, {})
+            for key, value in series.items():
+                if kind == 'histogram':
+                    current = merged.get(key)
+                    merged[key] = value[:] if current is None else [a + b for a, b in zip(current, value)]
+                else:
+                    merged[key] = merged.get(key, 0.0) + value
+    
+    @staticmethod
+    def _read_json(path: Path) -> Dict[str, Any]:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    @staticmethod
+    def _pid_alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+            return True
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+    
+    def _archive_pid_file(self, pid: int):
+        """把指定进程的快照并入归档（进程已退出或pid被复用时调用）"""
+        path = self.metrics_dir / f"{pid}.json"
+        if not path.exists():
+            return
+        with self._dir_locked():
+            if not path.exists():
+                return
+            archive_path = self.metrics_dir / 'archive.json'
+            archive = self._read_json(archive_path)
+            self._merge(archive, self._read_json(path), include_gauges=False)
+            tmp_path = self.metrics_dir / f"archive.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(archive, f, ensure_ascii=False)
+            os.replace(tmp_path, archive_path)
+            path.unlink()
+    
+    def collect(self) -> Dict[str, Dict[str, Any]]:
+        """合并所有进程的指标"""
+        self.flush()
+        merged: Dict[str, Dict[str, Any]] = {}
+        for path in self.metrics_dir.glob('*.json'):
+            if path.stem == 'archive':
+                continue
+            try:
+                pid = int(path.stem)
+            except ValueError:
+                continue
+            if pid != os.getpid() and not self._pid_alive(pid):
+                self._archive_pid_file(pid)
+                continue
+            self._merge(merged, self._read_json(path), include_gauges=True)
+        self._merge(merged, self._read_json(self.metrics_dir / 'archive.json'), include_gauges=False)
+        return merged
+    
+    @staticmethod
+    def _format_labels(pairs) -> str:
+        if not pairs:
+            return ''
+        escaped = []
+        for k, v in pairs:
+            v = str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            escaped.append(f'{k}="{v}"')
+        return '{' + ','.join(escaped) + '}'
+    
+    def render(self, extra_gauges: Optional[Dict[str, float]] = None) -> str:
+        """输出Prometheus文本格式"""
+        merged = self.collect()
+        for name, value in (extra_gauges or {}).items():
+            merged.setdefault(name, {})[self._label_key({})] = value
+        
+        lines = []
+        for name in sorted(merged):
+            kind, help_text = self.METRICS.get(name, ('untyped', ''))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key in sorted(merged[name]):
+                pairs = [tuple(p) for p in json.loads(key)]
+                value = merged[name][key]
+                if kind == 'histogram':
+                    cumulative = 0
+                    for bound, count in zip(self.BUCKETS, value[:len(self.BUCKETS)]):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{self._format_labels(pairs + [('le', bound)])} {cumulative}")
+                    lines.append(f"{name}_bucket{self._format_labels(pairs + [('le', '+Inf')])} {value[-1]}")
+                    lines.append(f"{name}_sum{self._format_labels(pairs)} {value[-2]}")
+                    lines.append(f"{name}_count{self._format_labels(pairs)} {value[-1]}")
+                else:
+                    lines.append(f"{name}{self._format_labels(pairs)} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+def _timed_task(task: str):
+    """记录JackDisk方法耗时到 jackdisk_task_duration_seconds"""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return f(self, *args, **kwargs)
+            finally:
+                self.metrics.observe('jackdisk_task_duration_seconds', time.perf_counter() - start, task=task)
+        return wrapper
+    return decorator
+
+
+class RequestProfiler:
+    """
+    按需采样的请求性能分析器（管理员开启）
+    设置保存在 profiles/settings.json，各工作进程最多每秒检查一次修改时间；
+    采样到的cProfile结果按路由在进程内累加，并写入 profiles/<路由键>.<pid>.prof，
+    下载时合并所有进程的同一路由；文件总数超过上限时删除最旧的，相当于磁盘上的环形缓冲区
+    """
+    
+    def __init__(self, profile_dir: Path, max_profiles: int = 20):
+        self.profile_dir = profile_dir
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        self.max_profiles = max_profiles
+        self.settings_file = self.profile_dir / 'settings.json'
+        self.settings = {'enabled': False, 'sample_rate': 0.0, 'route': ''}
+        self._settings_mtime = None
+        self._settings_checked = 0.0
+        self._aggregates: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def route_key(route: str) -> str:
+        return hashlib.md5(route.encode('utf-8')).hexdigest()[:12]
+    
+    def _refresh_settings(self):
+        now = time.time()
+        if now - self._settings_checked < 1.0:
+            return
+        self._settings_checked = now
+        try:
+            mtime = self.settings_file.stat().st_mtime
+        except FileNotFoundError:
+            return
+        if mtime != self._settings_mtime:
+            try:
+                with open(self.settings_file, 'r', encoding='utf-8') as f:
+                    self.settings = json.load(f)
+                self._settings_mtime = mtime
+            except (OSError, ValueError):
+                pass
+    
+    def update_settings(self, enabled: bool, sample_rate: float, route: str):
+        self.settings = {'enabled': enabled, 'sample_rate': sample_rate, 'route': route}
+        tmp_path = self.profile_dir / f"settings.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.settings, f, ensure_ascii=False)
+        os.replace(tmp_path, self.settings_file)
+        self._settings_checked = 0.0
+    
+    def should_sample(self, route: str) -> bool:
+        """判断本次请求是否采样：指定路由全部采样，否则按百分比随机采样"""
+        self._refresh_settings()
+        if not self.settings.get('enabled'):
+            return False
+        target = self.settings.get('route')
+        if target:
+            return route == target
+        return random.random() * 100 < float(self.settings.get('sample_rate', 0))
+    
+    def record(self, route: str, profile: cProfile.Profile, duration: float):
+        """
+        把一次采样结果累加到该路由的汇总中并写盘（写临时文件后原子替换，其他进程不会读到写了一半的文件）；
+        只有本进程第一次写某个路由、文件数可能增加时才检查是否超过上限
+        """
+        with self._lock:
+            aggregate = self._aggregates.get(route)
+            created = aggregate is None
+            if created:
+                aggregate = {'stats': pstats.Stats(profile), 'samples': 0, 'total_time': 0.0}
+                self._aggregates[route] = aggregate
+            else:
+                aggregate['stats'].add(profile)
+            aggregate['samples'] += 1
+            aggregate['total_time'] += duration
+            
+            base = f"{self.route_key(route)}.{os.getpid()}"
+            self._write_atomic(self.profile_dir / f"{base}.prof", marshal.dumps(aggregate['stats'].stats))
+            self._write_atomic(self.profile_dir / f"{base}.json", json.dumps(
+                {'route': route, 'samples': aggregate['samples'],
+                 'total_time': aggregate['total_time'], 'updated': int(time.time())}, ensure_ascii=False
+            ).encode('utf-8'))
+        if created:
+            self._prune()
+    
+    def _write_atomic(self, path: Path, data: bytes):
+        tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    
+    def _prune(self):
+        """只保留最近更新的若干份性能分析结果"""
+        files = sorted(self.profile_dir.glob('*.prof'), key=lambda p: p.stat().st_mtime, reverse=True)
+        for path in files[self.max_profiles:]:
+            path.unlink(missing_ok=True)
+            path.with_suffix('.json').unlink(missing_ok=True)
+    
+    def list_profiles(self) -> List[Dict[str, Any]]:
+        """按路由汇总所有进程的采样信息"""
+        summary: Dict[str, Dict[str, Any]] = {}
+        for meta_path in self.profile_dir.glob('*.*.json'):
+            try:
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            item = summary.setdefault(meta['route'], {
+                'route': meta['route'], 'key': self.route_key(meta['route']),
+                'samples': 0, 'total_time': 0.0, 'updated': 0, 'workers': 0
+            })
+            item['samples'] += meta['samples']
+            item['total_time'] += meta['total_time']
+            item['updated'] = max(item['updated'], meta['updated'])
+            item['workers'] += 1
+        for item in summary.values():
+            item['avg_time_ms'] = round(item['total_time'] / item['samples'] * 1000, 2) if item['samples'] else 0
+        return sorted(summary.values(), key=lambda x: x['updated'], reverse=True)
+    
+    def load(self, key: str) -> Optional[pstats.Stats]:
+        """合并所有进程中同一路由的性能分析结果"""
+        files = [str(p) for p in self.profile_dir.glob(f"{secure_filename(key)}.*.prof")]
+        if not files:
+            return None
+        return pstats.Stats(*files)
+    
+    def clear(self):
+        with self._lock:
+            self._aggregates.clear()
+            for path in list(self.profile_dir.glob('*.prof')) + list(self.profile_dir.glob('*.*.json')):
+                path.unlink(missing_ok=True)
+
+
+class CounterStore:
+    """
+    下载计数和统计信息的延迟批量持久化（write-behind）
+    下载等热点路径只在进程内存中累加增量，后台线程每隔几秒把增量作为一个批次写入SQLite；
+    每个批次带唯一ID，和计数更新在同一个事务中登记，失败重试时不会重复累加（恰好一次）。
+    写入后按序号增量读回其他进程的变更，各工作进程看到的计数最终一致
+    """
+    
+    def __init__(self, db_path: Path, flush_interval: float = 5.0):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.on_sync = None  # 回调: on_sync(file_counts: Dict[str, int], stats: Dict[str, int])
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._pending_files: Dict[str, int] = {}
+        self._pending_stats: Dict[str, int] = {}
+        self._inflight: Optional[Tuple[str, Dict[str, int], Dict[str, int]]] = None
+        self._durable_stats: Dict[str, int] = {}
+        self._last_seq = 0
+        self._flusher_pid = None
+        self._conn = sqlite3.connect(str(db_path), timeout=5.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS batches (seq INTEGER PRIMARY KEY AUTOINCREMENT, batch_id TEXT UNIQUE, applied REAL)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS download_counts (file_id TEXT PRIMARY KEY, count INTEGER, seq INTEGER)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_download_counts_seq ON download_counts (seq)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS stats (key TEXT PRIMARY KEY, value INTEGER)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+    
+    def _ensure_flusher(self):
+        """按进程启动后台刷新线程；fork出的子进程丢弃父进程未刷新的增量"""
+        pid = os.getpid()
+        if self._flusher_pid == pid:
+            return
+        with self._lock:
+            if self._flusher_pid == pid:
+                return
+            if self._flusher_pid is not None:
+                self._pending_files = {}
+                self._pending_stats = {}
+                self._inflight = None
+            self._flusher_pid = pid
+        threading.Thread(target=self._flush_loop, name='counter-flusher', daemon=True).start()
+    
+    def incr(self, file_id: Optional[str] = None, stat: Optional[str] = None, n: int = 1):
+        """累加增量（只操作内存）"""
+        self._ensure_flusher()
+        with self._lock:
+            if file_id is not None:
+                self._pending_files[file_id] = self._pending_files.get(file_id, 0) + n
+            if stat is not None:
+                self._pending_stats[stat] = self._pending_stats.get(stat, 0) + n
+    
+    def pending_for(self, file_id: str) -> int:
+        """本进程尚未持久化的下载增量"""
+        with self._lock:
+            pending = self._pending_files.get(file_id, 0)
+            if self._inflight is not None:
+                pending += self._inflight[1].get(file_id, 0)
+            return pending
+    
+    def stat(self, key: str) -> int:
+        """统计值 = 已持久化的值 + 本进程未持久化的增量"""
+        with self._lock:
+            value = self._durable_stats.get(key, 0) + self._pending_stats.get(key, 0)
+            if self._inflight is not None:
+                value += self._inflight[2].get(key, 0)
+            return value
+    
+    def _flush_loop(self):
+        pid = os.getpid()
+        while self._flusher_pid == pid:
+            time.sleep(self.flush_interval)
+            self.flush()
+    
+    def flush(self):
+        """把增量作为一个批次写入，然后读回变更"""
+        with self._lock:
+            if self._inflight is None and (self._pending_files or self._pending_stats):
+                self._inflight = (f"{os.getpid()}-{uuid.uuid4().hex}", self._pending_files, self._pending_stats)
+                self._pending_files = {}
+                self._pending_stats = {}
+            batch = self._inflight
+        
+        with self._db_lock:
+            if batch is not None:
+                batch_id, file_deltas, stat_deltas = batch
+                try:
+                    self._conn.execute('BEGIN IMMEDIATE')
+                    applied = self._conn.execute('SELECT seq FROM batches WHERE batch_id = ?', (batch_id,)).fetchone()
+                    if applied is None:
+                        seq = self._conn.execute('INSERT INTO batches (batch_id, applied) VALUES (?, ?)',
+                                                 (batch_id, time.time())).lastrowid
+                        self._conn.executemany(
+                            'INSERT INTO download_counts (file_id, count, seq) VALUES (?, ?, ?) '
+                            'ON CONFLICT(file_id) DO UPDATE SET count = count + excluded.count, seq = excluded.seq',
+                            [(file_id, delta, seq) for file_id, delta in file_deltas.items()]
+                        )
+                        self._conn.executemany(
+                            'INSERT INTO stats (key, value) VALUES (?, ?) '
+                            'ON CONFLICT(key) DO UPDATE SET value = value + excluded.value',
+                            list(stat_deltas.items())
+                        )
+                    self._conn.execute('COMMIT')
+                    with self._lock:
+                        self._inflight = None
+                except sqlite3.Error as e:
+                    # 保留这个批次，下次用同一个批次ID重试
+                    try:
+                        self._conn.execute('ROLLBACK')
+                    except sqlite3.Error:
+                        pass
+                    logger.warning(f"持久化计数失败: {e}")
+                    return
+            
+            self._sync()
+    
+    def _sync(self):
+        """读回上次同步之后变化的计数"""
+        try:
+            rows = self._conn.execute(
+                'SELECT file_id, count, seq FROM download_counts WHERE seq > ?', (self._last_seq,)
+            ).fetchall()
+            stats = dict(self._conn.execute('SELECT key, value FROM stats').fetchall())
+        except sqlite3.Error as e:
+            logger.warning(f"读取计数失败: {e}")
+            return
+        
+        file_counts = {}
+        for file_id, count, seq in rows:
+            file_counts[file_id] = count
+            self._last_seq = max(self._last_seq, seq)
+        with self._lock:
+            self._durable_stats = stats
+        if self.on_sync is not None:
+            self.on_sync(file_counts, stats)
+    
+    def seed_downloads(self, counts: Iterable[Tuple[str, int]]):
+        """
+        计数库新建时（首次部署或库文件丢失），用元数据中已有的下载计数打底，否则第一次累加会从0开始，
+        覆盖掉metadata.json中的计数。只执行一次（meta表记录标记），之后启动不再遍历元数据
+        """
+        with self._db_lock:
+            try:
+                self._conn.execute('BEGIN IMMEDIATE')
+                if self._conn.execute("SELECT 1 FROM meta WHERE key = 'downloads_seeded'").fetchone() is None:
+                    self._conn.executemany(
+                        'INSERT OR IGNORE INTO download_counts (file_id, count, seq) VALUES (?, ?, 0)',
+                        ((file_id, count) for file_id, count in counts if count)
+                    )
+                    self._conn.execute("INSERT INTO meta (key, value) VALUES ('downloads_seeded', ?)", (str(int(time.time())),))
+                self._conn.execute('COMMIT')
+            except sqlite3.Error as e:
+                try:
+                    self._conn.execute('ROLLBACK')
+                except sqlite3.Error:
+                    pass
+                logger.warning(f"初始化下载计数失败: {e}")
+    
+    def reset_downloads(self):
+        """清空所有下载计数（清空全部文件时调用）"""
+        with self._lock:
+            self._pending_files = {}
+            if self._inflight is not None:
+                self._inflight = (self._inflight[0], {}, self._inflight[2])
+        with self._db_lock:
+            try:
+                self._conn.execute('DELETE FROM download_counts')
+            except sqlite3.Error as e:
+                logger.warning(f"清空下载计数失败: {e}")
+    
+    def prune_batches(self, max_age: int = 86400):
+        """清理过旧的批次登记（重试只会发生在几秒内）"""
+        with self._db_lock:
+            try:
+                self._conn.execute('DELETE FROM batches WHERE applied < ?', (time.time() - max_age,))
+            except sqlite3.Error as e:
+                logger.warning(f"清理批次登记失败: {e}")
+
+
+class SharedConfigStore:
+    """
+    跨工作进程共享的运行时配置
+    配置整体保存在 config.json（原子替换，重启后仍然生效），
+    另有一个8字节的 config.gen 文件映射到共享内存作为代数计数器：
+    每次修改配置后代数加一，各工作进程每个请求只比较内存中的代数，变化时才重新读取配置
+    """
+    
+    FIELDS = ('max_file_size', 'max_storage', 'file_expire_hours', 'max_files_per_upload', 'clean_interval')
+    
+    def __init__(self, base_dir: Path):
+        self.config_file = base_dir / 'config.json'
+        self.gen_file = base_dir / 'config.gen'
+        self._lock_file = base_dir / 'config.lock'
+        self._thread_lock = threading.Lock()
+        with open(self.gen_file, 'ab') as f:
+            if f.tell() < 8:
+                f.write(b'\0' * (8 - f.tell()))
+        with open(self.gen_file, 'r+b') as f:
+            self._mm = mmap.mmap(f.fileno(), 8)
+    
+    @contextmanager
+    def locked(self):
+        """进程内和跨进程互斥，保证读-合并-写是原子的"""
+        with self._thread_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self._lock_file, 'a') as lock_fp:
+                fcntl.flock(lock_fp, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_fp, fcntl.LOCK_UN)
+    
+    @property
+    def generation(self) -> int:
+        """当前配置代数（只读共享内存，不访问磁盘）"""
+        return struct.unpack_from('<Q', self._mm, 0)[0]
+    
+    def load(self) -> Optional[Dict[str, Any]]:
+        """读取已保存的配置，不存在时返回None"""
+        try:
+            with open(self.config_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        return {key: data[key] for key in self.FIELDS if key in data}
+    
+    def save(self, changes: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
+        """合并修改并保存，返回 (完整配置, 新代数)"""
+        with self.locked():
+            values = self.load() or {}
+            values.update({key: changes[key] for key in self.FIELDS if key in changes})
+            generation = self.generation + 1
+            tmp_path = self.config_file.parent / f"{self.config_file.name}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(dict(values, generation=generation), f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.config_file)
+            struct.pack_into('<Q', self._mm, 0, generation)
+        return values, generation
+
+
+class CleanupEngine:
+    """
+    后台删除引擎
+    待删除的文件和目录先原子重命名到 trash/ 目录（与上传目录同一文件系统，只改目录项），
+    再由后台线程用os.scandir遍历、通过有界线程池按预算（每秒文件数/字节数）限速删除。
+    trash/ 目录本身就是待办清单：进程中途重启后剩余内容会在下次启动时继续删除；
+    进度写入 cleanup_progress.json，所有工作进程都能查询，同一时刻只有一个进程在删除
+    """
+    
+    def __init__(self, trash_dir: Path, workers: int = 4, files_per_sec: float = 0, bytes_per_sec: float = 0):
+        self.trash_dir = trash_dir
+        self.trash_dir.mkdir(parents=True, exist_ok=True)
+        self.progress_file = trash_dir.parent / 'cleanup_progress.json'
+        self._lock_file = trash_dir.parent / 'cleanup.lock'
+        self.workers = max(1, workers)
+        self.files_per_sec = files_per_sec
+        self.bytes_per_sec = bytes_per_sec
+        self._thread_lock = threading.Lock()
+        self._sweeper: Optional[threading.Thread] = None
+        self._sweeper_pid = None
+        self._wake = threading.Event()
+        self._next_slot = 0.0
+        self._progress: Dict[str, Any] = {}
+        self._progress_saved = 0.0
+    
+    def discard(self, path: Path) -> bool:
+        """把文件或目录移入回收目录等待后台删除，路径不存在时返回False"""
+        target = self.trash_dir / f"{uuid.uuid4().hex}_{path.name}"
+        try:
+            os.replace(path, target)
+        except FileNotFoundError:
+            return False
+        self.kick()
+        return True
+    
+    def kick(self):
+        """确保本进程有后台删除线程在运行"""
+        with self._thread_lock:
+            if self._sweeper_pid == os.getpid() and self._sweeper is not None and self._sweeper.is_alive():
+                self._wake.set()
+                return
+            self._sweeper_pid = os.getpid()
+            self._wake = threading.Event()
+            self._sweeper = threading.Thread(target=self._sweep_loop, name='cleanup-engine', daemon=True)
+            self._sweeper.start()
+    
+    def status(self) -> Dict[str, Any]:
+        """当前（或最近一次）删除进度"""
+        try:
+            with open(self.progress_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'state': 'idle'}
+    
+    def _save_progress(self, force: bool = False):
+        now = time.time()
+        if not force and now - self._progress_saved < 1.0:
+            return
+        self._progress['updated'] = int(now)
+        tmp_path = self.progress_file.parent / f"{self.progress_file.name}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._progress, f)
+            os.replace(tmp_path, self.progress_file)
+            self._progress_saved = now
+        except OSError as e:
+            logger.warning(f"保存清理进度失败: {e}")
+    
+    def _throttle(self, nbytes: int):
+        """按文件数和字节数预算排队，预算用尽时等待"""
+        cost = 0.0
+        if self.files_per_sec > 0:
+            cost = 1.0 / self.files_per_sec
+        if self.bytes_per_sec > 0:
+            cost = max(cost, nbytes / self.bytes_per_sec)
+        if cost <= 0:
+            return
+        now = time.monotonic()
+        self._next_slot = max(self._next_slot, now) + cost
+        delay = self._next_slot - cost - now
+        if delay > 0:
+            time.sleep(delay)
+    
+    def _unlink(self, path: str, nbytes: int):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            logger.error(f"删除文件失败 {path}: {e}")
+            with self._thread_lock:
+                self._progress['errors'] += 1
+            return
+        with self._thread_lock:
+            self._progress['files_deleted'] += 1
+            self._progress['bytes_deleted'] += nbytes
+    
+    def _remove_tree(self, path: str, pool: ThreadPoolExecutor):
+        """后序遍历删除目录：本层文件并行删除完成后再删除子目录和自身"""
+        futures = []
+        subdirs = []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                        continue
+                    try:
+                        nbytes = entry.stat(follow_symlinks=False).st_size
+                    except FileNotFoundError:
+                        continue
+                    self._throttle(nbytes)
+                    futures.append(pool.submit(self._unlink, entry.path, nbytes))
+                    # 限制排队的删除任务数，避免一次性占用大量内存
+                    if len(futures) >= self.workers * 4:
+                        wait(futures)
+                        futures = []
+                        self._save_progress()
+        except FileNotFoundError:
+            return
+        wait(futures)
+        for subdir in subdirs:
+            self._remove_tree(subdir, pool)
+        try:
+            os.rmdir(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"删除目录失败 {path}: {e}")
+            with self._thread_lock:
+                self._progress['errors'] += 1
+        self._save_progress()
+    
+    @contextmanager
+    def _exclusive(self):
+        """
+        跨进程只允许一个删除线程；其他进程的删除线程等待持有者释放后自己再扫描一遍，
+        持有者扫描结束后、释放前才移入回收目录的内容也不会遗漏
+        """
+        if fcntl is None:
+            yield
+            return
+        with open(self._lock_file, 'a') as lock_fp:
+            fcntl.flock(lock_fp, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_fp, fcntl.LOCK_UN)
+    
+    def _sweep_loop(self):
+        while True:
+            self._sweep()
+            # 删除期间又有kick（扫描结束后才移入的内容）时再扫一遍，否则退出，之后的kick会启动新线程
+            with self._thread_lock:
+                if not self._wake.is_set():
+                    self._sweeper = None
+                    return
+                self._wake.clear()
+    
+    def _sweep(self):
+        with self._exclusive():
+            previous = self.status()
+            resumed = previous.get('state') == 'running'
+            if resumed:
+                # 上次删除中途退出，沿用之前的进度继续
+                self._progress = previous
+                self._progress['resumed'] = self._progress.get('resumed', 0) + 1
+            
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='cleanup') as pool:
+                while True:
+                    with os.scandir(self.trash_dir) as entries:
+                        pending = [(entry.path, entry.is_dir(follow_symlinks=False)) for entry in entries]
+                    if not pending:
+                        break
+                    if self._progress.get('state') != 'running':
+                        self._progress = {'state': 'running', 'started': int(time.time()), 'files_deleted': 0,
+                                          'bytes_deleted': 0, 'errors': 0, 'resumed': 0}
+                        logger.info(f"开始后台删除: {len(pending)} 项")
+                    self._progress['pending_entries'] = len(pending)
+                    self._save_progress(force=True)
+                    
+                    for path, is_dir in pending:
+                        if is_dir:
+                            self._remove_tree(path, pool)
+                        else:
+                            try:
+                                nbytes = os.stat(path).st_size
+                            except FileNotFoundError:
+                                continue
+                            self._throttle(nbytes)
+                            pool.submit(self._unlink, path, nbytes)
+                        self._progress['pending_entries'] -= 1
+                        self._save_progress()
+            
+            if self._progress.get('state') == 'running':
+                self._progress['state'] = 'idle'
+                self._progress['pending_entries'] = 0
+                self._save_progress(force=True)
+                logger.info(f"后台删除完成: {self._progress['files_deleted']} 个文件, "
+                            f"{self._progress['bytes_deleted']} bytes, {self._progress['errors']} 个错误")
+
+
+class EventBus:
+    """
+    实时事件推送（上传进度、新文件、删除、存储用量）
+    任意工作进程发布的事件追加写入共享的 events.log（加锁分配全局递增序号）；
+    每个有订阅者的工作进程只启动一个跟踪线程读取新增事件，放入内存环形缓冲区后一次性唤醒所有等待的连接，
+    因此同时打开的页面再多，每个进程每个事件也只读一次磁盘
+    """
+    
+    SEQ = struct.Struct('<Q')
+    
+    def __init__(self, base_dir: Path, history: int = 1000, max_journal: int = 4 * 1024 * 1024):
+        self.journal_file = base_dir / 'events.log'
+        self._lock_file = base_dir / 'events.lock'
+        self.max_journal = max_journal
+        self._write_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._events: deque = deque(maxlen=history)  # (序号, 类型, 数据)
+        self._tailer_pid = None
+        seq_file = base_dir / 'events.seq'
+        with open(seq_file, 'ab') as f:
+            if f.tell() < self.SEQ.size:
+                f.write(b'\0' * (self.SEQ.size - f.tell()))
+        with open(seq_file, 'r+b') as f:
+            self._seq = mmap.mmap(f.fileno(), self.SEQ.size)
+    
+    @contextmanager
+    def _locked(self):
+        with self._write_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self._lock_file, 'a') as lock_fp:
+                fcntl.flock(lock_fp, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_fp, fcntl.LOCK_UN)
+    
+    @property
+    def last_id(self) -> int:
+        return self.SEQ.unpack_from(self._seq, 0)[0]
+    
+    def publish(self, event_type: str, data: Dict[str, Any]):
+        """发布事件（失败只记录警告，不影响业务请求）"""
+        try:
+            with self._locked():
+                seq = self.last_id + 1
+                line = json.dumps({'id': seq, 'type': event_type, 'data': data}, ensure_ascii=False) + '\n'
+                if self.journal_file.exists() and self.journal_file.stat().st_size > self.max_journal:
+                    # 轮转：跟踪线程仍持有旧文件句柄，会先读完旧文件再切换
+                    os.replace(self.journal_file, self.journal_file.with_name('events.log.1'))
+                with open(self.journal_file, 'a', encoding='utf-8') as f:
+                    f.write(line)
+                self.SEQ.pack_into(self._seq, 0, seq)
+        except OSError as e:
+            logger.warning(f"发布事件失败: {e}")
+    
+    def _ensure_tailer(self):
+        pid = os.getpid()
+        if self._tailer_pid == pid:
+            return
+        with self._cond:
+            if self._tailer_pid == pid:
+                return
+            self._tailer_pid = pid
+            self._events.clear()
+        threading.Thread(target=self._tail_loop, name='event-tailer', daemon=True).start()
+    
+    def _tail_loop(self):
+        pid = os.getpid()
+        fp = None
+        inode = None
+        while self._tailer_pid == pid:
+            try:
+                if fp is None:
+                    fp = open(self.journal_file, 'r', encoding='utf-8')
+                    inode = os.fstat(fp.fileno()).st_ino
+                    # 启动时预读文件末尾的近期事件，便于断线重连的客户端补齐
+                    fp.seek(0, 2)
+                    fp.seek(max(0, fp.tell() - 64 * 1024))
+                    if fp.tell() > 0:
+                        fp.readline()
+                self._dispatch(fp.readlines())
+                if os.stat(self.journal_file).st_ino != inode:
+                    # 已轮转：旧文件读完后切换到新文件开头
+                    self._dispatch(fp.readlines())
+                    fp.close()
+                    fp = open(self.journal_file, 'r', encoding='utf-8')
+                    inode = os.fstat(fp.fileno()).st_ino
+                    continue
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"读取事件日志失败: {e}")
+            time.sleep(0.2)
+    
+    def _dispatch(self, lines: List[str]):
+        events = []
+        for line in lines:
+            try:
+                item = json.loads(line)
+                events.append((item['id'], item['type'], item['data']))
+            except (ValueError, KeyError):
+                continue
+        if events:
+            with self._cond:
+                self._events.extend(events)
+                self._cond.notify_all()
+    
+    def wait(self, since: Optional[int], timeout: float) -> Tuple[List[Tuple[int, str, Any]], int]:
+        """
+        等待序号大于since的事件，返回 (事件列表, 新的since)
+        since为None表示只接收之后的新事件；since早于缓冲区时返回reset事件，客户端应重新加载全部数据
+        """
+        self._ensure_tailer()
+        if since is None:
+            since = self.last_id
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._events and since < self._events[0][0] - 1:
+                    return [(self._events[-1][0], 'reset', {})], self._events[-1][0]
+                events = [event for event in self._events if event[0] > since]
+                if events:
+                    return events, events[-1][0]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return [], since
+                self._cond.wait(remaining)
+
+
+class StaticAssets:
+    """
+    静态资源（index.html、main.js、tailwind.css）启动时一次性加载到内存
+    JS/CSS按内容哈希生成带指纹的文件名并长期缓存（immutable），首页引用改写为指纹地址；
+    每个资源预先压缩为gzip（安装brotli时另有br），请求时按Accept-Encoding直接返回内存中的版本
+    """
+    
+    FILES = {'main.js': 'application/javascript; charset=utf-8', 'tailwind.css': 'text/css; charset=utf-8'}
+    
+    def __init__(self, base_dir: Path, index_html: str):
+        self.assets: Dict[str, Dict[str, Any]] = {}
+        for name, content_type in self.FILES.items():
+            raw = (base_dir / name).read_bytes()
+            digest = hashlib.md5(raw).hexdigest()[:12]
+            stem, ext = os.path.splitext(name)
+            fingerprinted = f"{stem}.{digest}{ext}"
+            asset = self._build(raw, content_type, digest, immutable=False)
+            self.assets[name] = asset
+            self.assets[fingerprinted] = dict(asset, immutable=True)
+            index_html = index_html.replace(f'"{name}"', f'"/{fingerprinted}"')
+        raw_index = index_html.encode('utf-8')
+        self.index = self._build(raw_index, 'text/html; charset=utf-8', hashlib.md5(raw_index).hexdigest()[:12], immutable=False)
+    
+    @staticmethod
+    def _build(raw: bytes, content_type: str, etag: str, immutable: bool) -> Dict[str, Any]:
+        encodings = {'identity': raw, 'gzip': gzip.compress(raw, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            encodings['br'] = brotli.compress(raw)
+        return {'encodings': encodings, 'content_type': content_type, 'etag': etag, 'immutable': immutable}
+    
+    def response(self, asset: Dict[str, Any]) -> Response:
+        """按客户端支持的压缩格式返回资源"""
+        accept = request.accept_encodings
+        encoding = 'identity'
+        for candidate in ('br', 'gzip'):
+            if candidate in asset['encodings'] and accept[candidate]:
+                encoding = candidate
+                break
+        response = Response(asset['encodings'][encoding], content_type=asset['content_type'])
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.set_etag(f"{asset['etag']}-{encoding}")
+        if asset['immutable']:
+            response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        else:
+            response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+
+
+class StorageError(Exception):
+    """存储后端返回了无法处理的结果"""
+
+
+class StorageBackend:
+    """
+    文件内容存储后端接口
+    上传、分片合并、下载、预览、删除和清空都通过后端读写文件内容；元数据、临时分片和回收目录仍在本地
+    """
+    
+    name = 'base'
+    BLOCK_SIZE = 1024 * 1024
+    
+    def save(self, file_id: str, upload_time: int, stream) -> Tuple[int, str]:
+        """从可读流写入文件，边写边计算MD5，返回 (字节数, MD5)"""
+        raise NotImplementedError
+    
+    def save_parts(self, file_id: str, upload_time: int, part_paths: List[Path]) -> int:
+        """按顺序拼接本地分片文件写入，返回字节数（分片已逐个校验，不再计算整体哈希）"""
+        raise NotImplementedError
+    
+    def exists(self, file_id: str, upload_time: int) -> bool:
+        raise NotImplementedError
+    
+    def open(self, file_id: str, upload_time: int):
+        """以二进制只读方式打开文件，不存在时返回None"""
+        raise NotImplementedError
+    
+    def local_path(self, file_id: str, upload_time: int) -> Optional[Path]:
+        """文件在本地文件系统上的完整路径，后端不以单个本地文件保存时返回None"""
+        return None
+    
+    def send(self, file_id: str, upload_time: int, download_name: str, mimetype: str) -> Optional[Response]:
+        """生成下载响应（支持Range），文件不存在时返回None"""
+        raise NotImplementedError
+    
+    def delete(self, file_id: str, upload_time: int, defer: bool = False):
+        """删除文件，defer为True时允许交给后台删除"""
+        raise NotImplementedError
+    
+    def usage(self) -> int:
+        """后端实际占用的字节数"""
+        raise NotImplementedError
+    
+    def clear(self) -> List[Dict[str, str]]:
+        """删除后端中的全部文件（包括未被元数据记录的），返回失败列表"""
+        raise NotImplementedError
+    
+    @staticmethod
+    def attachment_header(download_name: str) -> str:
+        return f"attachment; filename*=UTF-8''{quote(download_name, safe='')}"
+    
+    @classmethod
+    def _iter_parts(cls, part_paths: List[Path]):
+        for part_path in part_paths:
+            with open(part_path, 'rb') as f:
+                for block in iter(lambda: f.read(cls.BLOCK_SIZE), b''):
+                    yield block
+
+
+class LocalStorage(StorageBackend):
+    """本地磁盘存储：两级哈希分散目录，兼容旧版日期目录"""
+    
+    name = 'local'
+    
+    def __init__(self, upload_dir: Path, cleanup: 'CleanupEngine'):
+        self.upload_dir = upload_dir
+        self.cleanup = cleanup
+        # 已创建的存储目录缓存，避免每次写入都调用mkdir
+        self._known_dirs: set = set()
+    
+    def path_for(self, file_id: str, create: bool = False) -> Path:
+        """获取文件路径（两级哈希分散目录），仅在写入时创建目录"""
+        file_path = self.upload_dir / fanout_relpath(file_id)
+        if create and file_path.parent not in self._known_dirs:
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            self._known_dirs.add(file_path.parent)
+        return file_path
+    
+    def legacy_path(self, file_id: str, upload_time: int) -> Path:
+        """获取旧版按日期分目录的文件路径（兼容未迁移的文件）"""
+        upload_date = datetime.fromtimestamp(upload_time)
+        return self.upload_dir / upload_date.strftime('%Y%m%d') / f"{file_id}_{upload_time}"
+    
+    def resolve(self, file_id: str, upload_time: int) -> Optional[Path]:
+        """查找文件实际所在路径，新布局优先，兼容旧布局"""
+        file_path = self.path_for(file_id)
+        if file_path.exists():
+            return file_path
+        legacy_path = self.legacy_path(file_id, upload_time)
+        if legacy_path.exists():
+            return legacy_path
+        # 在线迁移可能恰好在两次检查之间移动了文件，再确认一次新路径
+        if file_path.exists():
+            return file_path
+        return None
+    
+    def _write(self, file_id: str, blocks) -> Tuple[int, str]:
+        hash_md5 = hashlib.md5()
+        size = 0
+        with open(self.path_for(file_id, create=True), 'wb') as f:
+            for block in blocks:
+                f.write(block)
+                hash_md5.update(block)
+                size += len(block)
+        return size, hash_md5.hexdigest()
+    
+    def save(self, file_id: str, upload_time: int, stream) -> Tuple[int, str]:
+        return self._write(file_id, iter(lambda: stream.read(self.BLOCK_SIZE), b''))
+    
+    def save_parts(self, file_id: str, upload_time: int, part_paths: List[Path]) -> int:
+        """用copy_file_range在内核中拼接分片（文件系统支持时共享数据块），不经过用户态缓冲"""
+        with open(self.path_for(file_id, create=True), 'wb', buffering=0) as out:
+            for part_path in part_paths:
+                with open(part_path, 'rb', buffering=0) as src:
+                    try:
+                        while os.copy_file_range(src.fileno(), out.fileno(), 1 << 30):
+                            pass
+                    except (AttributeError, OSError):
+                        # 不支持copy_file_range（旧内核、跨文件系统等）时从当前位置继续普通复制
+                        shutil.copyfileobj(src, out, self.BLOCK_SIZE)
+            return out.tell()
+    
+    def exists(self, file_id: str, upload_time: int) -> bool:
+        return self.resolve(file_id, upload_time) is not None
+    
+    def local_path(self, file_id: str, upload_time: int) -> Optional[Path]:
+        return self.resolve(file_id, upload_time)
+    
+    def open(self, file_id: str, upload_time: int):
+        file_path = self.resolve(file_id, upload_time)
+        if file_path is None:
+            return None
+        try:
+            return open(file_path, 'rb')
+        except FileNotFoundError:
+            return None
+    
+    def send(self, file_id: str, upload_time: int, download_name: str, mimetype: str) -> Optional[Response]:
+        file_path = self.resolve(file_id, upload_time)
+        if file_path is None:
+            return None
+        return send_file(file_path, as_attachment=True, download_name=download_name, mimetype=mimetype)
+    
+    def delete(self, file_id: str, upload_time: int, defer: bool = False):
+        file_path = self.resolve(file_id, upload_time)
+        if file_path is None:
+            return
+        if self._remove(file_path, defer) or file_path == self.path_for(file_id):
+            return
+        # 旧路径上的文件在查找之后被在线迁移移走了，到新路径上删除
+        self._remove(self.path_for(file_id), defer)
+    
+    def _remove(self, file_path: Path, defer: bool) -> bool:
+        """删除（或移入回收目录），文件不存在时返回False"""
+        if defer:
+            return self.cleanup.discard(file_path)
+        try:
+            file_path.unlink()
+        except FileNotFoundError:
+            return False
+        return True
+    
+    def usage(self) -> int:
+        """上传目录下所有文件的实际大小"""
+        total_size = 0
+        pending = [str(self.upload_dir)]
+        while pending:
+            try:
+                with os.scandir(pending.pop()) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                pending.append(entry.path)
+                            elif entry.is_file(follow_symlinks=False):
+                                total_size += entry.stat(follow_symlinks=False).st_size
+                        except FileNotFoundError:
+                            continue
+            except FileNotFoundError:
+                continue
+        return total_size
+    
+    def clear(self) -> List[Dict[str, str]]:
+        """
+        把所有存储目录移入回收目录，由后台删除引擎限速删除；
+        重命名是原子的，之后的新上传会写入新建的目录，不会被误删
+        """
+        errors = []
+        if not self.upload_dir.exists():
+            return errors
+        with os.scandir(self.upload_dir) as entries:
+            data_dirs = [Path(entry.path) for entry in entries
+                         if _is_fanout_dir(Path(entry.path)) or _is_legacy_date_dir(Path(entry.path))]
+        for data_dir in data_dirs:
+            try:
+                self.cleanup.discard(data_dir)
+            except Exception as e:
+                logger.error(f"清理存储目录失败 {data_dir}: {e}")
+                errors.append({'path': data_dir.name, 'error': str(e)})
+        self._known_dirs.clear()
+        return errors
+
+
+class TieredStorage(StorageBackend):
+    """
+    冷热分层存储：新上传和分片合并都写入热层（SSD/tmpfs上的上传目录），
+    后台迁移任务按上传时间和下载次数把文件限速搬到冷层（大容量磁盘），读取时先查热层再查冷层；
+    冷层文件被访问时直接从冷层发送，同时由后台线程复制回热层（提升），下载接口无需感知文件在哪一层。
+    迁移和提升都先复制到目标层的临时文件，再在文件锁内确认源文件仍在、原子替换并删除源文件；
+    删除文件也在同一把锁内进行，不会出现两层同时丢失或留下孤立副本
+    """
+    
+    name = 'tiered'
+    
+    def __init__(self, hot: LocalStorage, cold: LocalStorage, lock_path: Path, bytes_per_sec: float = 0):
+        self.hot = hot
+        self.cold = cold
+        self.lock_path = lock_path
+        self.bytes_per_sec = bytes_per_sec
+        self.on_move = None  # 回调: on_move(direction: str, nbytes: int)，direction为demote或promote
+        self._thread_lock = threading.Lock()
+        self._commit_thread_lock = threading.Lock()
+        self._next_slot = 0.0
+        self._promoting: set = set()
+        self._promote_queue: Optional[queue.Queue] = None
+        self._promoter_pid = None
+    
+    @contextmanager
+    def _commit_lock(self):
+        """跨进程互斥：只在确认源文件、替换和删除期间持有，不包括复制数据"""
+        if fcntl is None:
+            with self._commit_thread_lock:
+                yield
+            return
+        with open(self.lock_path, 'a') as lock_fp:
+            fcntl.flock(lock_fp, fcntl.LOCK_EX)
+            yield
+    
+    def _throttle(self, nbytes: int):
+        """按字节预算排队，预算用尽时等待（与后台删除引擎相同的限速方式）"""
+        if self.bytes_per_sec <= 0:
+            return
+        cost = nbytes / self.bytes_per_sec
+        now = time.monotonic()
+        self._next_slot = max(self._next_slot, now) + cost
+        delay = self._next_slot - cost - now
+        if delay > 0:
+            time.sleep(delay)
+    
+    def _move(self, file_id: str, upload_time: int, source: LocalStorage, target: LocalStorage,
+              throttle: bool) -> int:
+        """把文件从source层搬到target层，返回搬移的字节数（文件已不在source层时返回0）"""
+        source_path = source.resolve(file_id, upload_time)
+        if source_path is None:
+            return 0
+        target_path = target.path_for(file_id, create=True)
+        tmp_path = target_path.with_name(f"{target_path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        size = 0
+        try:
+            with open(source_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+                for block in iter(lambda: src.read(self.BLOCK_SIZE), b''):
+                    if throttle:
+                        self._throttle(len(block))
+                    dst.write(block)
+                    size += len(block)
+            with self._commit_lock():
+                if not source_path.exists():
+                    # 复制期间文件被删除或已被另一方搬走
+                    tmp_path.unlink(missing_ok=True)
+                    return 0
+                os.replace(tmp_path, target_path)
+                source_path.unlink(missing_ok=True)
+        except FileNotFoundError:
+            tmp_path.unlink(missing_ok=True)
+            return 0
+        except Exception:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        if self.on_move:
+            self.on_move('demote' if target is self.cold else 'promote', size)
+        return size
+    
+    def demote(self, file_id: str, upload_time: int) -> int:
+        """把热层文件限速搬到冷层，返回字节数"""
+        return self._move(file_id, upload_time, self.hot, self.cold, throttle=True)
+    
+    def promote(self, file_id: str, upload_time: int) -> int:
+        """把冷层文件复制回热层，返回字节数"""
+        return self._move(file_id, upload_time, self.cold, self.hot, throttle=False)
+    
+    def _promote_later(self, file_id: str, upload_time: int):
+        """登记后台提升，同一文件只排队一次；线程按进程启动，fork后重新创建"""
+        with self._thread_lock:
+            if file_id in self._promoting and self._promoter_pid == os.getpid():
+                return
+            if self._promoter_pid != os.getpid():
+                self._promoting = set()
+                self._promote_queue = queue.Queue()
+                self._promoter_pid = os.getpid()
+                threading.Thread(target=self._promote_loop, args=(self._promote_queue,),
+                                 name='tier-promoter', daemon=True).start()
+            self._promoting.add(file_id)
+            self._promote_queue.put((file_id, upload_time))
+    
+    def _promote_loop(self, pending: queue.Queue):
+        while True:
+            file_id, upload_time = pending.get()
+            try:
+                self.promote(file_id, upload_time)
+            except Exception as e:
+                logger.error(f"提升文件到热层失败 {file_id}: {e}")
+            finally:
+                with self._thread_lock:
+                    self._promoting.discard(file_id)
+    
+    def tier_of(self, file_id: str, upload_time: int) -> Optional[str]:
+        if self.hot.exists(file_id, upload_time):
+            return 'hot'
+        if self.cold.exists(file_id, upload_time):
+            return 'cold'
+        return None
+    
+    def save(self, file_id: str, upload_time: int, stream) -> Tuple[int, str]:
+        return self.hot.save(file_id, upload_time, stream)
+    
+    def save_parts(self, file_id: str, upload_time: int, part_paths: List[Path]) -> int:
+        return self.hot.save_parts(file_id, upload_time, part_paths)
+    
+    def exists(self, file_id: str, upload_time: int) -> bool:
+        return self.tier_of(file_id, upload_time) is not None
+    
+    def local_path(self, file_id: str, upload_time: int) -> Optional[Path]:
+        return self.hot.resolve(file_id, upload_time) or self.cold.resolve(file_id, upload_time)
+    
+    def open(self, file_id: str, upload_time: int):
+        f = self.hot.open(file_id, upload_time)
+        if f is None:
+            f = self.cold.open(file_id, upload_time)
+            if f is not None:
+                self._promote_later(file_id, upload_time)
+        return f
+    
+    def send(self, file_id: str, upload_time: int, download_name: str, mimetype: str) -> Optional[Response]:
+        response = self.hot.send(file_id, upload_time, download_name, mimetype)
+        if response is None:
+            # 已打开的文件在提升完成、冷层副本被删除后仍可继续读取
+            response = self.cold.send(file_id, upload_time, download_name, mimetype)
+            if response is not None:
+                self._promote_later(file_id, upload_time)
+        return response
+    
+    def delete(self, file_id: str, upload_time: int, defer: bool = False):
+        with self._commit_lock():
+            self.hot.delete(file_id, upload_time, defer)
+            self.cold.delete(file_id, upload_time, defer)
+    
+    def usage(self) -> int:
+        return self.hot.usage() + self.cold.usage()
+    
+    def tier_stats(self) -> Dict[str, int]:
+        return {'hot_bytes': self.hot.usage(), 'cold_bytes': self.cold.usage()}
+    
+    def clear(self) -> List[Dict[str, str]]:
+        with self._commit_lock():
+            return self.hot.clear() + self.cold.clear()
+
+
+class PrefixedStream:
+    """先返回已经读出的开头部分，再继续读原始流"""
+    
+    def __init__(self, head: bytes, stream):
+        self.head = head
+        self.stream = stream
+    
+    def read(self, size: int = -1) -> bytes:
+        if not self.head:
+            return self.stream.read(size)
+        if size is None or size < 0:
+            data, self.head = self.head + self.stream.read(), b''
+        else:
+            data, self.head = self.head[:size], self.head[size:]
+        return data
+
+
+class PackedStorage(StorageBackend):
+    """
+    小文件打包存储：不超过 threshold 的文件追加写入段文件（packs/segments/<pid>-<随机串>.pack），
+    不再各占一个文件、一个inode和至少一个磁盘块；其余文件照常交给内层存储（本地或冷热分层）。
+    (段, 偏移, 长度) 索引保存在 packs/index.db，下载时查索引后用 os.pread 从缓存的段文件描述符中按偏移读取，
+    不需要 open/stat/close。每个进程只追加写自己的活动段，写满后封存；删除只移除索引并扣减段的有效字节数，
+    后台压缩任务把有效数据比例过低的段中仍有效的文件搬到新段，再删除旧段回收空间
+    """
+    
+    name = 'packed'
+    FD_CACHE = 64  # 每个进程缓存的段文件描述符数
+    FD_SWEEP_INTERVAL = 60  # 关闭已被删除的段的描述符的间隔（秒），避免长期占住已回收的空间
+    ORPHAN_AGE = 3600  # 没有索引记录的段文件超过该秒数后删除（进程在登记前退出留下的）
+    
+    def __init__(self, inner: StorageBackend, root: Path, cleanup: 'CleanupEngine', threshold: int,
+                 segment_size: int = 64 * 1024 * 1024):
+        self.inner = inner
+        self.root = root
+        self.cleanup = cleanup
+        self.threshold = threshold
+        self.segment_size = segment_size
+        self.segments_dir = root / 'segments'
+        self.segments_dir.mkdir(parents=True, exist_ok=True)
+        self.db_path = root / 'index.db'
+        self._db_lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        # 当前进程的活动段
+        self._append_lock = threading.Lock()
+        self._active_name: Optional[str] = None
+        self._active_fd: Optional[int] = None
+        self._active_size = 0
+        self._active_pid = None
+        # 读取用的段文件描述符缓存
+        self._fd_lock = threading.Lock()
+        self._fds: OrderedDict = OrderedDict()
+        self._fd_pid = None
+        self._fd_swept = time.monotonic()
+        with self._transaction() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS objects '
+                         '(file_id TEXT PRIMARY KEY, segment TEXT, offset INTEGER, length INTEGER)')
+            conn.execute('CREATE INDEX IF NOT EXISTS objects_segment ON objects (segment)')
+            conn.execute('CREATE TABLE IF NOT EXISTS segments '
+                         '(name TEXT PRIMARY KEY, pid INTEGER, sealed INTEGER, size INTEGER, live INTEGER)')
+    
+    def _db(self) -> sqlite3.Connection:
+        # 连接不能跨fork共用，每个工作进程各自打开
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(str(self.db_path), timeout=30.0, isolation_level=None, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn_pid = os.getpid()
+        return self._conn
+    
+    @contextmanager
+    def _transaction(self):
+        with self._db_lock:
+            conn = self._db()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+    
+    def _roll(self):
+        """封存当前活动段并新建一个（调用方持有 _append_lock）；fork后继承的活动段属于父进程，只关闭不封存"""
+        if self._active_fd is not None:
+            if self._active_pid == os.getpid():
+                with self._transaction() as conn:
+                    conn.execute('UPDATE segments SET sealed = 1 WHERE name = ?', (self._active_name,))
+            os.close(self._active_fd)
+            self._active_fd = None
+        name = f"{os.getpid()}-{uuid.uuid4().hex[:12]}.pack"
+        # 先登记再创建文件：进程在两步之间退出只会留下一条空记录，由压缩任务删除
+        with self._transaction() as conn:
+            conn.execute('INSERT INTO segments (name, pid, sealed, size, live) VALUES (?, ?, 0, 0, 0)',
+                         (name, os.getpid()))
+        path = self.segments_dir / name
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileNotFoundError:
+            # 段目录可能已被clear移走
+            self.segments_dir.mkdir(parents=True, exist_ok=True)
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        self._active_name, self._active_fd, self._active_size, self._active_pid = name, fd, 0, os.getpid()
+    
+    def _append(self, data: bytes) -> Tuple[str, int]:
+        """把数据追加到当前进程的活动段，返回 (段名, 偏移)；写满时换新段"""
+        with self._append_lock:
+            if (self._active_fd is None or self._active_pid != os.getpid()
+                    or (self._active_size and self._active_size + len(data) > self.segment_size)):
+                self._roll()
+            offset = self._active_size
+            os.pwrite(self._active_fd, data, offset)
+            self._active_size += len(data)
+            return self._active_name, offset
+    
+    def _abandon(self, segment: str):
+        """活动段的索引记录已不存在（被clear清空），下次写入时换新段"""
+        with self._append_lock:
+            if self._active_name == segment and self._active_pid == os.getpid() and self._active_fd is not None:
+                os.close(self._active_fd)
+                self._active_fd = None
+    
+    def _add_live(self, conn: sqlite3.Connection, segment: str, offset: int, length: int) -> bool:
+        """登记段中新写入的有效字节，段记录已不存在时返回False"""
+        return conn.execute('UPDATE segments SET live = live + ?, size = MAX(size, ?) WHERE name = ?',
+                            (length, offset + length, segment)).rowcount > 0
+    
+    def _put(self, file_id: str, data: bytes):
+        for _ in range(3):
+            segment, offset = self._append(data)
+            with self._transaction() as conn:
+                if self._add_live(conn, segment, offset, len(data)):
+                    old = conn.execute('SELECT segment, length FROM objects WHERE file_id = ?', (file_id,)).fetchone()
+                    if old is not None:
+                        conn.execute('UPDATE segments SET live = live - ? WHERE name = ?', (old[1], old[0]))
+                    conn.execute('INSERT OR REPLACE INTO objects (file_id, segment, offset, length) VALUES (?, ?, ?, ?)',
+                                 (file_id, segment, offset, len(data)))
+                    return
+            self._abandon(segment)
+        raise StorageError(f"写入打包段失败: {file_id}")
+    
+    def _locate(self, file_id: str) -> Optional[Tuple[str, int, int]]:
+        with self._db_lock:
+            return self._db().execute('SELECT segment, offset, length FROM objects WHERE file_id = ?',
+                                      (file_id,)).fetchone()
+    
+    def _pread(self, segment: str, offset: int, length: int) -> bytes:
+        """
+        从缓存的段文件描述符读取；读取在锁内进行，描述符不会在读取途中被淘汰关闭。
+        段被压缩任务删除后已打开的描述符仍可读，定期关闭这些描述符释放空间
+        """
+        with self._fd_lock:
+            if self._fd_pid != os.getpid():
+                for fd in self._fds.values():
+                    os.close(fd)  # 只关闭fork继承来的副本，不影响父进程
+                self._fds = OrderedDict()
+                self._fd_pid = os.getpid()
+            now = time.monotonic()
+            if now - self._fd_swept > self.FD_SWEEP_INTERVAL:
+                self._fd_swept = now
+                for name, fd in list(self._fds.items()):
+                    if os.fstat(fd).st_nlink == 0:
+                        os.close(fd)
+                        del self._fds[name]
+            fd = self._fds.get(segment)
+            if fd is None:
+                fd = os.open(self.segments_dir / segment, os.O_RDONLY)
+                self._fds[segment] = fd
+                while len(self._fds) > self.FD_CACHE:
+                    os.close(self._fds.popitem(last=False)[1])
+            else:
+                self._fds.move_to_end(segment)
+            return os.pread(fd, length, offset)
+    
+    def read_packed(self, file_id: str) -> Optional[bytes]:
+        """读取打包保存的文件内容，不是打包文件时返回None"""
+        for _ in range(2):
+            location = self._locate(file_id)
+            if location is None:
+                return None
+            segment, offset, length = location
+            try:
+                data = self._pread(segment, offset, length)
+            except FileNotFoundError:
+                continue  # 查索引后段被压缩任务删除，文件已搬到新段
+            if len(data) != length:
+                raise StorageError(f"打包段数据不完整: {segment}")
+            return data
+        raise StorageError(f"打包段缺失: {file_id}")
+    
+    def save(self, file_id: str, upload_time: int, stream) -> Tuple[int, str]:
+        head = b''
+        while len(head) <= self.threshold:
+            block = stream.read(self.threshold + 1 - len(head))
+            if not block:
+                break
+            head += block
+        if len(head) > self.threshold:
+            return self.inner.save(file_id, upload_time, PrefixedStream(head, stream))
+        self._put(file_id, head)
+        return len(head), hashlib.md5(head).hexdigest()
+    
+    def save_parts(self, file_id: str, upload_time: int, part_paths: List[Path]) -> int:
+        if sum(part_path.stat().st_size for part_path in part_paths) > self.threshold:
+            return self.inner.save_parts(file_id, upload_time, part_paths)
+        data = b''.join(self._iter_parts(part_paths))
+        self._put(file_id, data)
+        return len(data)
+    
+    def exists(self, file_id: str, upload_time: int) -> bool:
+        return self._locate(file_id) is not None or self.inner.exists(file_id, upload_time)
+    
+    def local_path(self, file_id: str, upload_time: int) -> Optional[Path]:
+        if self._locate(file_id) is not None:
+            return None
+        return self.inner.local_path(file_id, upload_time)
+    
+    def open(self, file_id: str, upload_time: int):
+        data = self.read_packed(file_id)
+        if data is None:
+            return self.inner.open(file_id, upload_time)
+        return io.BytesIO(data)
+    
+    def send(self, file_id: str, upload_time: int, download_name: str, mimetype: str) -> Optional[Response]:
+        data = self.read_packed(file_id)
+        if data is None:
+            return self.inner.send(file_id, upload_time, download_name, mimetype)
+        response = Response(data, mimetype=mimetype)
+        response.headers['Content-Disposition'] = self.attachment_header(download_name)
+        response.set_etag(f"{file_id}-{len(data)}")
+        response.last_modified = upload_time
+        return response.make_conditional(request, accept_ranges=True, complete_length=len(data))
+    
+    def delete(self, file_id: str, upload_time: int, defer: bool = False):
+        """打包文件只移除索引，段中的空间由压缩任务回收"""
+        with self._transaction() as conn:
+            row = conn.execute('SELECT segment, length FROM objects WHERE file_id = ?', (file_id,)).fetchone()
+            if row is not None:
+                conn.execute('DELETE FROM objects WHERE file_id = ?', (file_id,))
+                conn.execute('UPDATE segments SET live = live - ? WHERE name = ?', (row[1], row[0]))
+        if row is None:
+            self.inner.delete(file_id, upload_time, defer)
+    
+    def usage(self) -> int:
+        # 段文件在上传目录下，内层存储统计上传目录时已包含（含尚未回收的空间）
+        return self.inner.usage()
+    
+    def _compactable(self, max_live_ratio: float) -> List[Tuple[str, int]]:
+        """已封存（或所属进程已退出）且有效数据比例低于阈值的段 (段名, 大小)"""
+        with self._db_lock:
+            rows = self._db().execute('SELECT name, pid, sealed, size, live FROM segments').fetchall()
+        segments = []
+        for name, pid, sealed, size, live in rows:
+            if not sealed and (pid == os.getpid() or MetricsRegistry._pid_alive(pid)):
+                continue  # 仍在追加写入的活动段
+            if live <= 0 or live < size * max_live_ratio:
+                segments.append((name, size))
+        return segments
+    
+    def compact(self, max_live_ratio: float = 0.5) -> Tuple[int, int]:
+        """
+        把段中仍有效的文件搬到当前进程的活动段，更新索引后删除旧段，返回 (删除的段数, 回收的字节数)。
+        只有索引仍指向旧位置时才改写，搬移期间被删除的文件不会复活；调用方保证同一时刻只有一个进程在压缩
+        """
+        removed = 0
+        reclaimed = 0
+        for segment, size in self._compactable(max_live_ratio):
+            with self._db_lock:
+                objects = self._db().execute('SELECT file_id, offset, length FROM objects WHERE segment = ?',
+                                             (segment,)).fetchall()
+            moved = 0
+            for file_id, offset, length in objects:
+                try:
+                    data = self._pread(segment, offset, length)
+                except FileNotFoundError:
+                    break  # 段已被clear移走
+                new_segment, new_offset = self._append(data)
+                with self._transaction() as conn:
+                    registered = self._add_live(conn, new_segment, new_offset, length)
+                    if registered and conn.execute('UPDATE objects SET segment = ?, offset = ? '
+                                                   'WHERE file_id = ? AND segment = ? AND offset = ?',
+                                                   (new_segment, new_offset, file_id, segment, offset)).rowcount:
+                        moved += length
+                    elif registered:
+                        # 搬移期间文件被删除，新副本不计入有效数据
+                        conn.execute('UPDATE segments SET live = live - ? WHERE name = ?', (length, new_segment))
+                if not registered:
+                    # 压缩期间存储被清空
+                    self._abandon(new_segment)
+                    return removed, reclaimed
+            with self._transaction() as conn:
+                if conn.execute('SELECT 1 FROM objects WHERE segment = ? LIMIT 1', (segment,)).fetchone():
+                    continue
+                conn.execute('DELETE FROM segments WHERE name = ?', (segment,))
+                (self.segments_dir / segment).unlink(missing_ok=True)
+            removed += 1
+            reclaimed += max(size - moved, 0)
+        reclaimed += self._remove_orphans()
+        return removed, reclaimed
+    
+    def _remove_orphans(self) -> int:
+        """删除没有索引记录的旧段文件，返回字节数"""
+        with self._db_lock:
+            known = {row[0] for row in self._db().execute('SELECT name FROM segments')}
+        reclaimed = 0
+        cutoff = time.time() - self.ORPHAN_AGE
+        try:
+            with os.scandir(self.segments_dir) as entries:
+                for entry in entries:
+                    if entry.name in known or not entry.name.endswith('.pack'):
+                        continue
+                    try:
+                        st = entry.stat()
+                        if st.st_mtime < cutoff:
+                            os.unlink(entry.path)
+                            reclaimed += st.st_size
+                    except FileNotFoundError:
+                        continue
+        except FileNotFoundError:
+            pass
+        return reclaimed
+    
+    def pack_stats(self) -> Dict[str, Any]:
+        """打包文件数、段数、段文件总字节数和其中的有效字节数"""
+        with self._db_lock:
+            conn = self._db()
+            objects = conn.execute('SELECT COUNT(*) FROM objects').fetchone()[0]
+            segments, size, live = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(live), 0) FROM segments'
+            ).fetchone()
+        return {
+            'objects': objects,
+            'segments': segments,
+            'segment_bytes': size,
+            'live_bytes': live,
+            'live_ratio': round(live / size, 3) if size else 1.0,
+        }
+    
+    def clear(self) -> List[Dict[str, str]]:
+        """清空内层存储，并在写事务中把段目录整体移入回收目录、清空索引（各进程的活动段在下次写入时换新）"""
+        errors = self.inner.clear()
+        with self._transaction() as conn:
+            try:
+                self.cleanup.discard(self.segments_dir)
+            except Exception as e:
+                logger.error(f"清理存储目录失败 {self.segments_dir}: {e}")
+                errors.append({'path': self.segments_dir.name, 'error': str(e)})
+            self.segments_dir.mkdir(parents=True, exist_ok=True)
+            conn.execute('DELETE FROM objects')
+            conn.execute('DELETE FROM segments')
+        return errors
+
+
+class HTTPBody:
+    """上游HTTP响应的流式响应体，读完后交给release回收连接（如归还连接池），中途关闭则断开连接"""
+    
+    BLOCK_SIZE = 64 * 1024
+    
+    def __init__(self, conn, response, release=None):
+        self._release = release
+        self._conn = conn
+        self._response = response
+        self._closed = False
+    
+    def read(self, size: int = -1) -> bytes:
+        return self._response.read(None if size is None or size < 0 else size)
+    
+    def __iter__(self):
+        while True:
+            block = self._response.read(self.BLOCK_SIZE)
+            if not block:
+                break
+            yield block
+    
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._response.isclosed() and self._release is not None:
+            self._release(self._conn)
+        else:
+            self._conn.close()
+
+
+class S3Client:
+    """
+    S3兼容对象存储的最小客户端，只依赖标准库：
+    AWS Signature V4签名、路径风格地址（/bucket/key，兼容MinIO等自建服务）、LIFO连接池复用keep-alive连接
+    """
+    
+    def __init__(self, endpoint: str, bucket: str, access_key: str, secret_key: str,
+                 region: str = 'us-east-1', pool_size: int = 16, timeout: float = 60):
+        parts = urlsplit(endpoint)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError(f"无效的S3地址: {endpoint}")
+        self.secure = parts.scheme == 'https'
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.secure else 80)
+        self.host_header = parts.netloc
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.timeout = timeout
+        self.pool_size = max(1, pool_size)
+        self._pool: queue.LifoQueue = queue.LifoQueue(self.pool_size)
+        self._pool_pid = os.getpid()
+    
+    def _new_conn(self):
+        conn_class = http.client.HTTPSConnection if self.secure else http.client.HTTPConnection
+        return conn_class(self.host, self.port, timeout=self.timeout)
+    
+    def _get_conn(self):
+        # 工作进程fork后不能复用父进程的套接字
+        if self._pool_pid != os.getpid():
+            self._pool = queue.LifoQueue(self.pool_size)
+            self._pool_pid = os.getpid()
+        try:
+            return self._pool.get_nowait(), True
+        except queue.Empty:
+            return self._new_conn(), False
+    
+    def _put_conn(self, conn):
+        if self._pool_pid != os.getpid():
+            conn.close()
+            return
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+    
+    def object_path(self, key: str = '') -> str:
+        path = f"/{self.bucket}"
+        if key:
+            path += '/' + key
+        return path
+    
+    def sign(self, method: str, path: str, query: Dict[str, str], headers: Dict[str, str],
+             payload_hash: str, amz_date: Optional[str] = None) -> Dict[str, str]:
+        """按SigV4签名，headers的键须为小写，返回附加了签名头的新字典"""
+        amz_date = amz_date or time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())
+        date = amz_date[:8]
+        headers = dict(headers)
+        headers.setdefault('host', self.host_header)
+        headers['x-amz-date'] = amz_date
+        headers['x-amz-content-sha256'] = payload_hash
+        
+        canonical_query = '&'.join(
+            f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}" for k, v in sorted(query.items())
+        )
+        signed_headers = ';'.join(sorted(headers))
+        canonical_headers = ''.join(f"{k}:{' '.join(str(headers[k]).split())}\n" for k in sorted(headers))
+        canonical_request = '\n'.join([
+            method, quote(path, safe='/-_.~'), canonical_query, canonical_headers, signed_headers, payload_hash
+        ])
+        scope = f"{date}/{self.region}/s3/aws4_request"
+        string_to_sign = '\n'.join([
+            'AWS4-HMAC-SHA256', amz_date, scope, hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()
+        ])
+        key = ('AWS4' + self.secret_key).encode('utf-8')
+        for part in (date, self.region, 's3', 'aws4_request'):
+            key = hmac.new(key, part.encode('utf-8'), hashlib.sha256).digest()
+        signature = hmac.new(key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+        headers['authorization'] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+            f"SignedHeaders={signed_headers}, Signature={signature}"
+        )
+        return headers
+    
+    def request(self, method: str, key: str = '', query: Optional[Dict[str, str]] = None,
+                headers: Optional[Dict[str, str]] = None, body: bytes = b'', stream: bool = False):
+        """
+        发送请求，返回 (状态码, 响应头, 响应体)；stream为True时响应体是HTTPBody，由调用方关闭
+        复用的空闲连接可能已被服务端关闭，此时换新连接重试一次
+        """
+        query = query or {}
+        path = self.object_path(key)
+        url = quote(path, safe='/-_.~')
+        if query:
+            url += '?' + urlencode(sorted(query.items()), quote_via=quote, safe='-_.~')
+        signed = self.sign(method, path, query, headers or {}, hashlib.sha256(body).hexdigest())
+        if body or method in ('PUT', 'POST'):
+            signed['content-length'] = str(len(body))
+        
+        for attempt in range(2):
+            conn, reused = self._get_conn()
+            try:
+                conn.request(method, url, body=body or None, headers=signed)
+                response = conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+            break
+        
+        response_headers = {k.lower(): v for k, v in response.getheaders()}
+        if stream and response.status < 300:
+            return response.status, response_headers, HTTPBody(conn, response, self._put_conn)
+        try:
+            data = response.read()
+        except Exception:
+            conn.close()
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            self._put_conn(conn)
+        return response.status, response_headers, data
+    
+    def check(self, status: int, data: bytes, action: str, expected=(200,)):
+        if status not in expected:
+            raise StorageError(f"S3 {action} 返回 {status}: {data[:200].decode('utf-8', 'replace')}")
+    
+    @staticmethod
+    def xml_find(root, name: str):
+        """按本地名查找子元素（忽略S3的XML命名空间）"""
+        for element in root.iter():
+            if element.tag.rsplit('}', 1)[-1] == name:
+                return element
+        return None
+    
+    def list_objects(self, prefix: str = ''):
+        """ListObjectsV2分页遍历，逐个产生 (key, size)"""
+        token = None
+        while True:
+            query = {'list-type': '2', 'prefix': prefix}
+            if token:
+                query['continuation-token'] = token
+            status, _, data = self.request('GET', '', query)
+            self.check(status, data, 'ListObjectsV2')
+            root = ElementTree.fromstring(data)
+            for element in root:
+                if element.tag.rsplit('}', 1)[-1] != 'Contents':
+                    continue
+                key = self.xml_find(element, 'Key').text or ''
+                size = self.xml_find(element, 'Size')
+                yield key, int(size.text) if size is not None and size.text else 0
+            truncated = self.xml_find(root, 'IsTruncated')
+            next_token = self.xml_find(root, 'NextContinuationToken')
+            if truncated is None or truncated.text != 'true' or next_token is None or not next_token.text:
+                return
+            token = next_token.text
+
+
+class S3Storage(StorageBackend):
+    """
+    S3兼容对象存储：对象键沿用本地的两级哈希分散路径（<prefix>ab/cd/<file_id>）。
+    不足一个分段的文件直接PutObject，更大的文件按 part_size 分段走Multipart Upload（S3要求除最后一段外每段至少5MB）；
+    下载时流式转发GET响应并透传Range，不落本地磁盘
+    """
+    
+    name = 's3'
+    MIN_PART_SIZE = 5 * 1024 * 1024
+    
+    def __init__(self, client: S3Client, prefix: str = '', part_size: int = 8 * 1024 * 1024, workers: int = 8):
+        self.client = client
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self.part_size = max(self.MIN_PART_SIZE, part_size)
+        self.workers = max(1, workers)
+    
+    def key_for(self, file_id: str) -> str:
+        return self.prefix + fanout_relpath(file_id).as_posix()
+    
+    def _upload(self, key: str, blocks) -> Tuple[int, str]:
+        """上传数据块序列，返回 (字节数, MD5)"""
+        hash_md5 = hashlib.md5()
+        size = 0
+        buffer = bytearray()
+        upload_id = None
+        parts: List[Tuple[int, str]] = []
+        try:
+            for block in blocks:
+                hash_md5.update(block)
+                size += len(block)
+                buffer += block
+                while len(buffer) >= self.part_size:
+                    if upload_id is None:
+                        upload_id = self._create_multipart(key)
+                    part = bytes(buffer[:self.part_size])
+                    del buffer[:self.part_size]
+                    parts.append(self._upload_part(key, upload_id, len(parts) + 1, part))
+            
+            if upload_id is None:
+                status, _, data = self.client.request('PUT', key, body=bytes(buffer))
+                self.client.check(status, data, 'PutObject')
+            else:
+                if buffer:
+                    parts.append(self._upload_part(key, upload_id, len(parts) + 1, bytes(buffer)))
+                self._complete_multipart(key, upload_id, parts)
+        except Exception:
+            if upload_id is not None:
+                try:
+                    self.client.request('DELETE', key, {'uploadId': upload_id})
+                except Exception as e:
+                    logger.error(f"中止分段上传失败 {key}: {e}")
+            raise
+        return size, hash_md5.hexdigest()
+    
+    def _create_multipart(self, key: str) -> str:
+        status, _, data = self.client.request('POST', key, {'uploads': ''})
+        self.client.check(status, data, 'CreateMultipartUpload')
+        element = S3Client.xml_find(ElementTree.fromstring(data), 'UploadId')
+        if element is None or not element.text:
+            raise StorageError('S3 CreateMultipartUpload 未返回UploadId')
+        return element.text
+    
+    def _upload_part(self, key: str, upload_id: str, number: int, data: bytes) -> Tuple[int, str]:
+        status, headers, body = self.client.request(
+            'PUT', key, {'partNumber': str(number), 'uploadId': upload_id}, body=data
+        )
+        self.client.check(status, body, 'UploadPart')
+        return number, headers.get('etag', '')
+    
+    def _complete_multipart(self, key: str, upload_id: str, parts: List[Tuple[int, str]]):
+        body = '<CompleteMultipartUpload>' + ''.join(
+            f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>" for number, etag in parts
+        ) + '</CompleteMultipartUpload>'
+        status, _, data = self.client.request('POST', key, {'uploadId': upload_id}, body=body.encode('utf-8'))
+        # CompleteMultipartUpload 出错时也可能返回200，错误写在响应体里
+        self.client.check(status, data, 'CompleteMultipartUpload')
+        if b'<Error>' in data:
+            raise StorageError(f"S3 CompleteMultipartUpload 失败: {data[:200].decode('utf-8', 'replace')}")
+    
+    def save(self, file_id: str, upload_time: int, stream) -> Tuple[int, str]:
+        return self._upload(self.key_for(file_id), iter(lambda: stream.read(self.BLOCK_SIZE), b''))
+    
+    def save_parts(self, file_id: str, upload_time: int, part_paths: List[Path]) -> int:
+        return self._upload(self.key_for(file_id), self._iter_parts(part_paths))[0]
+    
+    def exists(self, file_id: str, upload_time: int) -> bool:
+        status, _, data = self.client.request('HEAD', self.key_for(file_id))
+        if status == 404:
+            return False
+        self.client.check(status, data, 'HeadObject')
+        return True
+    
+    def open(self, file_id: str, upload_time: int):
+        status, _, body = self.client.request('GET', self.key_for(file_id), stream=True)
+        if status == 404:
+            return None
+        if isinstance(body, bytes):
+            self.client.check(status, body, 'GetObject')
+        return body
+    
+    def send(self, file_id: str, upload_time: int, download_name: str, mimetype: str) -> Optional[Response]:
+        headers = {}
+        range_header = request.headers.get('Range')
+        if range_header:
+            headers['range'] = range_header
+        status, object_headers, body = self.client.request('GET', self.key_for(file_id), headers=headers, stream=True)
+        if status == 404:
+            return None
+        if status == 416:
+            return Response(status=416, headers={'Content-Range': object_headers.get('content-range', '')})
+        if isinstance(body, bytes):
+            self.client.check(status, body, 'GetObject')
         
-        # 如果是ERROR或CRITICAL级别的日志，总是记录
-        if record.levelno >= logging.ERROR:
-            return True
-            
-        # 检查是否包含关键信息
-        for msg in key_messages:
-            if msg in record.getMessage():
-                return True
+        response = Response(body, status=status, mimetype=mimetype, direct_passthrough=True)
+        for name in ('content-length', 'content-range', 'etag', 'last-modified'):
+            if name in object_headers:
+                response.headers[name.title()] = object_headers[name]
+        response.headers['Accept-Ranges'] = 'bytes'
+        response.headers['Content-Disposition'] = self.attachment_header(download_name)
+        return response
+    
+    def delete(self, file_id: str, upload_time: int, defer: bool = False):
+        # 对象存储的删除不占本地磁盘IO，不区分是否延后
+        status, _, data = self.client.request('DELETE', self.key_for(file_id))
+        self.client.check(status, data, 'DeleteObject', expected=(200, 204, 404))
+    
+    def usage(self) -> int:
+        return sum(size for _, size in self.client.list_objects(self.prefix))
+    
+    def clear(self) -> List[Dict[str, str]]:
+        errors = []
         
-        return False
+        def remove(key):
+            try:
+                status, _, data = self.client.request('DELETE', key)
+                self.client.check(status, data, 'DeleteObject', expected=(200, 204, 404))
+                return None
+            except Exception as e:
+                return {'path': key, 'error': str(e)}
+        
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for error in pool.map(remove, [key for key, _ in self.client.list_objects(self.prefix)]):
+                if error:
+                    logger.error(f"清理对象失败 {error['path']}: {error['error']}")
+                    errors.append(error)
+        return errors
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        RotatingFileHandler('jack-disk.log', maxBytes=10*1024*1024, backupCount=0),  # 10MB限制，超过后自动清空
-        logging.StreamHandler()
-    ]
-)
-
-# 为文件处理器添加过滤器，只记录关键信息到文件
-file_handler = None
-for handler in logging.getLogger().handlers:
-    if isinstance(handler, RotatingFileHandler):
-        file_handler = handler
-        break
-
-if file_handler:
-    file_handler.addFilter(KeyInfoFilter())
 
-logger = logging.getLogger(__name__)
+class BlockReader(io.RawIOBase):
+    """按块清单顺序读取块文件，作为普通的二进制只读文件使用"""
+    
+    def __init__(self, storage: 'DedupStorage', entries: List[Tuple[bytes, int]]):
+        self._storage = storage
+        self._entries = entries
+        self._index = 0
+        self._block = b''
+        self._offset = 0
+    
+    def readable(self) -> bool:
+        return True
+    
+    def readinto(self, buffer) -> int:
+        while self._offset >= len(self._block):
+            if self._index >= len(self._entries):
+                return 0
+            self._block = self._storage.read_block(self._entries[self._index][0])
+            self._index += 1
+            self._offset = 0
+        n = min(len(buffer), len(self._block) - self._offset)
+        buffer[:n] = self._block[self._offset:self._offset + n]
+        self._offset += n
+        return n
 
-class JackDiskConfig:
-    """配置管理类"""
+
+class BlockStream:
+    """
+    下载响应体：按块清单顺序输出 [skip, skip+length) 范围内的数据，
+    用线程池提前读取后面的 READ_AHEAD 个块，磁盘读取与网络发送重叠
+    """
     
-    def __init__(self):
-        # 基础配置
-        self.admin_password = os.getenv('TEMPSTORE_ADMIN_PASSWORD', 'admin')  # 默认密码为admin
-        self.upload_dir = os.getenv('TEMPSTORE_UPLOAD_DIR', './uploads')
-        self.log_level = os.getenv('TEMPSTORE_LOG_LEVEL', 'INFO')
-        self.max_storage = self._parse_size(os.getenv('TEMPSTORE_MAX_STORAGE', '20GB'))
+    def __init__(self, storage: 'DedupStorage', entries: List[Tuple[bytes, int]], skip: int, length: int):
+        self._storage = storage
+        self._entries = entries
+        self._skip = skip
+        self._remaining = length
+        self._pool: Optional[ThreadPoolExecutor] = None
+    
+    def __iter__(self):
+        self._pool = ThreadPoolExecutor(max_workers=self._storage.READ_AHEAD)
+        pending = deque()
+        digests = iter(digest for digest, _ in self._entries)
+        for digest in digests:
+            pending.append(self._pool.submit(self._storage.read_block, digest))
+            if len(pending) >= self._storage.READ_AHEAD:
+                break
+        while pending and self._remaining > 0:
+            data = pending.popleft().result()
+            digest = next(digests, None)
+            if digest is not None:
+                pending.append(self._pool.submit(self._storage.read_block, digest))
+            data = data[self._skip:self._skip + self._remaining]
+            self._skip = 0
+            self._remaining -= len(data)
+            yield data
+    
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class DedupStorage(StorageBackend):
+    """
+    块级去重存储：上传内容经 ContentChunker 切分后按SHA-256内容寻址，相同的块只保存一份（blocks/objects/ab/<sha256>）。
+    每个文件对应一份块清单（blocks/manifests/ab/cd/<file_id>，依次为32字节块哈希和4字节块长度），
+    块的引用计数保存在 blocks/index.db：登记引用和补写缺失的块、删除时移除引用归零的块都在SQLite写事务中完成，
+    多个工作进程并发上传和删除同一个块时不会删掉刚被引用的块。下载时按清单并行预读后续块，顺序输出。
+    写入清单之前登记的引用同时记入pending表，进程中途被杀掉时由 sweep_pending 释放。
+    查找切点是纯Python循环，workers>0时交给进程池执行，请求线程等待期间释放GIL，不阻塞同进程的其他请求
+    """
+    
+    name = 'dedup'
+    ENTRY = struct.Struct('<32sI')
+    BATCH_BLOCKS = 64  # 每个写事务登记的块数
+    READ_AHEAD = 4  # 下载时提前读取的块数
+    PENDING_TTL = 3600  # 超过这个时间没有进展、也没有写出清单的写入视为已中断
+    
+    def __init__(self, root: Path, cleanup: 'CleanupEngine', avg_block_size: int = 64 * 1024, workers: int = 0):
+        self.root = root
+        self.cleanup = cleanup
+        self.chunker = ContentChunker(avg_block_size)
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+        self.objects_dir = root / 'objects'
+        self.manifests_dir = root / 'manifests'
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.manifests_dir.mkdir(parents=True, exist_ok=True)
+        self.db_path = root / 'index.db'
+        self._db_lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        self._known_dirs: set = set()
+        self._db().execute('CREATE TABLE IF NOT EXISTS blocks (hash BLOB PRIMARY KEY, size INTEGER, refs INTEGER)')
+        self._db().execute('CREATE TABLE IF NOT EXISTS pending (file_id TEXT, hash BLOB, started REAL)')
+        self._db().execute('CREATE INDEX IF NOT EXISTS idx_pending_file ON pending (file_id)')
+    
+    def _db(self) -> sqlite3.Connection:
+        # 连接不能跨fork共用，每个工作进程各自打开
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(str(self.db_path), timeout=30.0, isolation_level=None, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn_pid = os.getpid()
+        return self._conn
+    
+    def _executor(self) -> Optional[ProcessPoolExecutor]:
+        """查找切点的进程池，每个工作进程各自创建；workers为0时在请求线程中计算"""
+        if self.workers <= 0:
+            return None
+        with self._pool_lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                # forkserver：子进程从干净的服务进程派生，不继承Web工作进程的线程和锁
+                try:
+                    context = multiprocessing.get_context('forkserver')
+                    context.set_forkserver_preload(['content_chunker'])
+                except ValueError:
+                    context = multiprocessing.get_context()
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                self._pool_pid = os.getpid()
+            return self._pool
+    
+    @contextmanager
+    def _transaction(self):
+        with self._db_lock:
+            conn = self._db()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+    
+    def object_path(self, digest: bytes) -> Path:
+        hex_digest = digest.hex()
+        return self.objects_dir / hex_digest[:2] / hex_digest
+    
+    def manifest_path(self, file_id: str) -> Path:
+        return self.manifests_dir / fanout_relpath(file_id)
+    
+    def _write_atomic(self, path: Path, data: bytes):
+        if path.parent not in self._known_dirs:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._known_dirs.add(path.parent)
+        tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        try:
+            f = open(tmp_path, 'wb')
+        except FileNotFoundError:
+            # 目录可能已被其他进程清空（clear）后移走
+            path.parent.mkdir(parents=True, exist_ok=True)
+            f = open(tmp_path, 'wb')
+        with f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    
+    def _store(self, file_id: str, batch: List[Tuple[bytes, bytes]]):
+        """登记一批块的引用，缺失的块在同一事务中写入；引用同时记入pending，直到清单写出"""
+        with self._transaction() as conn:
+            now = time.time()
+            conn.executemany('INSERT INTO pending (file_id, hash, started) VALUES (?, ?, ?)',
+                             [(file_id, digest, now) for digest, _ in batch])
+            for digest, data in batch:
+                if conn.execute('UPDATE blocks SET refs = refs + 1 WHERE hash = ?', (digest,)).rowcount:
+                    continue
+                # 进程在写入块文件后、提交前退出会留下没有索引的块文件，这里直接覆盖
+                self._write_atomic(self.object_path(digest), data)
+                conn.execute('INSERT INTO blocks (hash, size, refs) VALUES (?, ?, 1)', (digest, len(data)))
+    
+    def _release(self, digests: List[bytes], defer: bool = False):
+        """释放块引用，引用归零的块从索引和磁盘上移除"""
+        counts: Dict[bytes, int] = {}
+        for digest in digests:
+            counts[digest] = counts.get(digest, 0) + 1
+        with self._transaction() as conn:
+            self._release_in(conn, counts, defer)
+    
+    def _release_in(self, conn: sqlite3.Connection, counts: Dict[bytes, int], defer: bool = False):
+        conn.executemany('UPDATE blocks SET refs = refs - ? WHERE hash = ?',
+                         [(n, digest) for digest, n in counts.items()])
+        unused = [digest for digest in counts
+                  if (conn.execute('SELECT refs FROM blocks WHERE hash = ?', (digest,)).fetchone() or (0,))[0] <= 0]
+        conn.executemany('DELETE FROM blocks WHERE hash = ?', [(digest,) for digest in unused])
+        for digest in unused:
+            if defer:
+                self.cleanup.discard(self.object_path(digest))
+            else:
+                self.object_path(digest).unlink(missing_ok=True)
+    
+    def _release_pending(self, file_id: str):
+        """释放一次未完成写入登记的全部引用"""
+        with self._transaction() as conn:
+            counts: Dict[bytes, int] = {}
+            for (digest,) in conn.execute('SELECT hash FROM pending WHERE file_id = ?', (file_id,)).fetchall():
+                counts[digest] = counts.get(digest, 0) + 1
+            conn.execute('DELETE FROM pending WHERE file_id = ?', (file_id,))
+            self._release_in(conn, counts)
+    
+    def _commit_pending(self, file_id: str):
+        """清单已写出，引用转为由清单持有"""
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM pending WHERE file_id = ?', (file_id,))
+    
+    def sweep_pending(self, max_age: Optional[float] = None) -> int:
+        """
+        释放中断的写入（工作进程在写出清单前被杀掉）登记的引用，返回处理的文件数；
+        已写出清单的只删除pending记录
+        """
+        cutoff = time.time() - (self.PENDING_TTL if max_age is None else max_age)
+        with self._db_lock:
+            stale = [row[0] for row in self._db().execute(
+                'SELECT file_id FROM pending GROUP BY file_id HAVING MAX(started) < ?', (cutoff,)
+            ).fetchall()]
+        for file_id in stale:
+            if self.manifest_path(file_id).exists():
+                self._commit_pending(file_id)
+            else:
+                self._release_pending(file_id)
+                logger.warning(f"释放中断写入的块引用: {file_id}")
+        return len(stale)
+    
+    def _ingest(self, file_id: str, blocks, hash_md5=None) -> int:
+        """切分、登记并写入块清单，返回字节数；失败时释放已登记的引用（进程被杀掉时由 sweep_pending 释放）"""
+        def tap(source):
+            for block in source:
+                hash_md5.update(block)
+                yield block
         
-        # 高级配置
-        # 修改：将清理间隔从15分钟改为5分钟，确保文件过期后能更及时被清理
-        self.clean_interval = int(os.getenv('TEMPSTORE_CLEAN_INTERVAL', '3600'))  # 60分钟
-        self.session_timeout = int(os.getenv('TEMPSTORE_SESSION_TIMEOUT', '1800'))  # 30分钟
-        self.max_file_size = self._parse_size(os.getenv('TEMPSTORE_MAX_FILE_SIZE', '1GB'))
-        self.max_files_per_upload = int(os.getenv('TEMPSTORE_MAX_FILES_PER_UPLOAD', '10'))
-        self.file_expire_hours = int(os.getenv('TEMPSTORE_FILE_EXPIRE_HOURS', '24'))
+        size = 0
+        entries: List[Tuple[bytes, int]] = []
+        batch: List[Tuple[bytes, bytes]] = []
+        try:
+            for chunk in self.chunker.split(tap(blocks) if hash_md5 is not None else blocks, self._executor()):
+                digest = hashlib.sha256(chunk).digest()
+                entries.append((digest, len(chunk)))
+                batch.append((digest, chunk))
+                size += len(chunk)
+                if len(batch) >= self.BATCH_BLOCKS:
+                    self._store(file_id, batch)
+                    batch = []
+            if batch:
+                self._store(file_id, batch)
+                batch = []
+            self._write_atomic(self.manifest_path(file_id),
+                               b''.join(self.ENTRY.pack(digest, length) for digest, length in entries))
+        except Exception as exc:
+            if isinstance(exc, BrokenProcessPool):
+                # 子进程异常退出后进程池不可再用，下次上传时重建
+                with self._pool_lock:
+                    self._pool = None
+            try:
+                self._release_pending(file_id)
+            except Exception as e:
+                logger.error(f"释放块引用失败 {file_id}: {e}")
+            raise
+        try:
+            self._commit_pending(file_id)
+        except Exception as e:
+            # 清单已经写出，遗留的pending记录由 sweep_pending 删除
+            logger.warning(f"清除写入登记失败 {file_id}: {e}")
+        return size
+    
+    def read_manifest(self, file_id: str) -> Optional[List[Tuple[bytes, int]]]:
+        try:
+            with open(self.manifest_path(file_id), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        return list(self.ENTRY.iter_unpack(data))
+    
+    def read_block(self, digest: bytes) -> bytes:
+        try:
+            with open(self.object_path(digest), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            raise StorageError(f"数据块缺失: {digest.hex()}")
+    
+    def save(self, file_id: str, upload_time: int, stream) -> Tuple[int, str]:
+        hash_md5 = hashlib.md5()
+        size = self._ingest(file_id, iter(lambda: stream.read(self.BLOCK_SIZE), b''), hash_md5)
+        return size, hash_md5.hexdigest()
+    
+    def save_parts(self, file_id: str, upload_time: int, part_paths: List[Path]) -> int:
+        return self._ingest(file_id, self._iter_parts(part_paths))
+    
+    def exists(self, file_id: str, upload_time: int) -> bool:
+        return self.manifest_path(file_id).exists()
+    
+    def open(self, file_id: str, upload_time: int):
+        entries = self.read_manifest(file_id)
+        if entries is None:
+            return None
+        return io.BufferedReader(BlockReader(self, entries), self.BLOCK_SIZE)
+    
+    def send(self, file_id: str, upload_time: int, download_name: str, mimetype: str) -> Optional[Response]:
+        entries = self.read_manifest(file_id)
+        if entries is None:
+            return None
+        offsets = [0]
+        for _, length in entries:
+            offsets.append(offsets[-1] + length)
+        total = offsets[-1]
         
-        # 安全配置
-        self.allowed_extensions = set()
-        self.blocked_extensions = {'.exe', '.bat', '.cmd', '.com', '.scr', '.vbs', '.js'}
+        start, stop = 0, total
+        byte_range = request.range.range_for_length(total) if request.range else None
+        if request.range and byte_range is None:
+            return Response(status=416, headers={'Content-Range': f'bytes */{total}'})
+        if byte_range:
+            start, stop = byte_range
+        first = bisect.bisect_right(offsets, start) - 1
+        last = bisect.bisect_left(offsets, stop)
+        body = BlockStream(self, entries[first:last], start - offsets[first], stop - start)
         
-    def _parse_size(self, size_str: str) -> int:
-        """解析文件大小字符串"""
-        size_str = size_str.upper()
-        if size_str.endswith('GB'):
-            return int(size_str[:-2]) * 1024 * 1024 * 1024
-        elif size_str.endswith('MB'):
-            return int(size_str[:-2]) * 1024 * 1024
-        elif size_str.endswith('KB'):
-            return int(size_str[:-2]) * 1024
-        else:
-            return int(size_str)
+        response = Response(body, status=206 if byte_range else 200, mimetype=mimetype, direct_passthrough=True)
+        response.headers['Content-Length'] = str(stop - start)
+        if byte_range:
+            response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{total}'
+        response.headers['Accept-Ranges'] = 'bytes'
+        response.headers['Content-Disposition'] = self.attachment_header(download_name)
+        return response
     
-    def to_dict(self) -> Dict[str, Any]:
-        """转换为字典"""
+    def delete(self, file_id: str, upload_time: int, defer: bool = False):
+        manifest_path = self.manifest_path(file_id)
+        entries = self.read_manifest(file_id)
+        if entries is None:
+            return
+        try:
+            manifest_path.unlink()
+        except FileNotFoundError:
+            return  # 并发删除，引用已由另一方释放
+        self._release([digest for digest, _ in entries], defer)
+    
+    def usage(self) -> int:
+        """去重后实际保存的块字节数"""
+        with self._db_lock:
+            return self._db().execute('SELECT COALESCE(SUM(size), 0) FROM blocks').fetchone()[0]
+    
+    def dedup_stats(self) -> Dict[str, Any]:
+        """块数、实际字节数、按引用计的逻辑字节数和去重比"""
+        with self._db_lock:
+            blocks, stored, logical = self._db().execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(size * refs), 0) FROM blocks'
+            ).fetchone()
         return {
-            'max_file_size': self.max_file_size,
-            'max_storage': self.max_storage,
-            'file_expire_hours': self.file_expire_hours,
-            'max_files_per_upload': self.max_files_per_upload,
-            'clean_interval': self.clean_interval
+            'blocks': blocks,
+            'stored_bytes': stored,
+            'logical_bytes': logical,
+            'dedup_ratio': round(logical / stored, 3) if stored else 1.0,
         }
+    
+    def clear(self) -> List[Dict[str, str]]:
+        """在写事务中把块目录和清单目录整体移入回收目录并清空索引"""
+        errors = []
+        with self._transaction() as conn:
+            for data_dir in (self.objects_dir, self.manifests_dir):
+                try:
+                    self.cleanup.discard(data_dir)
+                except Exception as e:
+                    logger.error(f"清理存储目录失败 {data_dir}: {e}")
+                    errors.append({'path': data_dir.name, 'error': str(e)})
+                data_dir.mkdir(parents=True, exist_ok=True)
+            conn.execute('DELETE FROM blocks')
+            conn.execute('DELETE FROM pending')
+            self._known_dirs.clear()
+        return errors
 
-class FileMetadata:
-    """文件元数据管理"""
+
+class ClusterError(Exception):
+    """集群节点请求失败"""
+
+
+class ClusterRing:
+    """
+    集群成员与一致性哈希环
+    每个节点在环上放置 VNODES 个虚拟节点，新文件按文件ID在环上的位置决定归属节点；
+    归属节点名同时写入文件ID前缀（<节点名>-<随机串>），之后增删节点也不会改变已有文件的位置
+    """
     
-    def __init__(self, file_id: str, original_name: str, file_size: int, 
-                 file_type: str, upload_time: int, expire_time: int,
-                 md5_hash: str = "", download_count: int = 0, is_deleted: bool = False):
-        self.file_id = file_id
-        self.original_name = original_name
-        self.file_size = file_size
-        self.file_type = file_type
-        self.upload_time = upload_time
-        self.expire_time = expire_time
-        self.md5_hash = md5_hash
-        self.download_count = download_count
-        self.is_deleted = is_deleted
+    VNODES = 128
+    FORWARDED_HEADER = 'X-JackDisk-Forwarded'  # 已被其他节点转发过的请求，只在本节点处理
+    SECRET_HEADER = 'X-JackDisk-Cluster-Secret'
+    HOP_BY_HOP = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+                  'te', 'trailers', 'transfer-encoding', 'upgrade'}
     
-    def to_dict(self) -> Dict[str, Any]:
-        return {
-            'file_id': self.file_id,
-            'original_name': self.original_name,
-            'file_size': self.file_size,
-            'file_type': self.file_type,
-            'upload_time': self.upload_time,
-            'expire_time': self.expire_time,
-            'md5_hash': self.md5_hash,
-            'download_count': self.download_count,
-            'is_deleted': self.is_deleted
-        }
+    def __init__(self, node_id: str, nodes: Dict[str, str], timeout: float = 3, proxy_timeout: float = 60,
+                 secret: str = ''):
+        if node_id not in nodes:
+            raise ValueError(f"节点 {node_id} 不在集群节点列表中")
+        self.node_id = node_id
+        self.nodes = nodes
+        self.timeout = timeout
+        self.proxy_timeout = proxy_timeout
+        self.secret = secret
+        self._ring = sorted((self._hash(f"{name}#{i}"), name) for name in nodes for i in range(self.VNODES))
+        self._ring_keys = [point for point, _ in self._ring]
+    
+    @staticmethod
+    def parse_nodes(spec: str) -> Dict[str, str]:
+        """解析节点列表，格式 a=http://10.0.0.1:5000,b=http://10.0.0.2:5000"""
+        nodes = {}
+        for item in spec.split(','):
+            if not item.strip():
+                continue
+            name, sep, url = item.strip().partition('=')
+            name = name.strip()
+            if not sep or not name.isalnum() or not url.strip().startswith(('http://', 'https://')):
+                raise ValueError(f"无效的集群节点配置: {item}")
+            nodes[name] = url.strip().rstrip('/')
+        return nodes
+    
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+    
+    def place(self, key: str) -> str:
+        """一致性哈希：返回key在环上顺时针方向的第一个节点"""
+        index = bisect.bisect(self._ring_keys, self._hash(key)) % len(self._ring)
+        return self._ring[index][1]
+    
+    def owner_of(self, object_id: str) -> str:
+        """从文件ID/上传ID前缀取归属节点，没有前缀的旧ID属于本节点"""
+        node, sep, _ = (object_id or '').partition('-')
+        return node if sep and node in self.nodes else self.node_id
+    
+    def new_id(self) -> str:
+        """生成归属本节点的ID：随机串在环上也落在本节点，前缀记录归属"""
+        for _ in range(64):
+            suffix = uuid.uuid4().hex[:8]
+            if self.place(suffix) == self.node_id:
+                break
+        return f"{self.node_id}-{suffix}"
+    
+    def open(self, node: str, method: str, path: str, headers: List[Tuple[str, str]],
+             body=None, content_length: Optional[int] = None, timeout: Optional[float] = None):
+        """
+        向节点发送请求，body可以是bytes或可读流（按content_length流式转发），返回 (连接, 响应)
+        调用方负责读完响应并关闭连接
+        """
+        parts = urlsplit(self.nodes[node])
+        conn_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        conn = conn_class(parts.hostname, parts.port, timeout=timeout or self.timeout)
+        try:
+            conn.putrequest(method, path, skip_host=True, skip_accept_encoding=True)
+            conn.putheader('Host', parts.netloc)
+            for name, value in headers:
+                conn.putheader(name, value)
+            conn.putheader(self.FORWARDED_HEADER, self.node_id)
+            if self.secret:
+                conn.putheader(self.SECRET_HEADER, self.secret)
+            if isinstance(body, bytes):
+                content_length = len(body)
+            if content_length is not None or method in ('POST', 'PUT'):
+                conn.putheader('Content-Length', str(content_length or 0))
+            conn.endheaders()
+            if isinstance(body, bytes):
+                conn.send(body)
+            elif body is not None and content_length:
+                remaining = content_length
+                while remaining > 0:
+                    block = body.read(min(remaining, HTTPBody.BLOCK_SIZE))
+                    if not block:
+                        break
+                    conn.send(block)
+                    remaining -= len(block)
+            return conn, conn.getresponse()
+        except Exception:
+            conn.close()
+            raise
+    
+    def fetch_json(self, node: str, method: str, path: str, headers: List[Tuple[str, str]],
+                   body: Optional[bytes] = None, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """发送请求并解析JSON响应（自动解压gzip）"""
+        conn, response = self.open(node, method, path, headers, body, timeout=timeout)
+        try:
+            data = response.read()
+        finally:
+            conn.close()
+        if response.getheader('Content-Encoding') == 'gzip':
+            data = gzip.decompress(data)
+        result = json.loads(data)
+        if response.status >= 400:
+            raise ClusterError(f"节点 {node} 返回 {response.status}: {result.get('message', '')}")
+        return result
+    
+    def is_trusted(self, headers) -> bool:
+        """请求是否来自配置了相同密钥的集群节点"""
+        return bool(self.secret) and hmac.compare_digest(headers.get(self.SECRET_HEADER, ''), self.secret)
+
+
+class DerivedAssetCache:
+    """
+    派生资源缓存（缩略图）：derived/thumbs/ab/cd/<file_id>.jpg，
+    derived/index.db 记录每个资源的大小和最近访问时间，总量超过上限时按最久未访问的顺序淘汰；
+    缓存内容都能从原文件重新生成，被淘汰不影响文件本身
+    """
+    
+    TOUCH_INTERVAL = 300  # 访问时间的最短更新间隔（秒），避免每次读取都写数据库
+    
+    def __init__(self, root: Path, max_bytes: int, cleanup: 'CleanupEngine'):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.cleanup = cleanup
+        self.thumbs_dir = root / 'thumbs'
+        self.tmp_dir = root / 'tmp'
+        self.thumbs_dir.mkdir(parents=True, exist_ok=True)
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        self._db_lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        conn = self._db()
+        conn.execute('CREATE TABLE IF NOT EXISTS assets (file_id TEXT PRIMARY KEY, size INTEGER, accessed REAL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_assets_accessed ON assets (accessed)')
+        # 进程中途退出时留下的临时文件
+        stale_before = time.time() - 3600
+        with os.scandir(self.tmp_dir) as entries:
+            for entry in entries:
+                try:
+                    if entry.stat().st_mtime < stale_before:
+                        os.unlink(entry.path)
+                except OSError:
+                    continue
+    
+    def _db(self) -> sqlite3.Connection:
+        # 连接不能跨fork共用，每个工作进程各自打开
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(str(self.root / 'index.db'), timeout=5.0, isolation_level=None,
+                                         check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn_pid = os.getpid()
+        return self._conn
+    
+    def thumbnail_path(self, file_id: str, create: bool = False) -> Path:
+        path = self.thumbs_dir / fanout_relpath(file_id).with_suffix('.jpg')
+        if create:
+            path.parent.mkdir(parents=True, exist_ok=True)
+        return path
+    
+    def temp_path(self, name: str) -> Path:
+        return self.tmp_dir / f"{name}.{uuid.uuid4().hex[:8]}"
+    
+    def add(self, file_id: str):
+        """登记已生成的缩略图，超出容量时淘汰最久未访问的资源"""
+        try:
+            size = self.thumbnail_path(file_id).stat().st_size
+        except FileNotFoundError:
+            return
+        evicted = []
+        with self._db_lock:
+            conn = self._db()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('INSERT OR REPLACE INTO assets (file_id, size, accessed) VALUES (?, ?, ?)',
+                             (file_id, size, time.time()))
+                total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM assets').fetchone()[0]
+                if self.max_bytes > 0 and total > self.max_bytes:
+                    for old_id, old_size in conn.execute('SELECT file_id, size FROM assets ORDER BY accessed'):
+                        if total <= self.max_bytes:
+                            break
+                        evicted.append(old_id)
+                        total -= old_size
+                    conn.executemany('DELETE FROM assets WHERE file_id = ?', [(old_id,) for old_id in evicted])
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        for old_id in evicted:
+            self.thumbnail_path(old_id).unlink(missing_ok=True)
+    
+    def get(self, file_id: str) -> Optional[Path]:
+        """缩略图路径，不存在（未生成或已淘汰）时返回None"""
+        with self._db_lock:
+            row = self._db().execute('SELECT accessed FROM assets WHERE file_id = ?', (file_id,)).fetchone()
+        if row is None:
+            return None
+        path = self.thumbnail_path(file_id)
+        if not path.exists():
+            self.remove(file_id)
+            return None
+        now = time.time()
+        if now - row[0] > self.TOUCH_INTERVAL:
+            with self._db_lock:
+                self._db().execute('UPDATE assets SET accessed = ? WHERE file_id = ?', (now, file_id))
+        return path
+    
+    def remove(self, file_id: str):
+        with self._db_lock:
+            self._db().execute('DELETE FROM assets WHERE file_id = ?', (file_id,))
+        self.thumbnail_path(file_id).unlink(missing_ok=True)
+    
+    def clear(self):
+        with self._db_lock:
+            self._db().execute('DELETE FROM assets')
+        self.cleanup.discard(self.thumbs_dir)
+        self.thumbs_dir.mkdir(parents=True, exist_ok=True)
+    
+    def stats(self) -> Dict[str, int]:
+        with self._db_lock:
+            count, size = self._db().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM assets').fetchone()
+        return {'assets': count, 'bytes': size, 'max_bytes': self.max_bytes}
+
+
+class MediaPipeline:
+    """
+    上传后的媒体处理：在有界进程池中提取媒体信息、生成缩略图，请求线程只登记任务，上传耗时不变。
+    登记后由本进程的调度线程准备源文件（后端没有本地路径时先复制到临时文件）并提交给进程池；
+    排队和处理中的任务数有上限，超出时直接放弃（缩略图接口会在访问时重新登记）。进程池按工作进程创建，fork后重建
+    """
+    
+    def __init__(self, storage: StorageBackend, cache: DerivedAssetCache, workers: int = 2, max_pending: int = 100,
+                 thumbnail_size: int = 256, max_source_size: int = 50 * 1024 * 1024):
+        self.storage = storage
+        self.cache = cache
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.thumbnail_size = thumbnail_size
+        self.max_source_size = max_source_size
+        self.on_done = None  # 回调: on_done(file_id: str, result: Dict[str, Any])
+        self._lock = threading.Lock()
+        self._pending: set = set()
+        self._queue: Optional[queue.Queue] = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pid = None
+    
+    def submit(self, file_id: str, upload_time: int, file_type: str, file_size: int) -> bool:
+        """登记处理任务（不阻塞），已在处理或队列已满时返回False"""
+        if not probe_supported(file_type):
+            return False
+        if file_type.startswith('image/') and file_size > self.max_source_size:
+            return False
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pending = set()
+                self._queue = queue.Queue()
+                self._pool = None
+                self._pid = os.getpid()
+                threading.Thread(target=self._dispatch_loop, args=(self._queue,), name='media-dispatcher',
+                                 daemon=True).start()
+            if file_id in self._pending or len(self._pending) >= self.max_pending:
+                return False
+            self._pending.add(file_id)
+        self._queue.put((file_id, upload_time, file_type, file_size))
+        return True
+    
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # forkserver：子进程从干净的服务进程派生，不继承Web工作进程的线程和锁
+            try:
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload(['media_probe'])
+            except ValueError:
+                context = multiprocessing.get_context()
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        return self._pool
+    
+    def _dispatch_loop(self, pending: queue.Queue):
+        while True:
+            file_id, upload_time, file_type, file_size = pending.get()
+            try:
+                self._start(file_id, upload_time, file_type, file_size)
+            except Exception as e:
+                logger.error(f"提交媒体处理失败 {file_id}: {e}")
+                self._finish(file_id)
+    
+    def _start(self, file_id: str, upload_time: int, file_type: str, file_size: int):
+        source = self.storage.local_path(file_id, upload_time)
+        spooled = None
+        if source is None:
+            if file_size > self.max_source_size:
+                self._finish(file_id)
+                return
+            stream = self.storage.open(file_id, upload_time)
+            if stream is None:
+                self._finish(file_id)
+                return
+            spooled = self.cache.temp_path(file_id)
+            try:
+                with open(spooled, 'wb') as f:
+                    shutil.copyfileobj(stream, f, StorageBackend.BLOCK_SIZE)
+            finally:
+                stream.close()
+            source = spooled
+        
+        thumbnail = None
+        if file_type.startswith('image/') and thumbnails_supported():
+            thumbnail = str(self.cache.thumbnail_path(file_id, create=True))
+        future = self._get_pool().submit(process_media, str(source), file_type, thumbnail, self.thumbnail_size)
+        future.add_done_callback(lambda f: self._finish(file_id, f, spooled))
+    
+    def _finish(self, file_id: str, future=None, spooled: Optional[Path] = None):
+        try:
+            if spooled is not None:
+                spooled.unlink(missing_ok=True)
+            if future is not None:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error(f"媒体处理失败 {file_id}: {e}")
+                    # 进程池中的子进程异常退出后进程池不再可用，下次提交时重建
+                    with self._lock:
+                        broken, self._pool = self._pool, None
+                    if broken is not None:
+                        broken.shutdown(wait=False)
+                    return
+                if result.get('error'):
+                    logger.warning(f"媒体处理失败 {file_id}: {result['error']}")
+                if result.get('thumbnail'):
+                    self.cache.add(file_id)
+                if self.on_done:
+                    self.on_done(file_id, result)
+        except Exception as e:
+            logger.error(f"保存媒体处理结果失败 {file_id}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(file_id)
+
 
 class JackDisk:
     """Jack-Disk核心类"""
@@ -159,12 +4036,95 @@ class JackDisk:
         # 初始化上传目录
         Path(self.config.upload_dir).mkdir(exist_ok=True)
         
+        # 共享运行时配置（管理员修改后同步到所有工作进程）
+        self.shared_config = SharedConfigStore(Path(self.config.upload_dir))
+        self._config_generation = -1
+        self._sync_shared_config()
+        
+        self._migration_thread: Optional[threading.Thread] = None
+        self._migration_result: Optional[Dict[str, int]] = None
+        # 分片上传信息（upload_info.json）读改写的进程内互斥，跨进程另加文件锁
+        self._upload_info_lock = threading.Lock()
+        # 元数据保存（定时任务、批量接口和退出时可能同时触发）的进程内互斥
+        self._metadata_save_lock = threading.Lock()
+        
+        # 指标收集（跨工作进程聚合）
+        self.metrics = MetricsRegistry(Path(self.config.metrics_dir))
+        
+        # 请求性能分析（管理员按需开启）
+        self.profiler = RequestProfiler(Path(self.config.upload_dir) / 'profiles', self.config.max_profiles)
+        
+        # 元数据代数：上传、删除、过期、延期、下载计数和配置变化时递增，驱动ETag和响应缓存
+        self.generation = 0
+        self._response_cache: OrderedDict = OrderedDict()
+        self._response_cache_lock = threading.Lock()  # 同一进程的多个请求线程共用缓存
+        
         # 文件元数据缓存
-        self.file_metadata: Dict[str, FileMetadata] = {}
+        self.file_metadata: LazyMetadataMap = LazyMetadataMap()
         self.metadata_file = Path(self.config.upload_dir) / 'metadata.json'
+        self.snapshot_file = Path(self.config.upload_dir) / 'metadata.snap'
+        
+        # 静态资源（预压缩、带指纹，常驻内存）
+        with self.app.app_context():
+            index_html = render_template('index.html')
+        self.static_assets = StaticAssets(Path(self.app.root_path), index_html)
+        
+        # 实时事件推送
+        self.events = EventBus(Path(self.config.upload_dir))
+        
+        # 后台删除引擎（限速并行删除，重启后继续）
+        self.cleanup = CleanupEngine(
+            Path(self.config.upload_dir) / 'trash', self.config.cleanup_workers,
+            self.config.cleanup_files_per_sec, self.config.cleanup_bytes_per_sec
+        )
+        self.cleanup.kick()
+        
+        # 文件内容存储后端
+        self.storage = self._create_storage()
+        
+        # 派生资源（缩略图）缓存和上传后的媒体处理
+        self.derived = DerivedAssetCache(Path(self.config.upload_dir) / 'derived', self.config.derived_cache_size,
+                                         self.cleanup)
+        self.media: Optional[MediaPipeline] = None
+        if self.config.media_workers > 0:
+            self.media = MediaPipeline(self.storage, self.derived, self.config.media_workers,
+                                       self.config.media_max_pending, self.config.thumbnail_size,
+                                       self.config.media_max_source)
+            self.media.on_done = self._apply_media_result
+        
+        # 集群（未配置节点列表时为None）
+        self.cluster: Optional[ClusterRing] = None
+        if self.config.cluster_nodes:
+            if not self.config.cluster_secret:
+                # 没有密钥就无法区分节点转发和伪造了转发头的外部请求
+                raise ValueError("集群模式需要设置节点间共享密钥 TEMPSTORE_CLUSTER_SECRET")
+            self.cluster = ClusterRing(
+                self.config.node_id, ClusterRing.parse_nodes(self.config.cluster_nodes),
+                self.config.cluster_timeout, self.config.cluster_proxy_timeout, self.config.cluster_secret
+            )
+            logger.info(f"集群模式: 本节点 {self.cluster.node_id}，共 {len(self.cluster.nodes)} 个节点")
+        
+        # 上传空间预留（准入控制）
+        self.reservations = SpaceReservations(
+            Path(self.config.upload_dir) / 'reservations', self.config.reservation_ttl
+        )
+        
+        # 日志查询
+        self.log_reader = LogReader(LOG_FILE)
+        
+        # 客户端限流（跨工作进程共享）
+        self.rate_limiter = RateLimiter(Path(self.config.upload_dir) / 'ratelimit.db')
+        
+        # 下载计数和统计信息（延迟批量持久化，跨工作进程共享）
+        self._synced_stats: Dict[str, int] = {}
+        self.counters = CounterStore(Path(self.config.upload_dir) / 'counters.db', self.config.counter_flush_interval)
+        self.counters.on_sync = self._apply_counter_sync
         
         # 加载元数据
         self._load_metadata()
+        self.counters.seed_downloads(self.file_metadata.download_counts())
+        self.counters.flush()
+        atexit.register(self.counters.flush)
         
         # 初始化定时任务
         self.scheduler = BackgroundScheduler()
@@ -173,32 +4133,151 @@ class JackDisk:
         # 注册路由
         self._register_routes()
         
-        # 统计信息
+        # 统计信息（上传下载总数由self.counters持久化）
         self.stats = {
-            'total_uploads': 0,
-            'total_downloads': 0,
             'total_files': 0,
             'storage_used': 0
         }
     
+    def _sync_shared_config(self):
+        """代数变化时重新加载共享配置（每个请求开始时调用）"""
+        generation = self.shared_config.generation
+        if generation == self._config_generation:
+            return
+        try:
+            values = self.shared_config.load()
+        except (OSError, ValueError) as e:
+            logger.warning(f"加载共享配置失败: {e}")
+            return
+        if values:
+            self._apply_config(values)
+        self._config_generation = generation
+    
+    def _apply_config(self, values: Dict[str, Any]):
+        """把配置应用到本进程"""
+        old_clean_interval = self.config.clean_interval
+        for key, value in values.items():
+            setattr(self.config, key, int(value))
+        # 同步更新Flask应用的MAX_CONTENT_LENGTH
+        self.app.config['MAX_CONTENT_LENGTH'] = self.config.max_file_size + 100 * 1024 * 1024  # 增加100MB余量
+        
+        scheduler = getattr(self, 'scheduler', None)
+        if scheduler is not None and scheduler.running and self.config.clean_interval != old_clean_interval:
+            try:
+                scheduler.reschedule_job('cleanup_expired_files',
+                                         trigger=IntervalTrigger(seconds=self.config.clean_interval))
+            except Exception as e:
+                logger.warning(f"调整清理间隔失败: {e}")
+    
+    def _apply_counter_sync(self, file_counts: Dict[str, int], stats: Dict[str, int]):
+        """把持久化的下载计数合并到内存元数据（加上本进程尚未持久化的增量）"""
+        for file_id, count in file_counts.items():
+            metadata = self.file_metadata.get(file_id)
+            if metadata is not None:
+                metadata.download_count = count + self.counters.pending_for(file_id)
+        if file_counts or stats != self._synced_stats:
+            self._synced_stats = stats
+            self._bump_generation()
+    
+    def _bump_generation(self):
+        """元数据发生变化，之前的ETag和缓存的响应全部失效"""
+        self.generation += 1
+    
+    def _cached_json(self, key: str, build):
+        """
+        带缓存和条件请求的JSON响应
+        build() 返回 (响应数据, 有效截止时间)，缓存按 (元数据代数, 配置代数) 和截止时间失效；
+        ETag取自响应内容的哈希，各工作进程一致，客户端带If-None-Match且未变化时返回304
+        """
+        cache_key = (key, tuple(sorted(request.args.items(multi=True))))
+        generation = (self.generation, self._config_generation)
+        now = time.time()
+        with self._response_cache_lock:
+            entry = self._response_cache.get(cache_key)
+            hit = entry is not None and entry[0] == generation and now < entry[1]
+            if hit:
+                self._response_cache.move_to_end(cache_key)
+        if not hit:
+            # 在锁外生成，慢查询不阻塞其他请求
+            payload, valid_until = build()
+            # build() 可以直接返回编码好的JSON字符串
+            body = payload if isinstance(payload, str) else self.app.json.dumps(payload)
+            body = body.encode('utf-8')
+            etag = hashlib.md5(body).hexdigest()
+            entry = [generation, min(valid_until, now + self.config.response_cache_ttl), body, etag, None]
+            with self._response_cache_lock:
+                current = self._response_cache.get(cache_key)
+                if current is not None and current[0] == generation and time.time() < current[1]:
+                    # 其他线程已经生成了同一代数的结果，沿用它（连同已压缩的内容）
+                    entry = current
+                else:
+                    self._response_cache[cache_key] = entry
+                self._response_cache.move_to_end(cache_key)
+                while len(self._response_cache) > 64:
+                    self._response_cache.popitem(last=False)
+        self.metrics.inc('jackdisk_response_cache_total', route=key, result='hit' if hit else 'miss')
+        
+        if len(entry[2]) >= self.config.gzip_min_size and request.accept_encodings['gzip']:
+            # 压缩结果随缓存项保存，命中缓存时不再重复压缩
+            if entry[4] is None:
+                entry[4] = gzip.compress(entry[2], compresslevel=6)
+            response = Response(entry[4], mimetype='application/json')
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = Response(entry[2], mimetype='application/json')
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.set_etag(entry[3], weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+    
+    def _next_midnight(self) -> float:
+        return (datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)).timestamp()
+    
     def _load_metadata(self):
-        """加载文件元数据"""
+        """加载文件元数据（优先映射二进制快照，快照过期时解析metadata.json并重建快照）"""
         try:
             if self.metadata_file.exists():
+                snapshot = MetadataSnapshot.open_if_fresh(self.snapshot_file, self.metadata_file.stat())
+                if snapshot is not None:
+                    self.file_metadata = LazyMetadataMap(snapshot)
+                    logger.info(f"从快照映射了 {len(self.file_metadata)} 个文件的元数据")
+                    return
+                
                 with open(self.metadata_file, 'r', encoding='utf-8') as f:
                     data = json.load(f)
-                    for file_id, meta in data.items():
-                        self.file_metadata[file_id] = FileMetadata(**meta)
-                logger.info(f"加载了 {len(self.file_metadata)} 个文件的元数据")
+                    loaded = [(file_id, FileMetadata(**meta)) for file_id, meta in data.items()]
+                logger.info(f"加载了 {len(loaded)} 个文件的元数据")
+                self._write_snapshot(loaded)
+                # 改为映射刚生成的快照，文件列表和统计直接读快照的列，解析出的对象随之释放
+                snapshot = MetadataSnapshot.open_if_fresh(self.snapshot_file, self.metadata_file.stat())
+                if snapshot is not None:
+                    self.file_metadata = LazyMetadataMap(snapshot)
+                else:
+                    for file_id, metadata in loaded:
+                        self.file_metadata[file_id] = metadata
         except Exception as e:
             logger.error(f"加载元数据失败: {e}")
     
+    def _write_snapshot(self, items: List[Tuple[str, FileMetadata]]):
+        """按刚写入或读出metadata.json时的元数据生成快照，供下次启动直接映射"""
+        try:
+            MetadataSnapshot.write(self.snapshot_file, items, self.metadata_file.stat())
+        except Exception as e:
+            logger.warning(f"生成元数据快照失败: {e}")
+    
     def _save_metadata(self):
         """保存文件元数据"""
         try:
-            data = {file_id: meta.to_dict() for file_id, meta in self.file_metadata.items()}
-            with open(self.metadata_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            with self._metadata_save_lock, self.metrics.time('jackdisk_metadata_persist_duration_seconds'):
+                # 遍历时解码的记录不缓存，取一次同时用于JSON和快照
+                items = list(self.file_metadata.items())
+                data = {file_id: meta.to_dict() for file_id, meta in items}
+                # 写临时文件后原子替换，中途失败不会留下不完整的元数据；临时文件名唯一，并发保存互不覆盖
+                tmp_path = self.metadata_file.parent / f"{self.metadata_file.name}.{uuid.uuid4().hex[:8]}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, self.metadata_file)
+                self._write_snapshot(items)
         except Exception as e:
             logger.error(f"保存元数据失败: {e}")
     
@@ -231,114 +4310,705 @@ class JackDisk:
             replace_existing=True
         )
         
+        # 清理计数批次登记任务
+        self.scheduler.add_job(
+            func=self.counters.prune_batches,
+            trigger=IntervalTrigger(seconds=3600),
+            id='prune_counter_batches',
+            name='清理计数批次登记',
+            replace_existing=True
+        )
+        
+        # 清理限流状态任务
+        self.scheduler.add_job(
+            func=self.rate_limiter.purge,
+            trigger=IntervalTrigger(seconds=3600),
+            id='purge_rate_limits',
+            name='清理限流状态',
+            replace_existing=True
+        )
+        
+        # 冷热分层迁移任务
+        if self._tiered_storage() is not None:
+            self.scheduler.add_job(
+                func=self._demote_cold_files,
+                trigger=IntervalTrigger(seconds=self.config.tier_interval),
+                id='demote_cold_files',
+                name='迁移冷文件',
+                replace_existing=True
+            )
+        
+        # 释放中断的去重写入登记的块引用
+        if isinstance(self.storage, DedupStorage):
+            self.scheduler.add_job(
+                func=self.storage.sweep_pending,
+                trigger=IntervalTrigger(seconds=3600),
+                id='sweep_dedup_pending',
+                name='释放中断写入的块引用',
+                replace_existing=True
+            )
+        
+        # 小文件打包段压缩任务
+        if isinstance(self.storage, PackedStorage):
+            self.scheduler.add_job(
+                func=self._compact_packs,
+                trigger=IntervalTrigger(seconds=self.config.pack_compact_interval),
+                id='compact_packs',
+                name='压缩打包段',
+                replace_existing=True
+            )
+        
         self.scheduler.start()
-        logger.info("定时任务已启动")
+        logger.info("定时任务已启动", extra={'event': 'scheduler.start'})
     
+    @_timed_task('cleanup_expired_files')
     def _cleanup_expired_files(self):
         """清理过期文件"""
         try:
             current_time = int(time.time())
             expired_files = []
             
-            # 找出过期文件
-            for file_id, metadata in self.file_metadata.items():
-                if metadata.expire_time < current_time and not metadata.is_deleted:
-                    expired_files.append(file_id)
+            # 找出过期文件（按过期时间顺序，遇到未过期的即停止）
+            for expire_time, file_id, _ in self.file_metadata.by_expire_time():
+                if expire_time >= current_time:
+                    break
+                expired_files.append(file_id)
             
-            # 删除过期文件
+            # 删除过期文件（物理文件由后台删除引擎限速删除）
             for file_id in expired_files:
-                self._delete_file(file_id)
+                self._delete_file(file_id, defer=True)
+            if expired_files:
+                self.metrics.inc('jackdisk_evicted_files_total', len(expired_files), reason='expired')
             
             # 检查存储空间
             self._check_storage_limit()
             
             if expired_files:
-                logger.info(f"清理了 {len(expired_files)} 个过期文件")
+                logger.info(f"清理了 {len(expired_files)} 个过期文件", extra={'event': 'cleanup.expired'})
                 
         except Exception as e:
             logger.error(f"清理过期文件失败: {e}")
     
-    def _check_storage_limit(self):
-        """检查存储空间限制"""
+    def _tier_candidates(self) -> List[Tuple[str, int, int]]:
+        """
+        选出要迁移到冷层的热层文件 (file_id, upload_time, 字节数)：
+        在热层停留超过 tier_hot_age（按热层文件的修改时间，提升回热层的文件重新计时）且下载次数少于 tier_hot_downloads 的文件；
+        热层仍超出容量时，再按停留时间从长到短补充
+        """
+        hot = self._tiered_storage().hot
+        current_time = time.time()
+        hot_files = []
+        hot_bytes = 0
+        for file_id, upload_time, download_count in self.file_metadata.active_entries(current_time):
+            path = hot.resolve(file_id, upload_time)
+            if path is None:
+                continue
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            hot_bytes += st.st_size
+            hot_files.append((current_time - st.st_mtime, download_count, file_id, upload_time, st.st_size))
+        
+        hot_files.sort(reverse=True)
+        candidates = []
+        remaining = []
+        for idle, download_count, file_id, upload_time, size in hot_files:
+            if idle >= self.config.tier_hot_age and download_count < self.config.tier_hot_downloads:
+                candidates.append((file_id, upload_time, size))
+                hot_bytes -= size
+            else:
+                remaining.append((file_id, upload_time, size))
+        capacity = self.config.tier_hot_capacity
+        if capacity > 0:
+            for file_id, upload_time, size in remaining:
+                if hot_bytes <= capacity:
+                    break
+                candidates.append((file_id, upload_time, size))
+                hot_bytes -= size
+        return candidates
+    
+    @_timed_task('demote_cold_files')
+    def _demote_cold_files(self):
+        """把热层中不再活跃的文件限速迁移到冷层，同一时刻只有一个进程在迁移"""
+        try:
+            with open(Path(self.config.upload_dir) / 'tier_mover.lock', 'a') as lock_fp:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(lock_fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        return
+                storage = self._tiered_storage()
+                moved = 0
+                moved_bytes = 0
+                for file_id, upload_time, _ in self._tier_candidates():
+                    metadata = self.file_metadata.get(file_id)
+                    if metadata is None or metadata.is_deleted:
+                        continue
+                    try:
+                        nbytes = storage.demote(file_id, upload_time)
+                    except Exception as e:
+                        logger.error(f"迁移文件到冷层失败 {file_id}: {e}")
+                        continue
+                    if nbytes:
+                        moved += 1
+                        moved_bytes += nbytes
+                if moved:
+                    logger.info(f"迁移了 {moved} 个文件到冷层（{self._format_file_size(moved_bytes)}）",
+                                extra={'event': 'storage.demote'})
+        except Exception as e:
+            logger.error(f"迁移冷文件失败: {e}")
+    
+    @_timed_task('compact_packs')
+    def _compact_packs(self):
+        """压缩有效数据比例过低的打包段，同一时刻只有一个进程在压缩"""
+        try:
+            with open(Path(self.config.upload_dir) / 'pack_compactor.lock', 'a') as lock_fp:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(lock_fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        return
+                removed, reclaimed = self.storage.compact(self.config.pack_compact_ratio)
+                if reclaimed:
+                    self.metrics.inc('jackdisk_pack_reclaimed_bytes_total', reclaimed)
+                if removed:
+                    logger.info(f"压缩了 {removed} 个打包段，回收 {self._format_file_size(reclaimed)}",
+                                extra={'event': 'storage.compact'})
+        except Exception as e:
+            logger.error(f"压缩打包段失败: {e}")
+    
+    @_timed_task('check_storage_limit')
+    def _check_storage_limit(self):
+        """检查存储空间限制"""
+        try:
+            total_size = self._get_total_storage_size()
+            if total_size > self.config.max_storage:
+                files_to_clean = self._evict_files(total_size - self.config.max_storage)
+                logger.info(f"存储空间超限，清理了 {len(files_to_clean)} 个文件", extra={'event': 'storage.evict'})
+                
+        except Exception as e:
+            logger.error(f"检查存储空间失败: {e}")
+    
+    def _evict_files(self, bytes_needed: int) -> List[str]:
+        """按过期时间顺序清理文件，直到腾出指定空间，返回被清理的文件ID"""
+        files_to_clean = []
+        if bytes_needed <= 0:
+            return files_to_clean
+        
+        # 按过期时间顺序，优先清理快过期的文件
+        freed = 0
+        for _, file_id, file_size in self.file_metadata.by_expire_time():
+            if freed >= bytes_needed:
+                break
+            files_to_clean.append(file_id)
+            freed += file_size
+        
+        for file_id in files_to_clean:
+            self._delete_file(file_id)
+        if files_to_clean:
+            self.metrics.inc('jackdisk_evicted_files_total', len(files_to_clean), reason='storage_limit')
+        
+        return files_to_clean
+    
+    def _get_disk_free_space(self) -> Optional[int]:
+        """获取上传目录所在文件系统的可用空间（statvfs）"""
+        try:
+            st = os.statvfs(self.config.upload_dir)
+            return st.f_bavail * st.f_frsize
+        except (AttributeError, OSError):
+            # Windows等不支持statvfs的平台
+            try:
+                return shutil.disk_usage(self.config.upload_dir).free
+            except OSError:
+                return None
+    
+    @_timed_task('reserve_space')
+    def _reserve_space(self, key: str, nbytes: int) -> bool:
+        """
+        上传准入控制：在接收数据前按声明大小预留空间
+        同时检查总存储上限和磁盘剩余空间，必要时先清理旧文件腾出空间，无法腾出时拒绝
+        """
+        with self.reservations.locked():
+            reserved, outstanding = self.reservations.totals(exclude=key)
+            
+            # 总存储上限：已存文件 + 其他上传的预留 + 本次
+            quota_shortfall = self._get_total_storage_size() + reserved + nbytes - self.config.max_storage
+            
+            # 磁盘剩余空间：其他上传尚未写入的字节 + 本次 + 保留空间
+            disk_shortfall = 0
+            free_space = self._get_disk_free_space()
+            if free_space is not None:
+                disk_shortfall = outstanding + nbytes + self.config.min_free_space - free_space
+            
+            shortfall = max(quota_shortfall, disk_shortfall)
+            if shortfall > 0:
+                evictable = self._get_total_storage_size()
+                if evictable < shortfall:
+                    logger.warning(f"存储空间不足，拒绝上传: 需要 {nbytes} bytes，缺口 {shortfall} bytes", extra={'event': 'storage.reject'})
+                    return False
+                files_to_clean = self._evict_files(shortfall)
+                logger.info(f"为上传预留空间，清理了 {len(files_to_clean)} 个文件", extra={'event': 'storage.evict'})
+            
+            self.reservations.put(key, nbytes, nbytes)
+            return True
+    
+    def _insufficient_storage_response(self):
+        return jsonify({'status': 'error', 'message': '存储空间不足，请稍后再试'}), 507
+    
+    def _get_total_storage_size(self) -> int:
+        """获取总存储大小（元数据实时累计，不遍历文件）"""
+        return self.file_metadata.stored_bytes()
+    
+    def _get_actual_disk_usage(self) -> int:
+        """获取存储后端实际使用量"""
         try:
-            total_size = self._get_total_storage_size()
-            if total_size > self.config.max_storage:
-                # 需要清理文件
-                files_to_clean = []
-                
-                # 按过期时间排序，优先清理快过期的文件
-                sorted_files = sorted(
-                    [(file_id, meta) for file_id, meta in self.file_metadata.items() 
-                     if not meta.is_deleted],
-                    key=lambda x: x[1].expire_time
-                )
-                
-                # 清理文件直到满足存储限制
-                for file_id, metadata in sorted_files:
-                    if total_size <= self.config.max_storage:
-                        break
-                    
-                    files_to_clean.append(file_id)
-                    total_size -= metadata.file_size
-                
-                # 执行清理
-                for file_id in files_to_clean:
-                    self._delete_file(file_id)
-                
-                logger.info(f"存储空间超限，清理了 {len(files_to_clean)} 个文件")
-                
+            return self.storage.usage()
         except Exception as e:
-            logger.error(f"检查存储空间失败: {e}")
+            logger.error(f"获取存储使用量失败: {e}")
+            return 0
     
-    def _get_total_storage_size(self) -> int:
-        """获取总存储大小"""
-        total_size = 0
-        for metadata in self.file_metadata.values():
-            if not metadata.is_deleted:
-                total_size += metadata.file_size
-        return total_size
+    def _create_storage(self) -> StorageBackend:
+        """按配置创建存储后端"""
+        if self.config.storage_backend == 's3':
+            client = S3Client(
+                self.config.s3_endpoint, self.config.s3_bucket,
+                self.config.s3_access_key, self.config.s3_secret_key,
+                region=self.config.s3_region, pool_size=self.config.s3_pool_size
+            )
+            logger.info(f"使用S3存储后端: {self.config.s3_endpoint}/{self.config.s3_bucket}")
+            return S3Storage(client, self.config.s3_prefix, self.config.s3_part_size, self.config.batch_workers)
+        if self.config.storage_backend == 'dedup':
+            return DedupStorage(Path(self.config.upload_dir) / 'blocks', self.cleanup, self.config.dedup_avg_block,
+                                self.config.dedup_workers)
+        if self.config.storage_backend != 'local':
+            raise ValueError(f"未知的存储后端: {self.config.storage_backend}")
+        storage = LocalStorage(Path(self.config.upload_dir), self.cleanup)
+        if self.config.cold_dir:
+            # 冷层有自己的回收目录：回收依赖同一文件系统内的重命名
+            cold_dir = Path(self.config.cold_dir)
+            cold_cleanup = CleanupEngine(
+                cold_dir / 'trash', self.config.cleanup_workers,
+                self.config.cleanup_files_per_sec, self.config.cleanup_bytes_per_sec
+            )
+            cold_cleanup.kick()
+            storage = TieredStorage(storage, LocalStorage(cold_dir, cold_cleanup),
+                                    Path(self.config.upload_dir) / 'tiering.lock', self.config.tier_bytes_per_sec)
+            storage.on_move = lambda direction, nbytes: (
+                self.metrics.inc('jackdisk_tier_moves_total', direction=direction),
+                self.metrics.inc('jackdisk_tier_moved_bytes_total', nbytes, direction=direction),
+            )
+            logger.info(f"启用冷热分层存储: 热层 {self.config.upload_dir}，冷层 {cold_dir}")
+        if self.config.pack_threshold > 0:
+            # 段文件留在上传目录（热层），不参与冷热迁移
+            storage = PackedStorage(storage, Path(self.config.upload_dir) / 'packs', self.cleanup,
+                                    self.config.pack_threshold, self.config.pack_segment_size)
+            logger.info(f"启用小文件打包: 不超过 {self._format_file_size(self.config.pack_threshold)} 的文件写入段文件")
+        return storage
     
-    def _get_actual_disk_usage(self) -> int:
-        """获取实际磁盘使用量"""
-        total_size = 0
-        upload_path = Path(self.config.upload_dir)
+    def _tiered_storage(self) -> Optional[TieredStorage]:
+        """冷热分层存储（可能包在小文件打包存储内），未分层时返回None"""
+        storage = self.storage.inner if isinstance(self.storage, PackedStorage) else self.storage
+        return storage if isinstance(storage, TieredStorage) else None
+    
+    def _cluster_local(self) -> bool:
+        """单机运行，或请求已由其他节点转发（只处理本节点的数据）；转发头必须带有正确的集群密钥"""
+        return self.cluster is None or (bool(request.headers.get(ClusterRing.FORWARDED_HEADER))
+                                        and self.cluster.is_trusted(request.headers))
+    
+    def _cluster_headers(self, conditional: bool = True) -> List[Tuple[str, str]]:
+        """转发给其他节点的请求头：去掉逐跳头，X-Forwarded-For改为本节点识别出的客户端地址"""
+        skipped = ClusterRing.HOP_BY_HOP | {'host', 'content-length', 'x-forwarded-for', 'x-real-ip',
+                                            ClusterRing.FORWARDED_HEADER.lower(), ClusterRing.SECRET_HEADER.lower()}
+        if not conditional:
+            skipped |= {'if-none-match', 'if-modified-since', 'range', 'if-range'}
+        headers = [(name, value) for name, value in request.headers.items() if name.lower() not in skipped]
+        headers.append(('X-Forwarded-For', self._client_id()))
+        return headers
+    
+    def _request_owner(self) -> Tuple[Optional[str], Optional[bytes]]:
+        """
+        确定请求应由哪个节点处理，返回 (节点名, 已读取的请求体)，None表示不需要路由
+        已有文件和上传任务按ID前缀找归属节点；新上传按一致性哈希选择节点，
+        分片上传按文件名和大小选择，同一文件重新初始化时落在同一节点，可以续传
+        """
+        endpoint = request.endpoint
+        view_args = request.view_args or {}
+        if endpoint in ('download_file', 'preview_file', 'thumbnail_file'):
+            return self.cluster.owner_of(view_args.get('file_id', '')), None
+        if endpoint == 'get_upload_status':
+            return self.cluster.owner_of(view_args.get('upload_id', '')), None
+        if endpoint in ('event_stream', 'event_poll'):
+            upload_id = request.args.get('upload_id')
+            return (self.cluster.owner_of(upload_id), None) if upload_id else (None, None)
+        if endpoint == 'upload_chunk':
+            # 先缓存原始请求体，解析表单后仍可原样转发
+            body = request.get_data(cache=True)
+            return self.cluster.owner_of(request.form.get('upload_id', '')), body
+        if endpoint == 'complete_chunked_upload':
+            data = request.get_json(silent=True) or {}
+            return self.cluster.owner_of(str(data.get('upload_id', ''))), request.get_data(cache=True)
+        if endpoint == 'init_chunked_upload':
+            data = request.get_json(silent=True) or {}
+            return self.cluster.place(f"{data.get('filename')}:{data.get('file_size')}"), request.get_data(cache=True)
+        if endpoint == 'upload_file':
+            return self.cluster.place(uuid.uuid4().hex), None
+        return None, None
+    
+    def _proxy_to(self, node: str, body: Optional[bytes] = None) -> Response:
+        """把当前请求流式转发给节点，响应体边收边发"""
+        path = quote(request.path)
+        if request.query_string:
+            path += '?' + request.query_string.decode('latin-1')
+        if body is None:
+            body, content_length = request.stream, request.content_length
+        else:
+            content_length = len(body)
+        try:
+            conn, upstream = self.cluster.open(node, request.method, path, self._cluster_headers(), body,
+                                               content_length, timeout=self.cluster.proxy_timeout)
+        except OSError as e:
+            logger.error(f"转发请求失败 {node}{path}: {e}")
+            return jsonify({'status': 'error', 'message': '文件所在节点不可用'}), 502
+        headers = [(name, value) for name, value in upstream.getheaders() if name.lower() not in ClusterRing.HOP_BY_HOP]
+        return Response(HTTPBody(conn, upstream), status=upstream.status, headers=headers, direct_passthrough=True)
+    
+    def _cluster_gather(self, path: str, local) -> Dict[str, Optional[Dict[str, Any]]]:
+        """并行查询其他节点（超时或失败的节点结果为None），本节点的结果由local()直接生成"""
+        headers = self._cluster_headers(conditional=False)
+        pool = ThreadPoolExecutor(max_workers=len(self.cluster.nodes))
+        futures = {pool.submit(self.cluster.fetch_json, node, 'GET', path, headers): node
+                   for node in self.cluster.nodes if node != self.cluster.node_id}
+        results = {self.cluster.node_id: local()}
+        done, _ = wait(futures, timeout=self.cluster.timeout)
+        # 不等待超时的节点，其套接字超时后线程自行结束
+        pool.shutdown(wait=False)
+        for future, node in futures.items():
+            if future in done and future.exception() is None:
+                results[node] = future.result()
+            else:
+                results[node] = None
+                error = future.exception() if future in done else '超时'
+                logger.warning(f"集群节点查询失败 {node}{path}: {error}")
+        return results
+    
+    def _cluster_batch(self, file_ids: List[str], local) -> List[Dict[str, Any]]:
+        """
+        批量操作按归属节点拆分：本节点的部分直接由local(ids)处理，其他节点的部分并行转发，
+        结果按请求顺序合并；节点不可用时对应文件返回错误
+        """
+        if self._cluster_local():
+            return local(file_ids)
+        groups: Dict[str, List[str]] = {}
+        for file_id in file_ids:
+            groups.setdefault(self.cluster.owner_of(file_id), []).append(file_id)
+        local_ids = groups.pop(self.cluster.node_id, [])
+        payload = request.get_json(silent=True) or {}
+        headers = self._cluster_headers(conditional=False)
         
-        # 遍历上传目录下的所有文件
-        for file_path in upload_path.rglob('*'):
-            if file_path.is_file():
-                total_size += file_path.stat().st_size
+        results = {}
+        with ThreadPoolExecutor(max_workers=max(1, len(groups))) as pool:
+            futures = {
+                pool.submit(self.cluster.fetch_json, node, 'POST', request.path, headers,
+                            json.dumps(dict(payload, file_ids=ids)).encode('utf-8'), self.cluster.proxy_timeout): node
+                for node, ids in groups.items()
+            }
+            if local_ids:
+                for item in local(local_ids):
+                    results[item['file_id']] = item
+            for future, node in futures.items():
+                try:
+                    for item in future.result()['results']:
+                        results[item['file_id']] = item
+                except Exception as e:
+                    logger.error(f"批量操作转发失败 {node}: {e}")
+                    for file_id in groups[node]:
+                        results[file_id] = {'file_id': file_id, 'status': 'error', 'error': '文件所在节点不可用'}
+        return [results[file_id] for file_id in file_ids]
+    
+    def _cluster_file_list(self) -> Dict[str, Any]:
+        """集群汇总文件列表：各节点返回排序后的前 page*per_page 条，合并排序后再分页"""
+        sort_by = request.args.get('sort', 'upload_time')
+        page = max(int(request.args.get('page', 1)), 1)
+        per_page = min(max(int(request.args.get('per_page', 50)), 1), self.config.max_per_page)
+        window = min(page * per_page, self.config.cluster_max_window)
+        args = request.args.to_dict()
+        args.update(page='1', per_page=str(window))
+        responses = self._cluster_gather(
+            f"/api/files?{urlencode(args)}", lambda: json.loads(self._build_file_list(1, window)[0])
+        )
         
-        return total_size
+        files = []
+        total_files = 0
+        nodes = {}
+        for node, data in responses.items():
+            if data is None:
+                nodes[node] = 'unavailable'
+                continue
+            nodes[node] = 'ok'
+            files.extend(data['files'])
+            total_files += data['pagination']['total_files']
+        
+        if sort_by == 'name':
+            files.sort(key=lambda x: x['original_name'])
+        elif sort_by == 'size':
+            files.sort(key=lambda x: x['file_size'], reverse=True)
+        else:
+            files.sort(key=lambda x: x['upload_time'], reverse=True)
+        
+        start_idx = (page - 1) * per_page
+        return {
+            'status': 'success',
+            'files': files[start_idx:start_idx + per_page],
+            'pagination': {
+                'page': page,
+                'per_page': per_page,
+                'total_files': total_files,
+                'total_pages': (total_files + per_page - 1) // per_page
+            },
+            'nodes': nodes
+        }
     
-    def _delete_file(self, file_id: str):
-        """删除文件"""
+    def _cluster_stats(self) -> Dict[str, Any]:
+        """集群汇总统计信息：计数和容量按节点求和"""
+        responses = self._cluster_gather('/api/stats', lambda: self._build_stats()[0])
+        totals = dict.fromkeys(('total_uploads', 'total_downloads', 'active_files', 'today_uploads',
+                                'storage_used', 'actual_disk_usage', 'storage_total'), 0)
+        nodes = {}
+        for node, data in responses.items():
+            if data is None:
+                nodes[node] = 'unavailable'
+                continue
+            nodes[node] = 'ok'
+            for key in totals:
+                totals[key] += data['stats'].get(key, 0)
+        
+        storage_total = totals['storage_total']
+        stats = dict(totals,
+                     storage_used_formatted=self._format_file_size(totals['storage_used']),
+                     actual_disk_usage_formatted=self._format_file_size(totals['actual_disk_usage']),
+                     storage_total_formatted=self._format_file_size(storage_total),
+                     storage_usage_percent=round(totals['storage_used'] / storage_total * 100, 2) if storage_total > 0 else 0)
+        return {'status': 'success', 'stats': stats, 'nodes': nodes}
+    
+    def _delete_file(self, file_id: str, defer: bool = False):
+        """删除文件，defer为True时移入回收目录由后台删除（用于批量清理）"""
         try:
             if file_id in self.file_metadata:
                 metadata = self.file_metadata[file_id]
                 
-                # 删除物理文件
-                file_path = self._get_file_path(file_id, metadata.upload_time)
-                if file_path.exists():
-                    file_path.unlink()
+                # 删除物理文件和派生资源
+                self.storage.delete(file_id, metadata.upload_time, defer=defer)
+                self.derived.remove(file_id)
                 
                 # 标记为已删除
                 metadata.is_deleted = True
+                self._bump_generation()
                 
-                logger.info(f"删除文件: {file_id} - {metadata.original_name}")
+                logger.info(f"删除文件: {file_id} - {metadata.original_name}", extra={'event': 'file.delete'})
                 
         except Exception as e:
             logger.error(f"删除文件失败 {file_id}: {e}")
     
-    def _get_file_path(self, file_id: str, upload_time: int) -> Path:
-        """获取文件路径"""
-        upload_date = datetime.fromtimestamp(upload_time)
-        date_dir = Path(self.config.upload_dir) / upload_date.strftime('%Y%m%d')
-        date_dir.mkdir(exist_ok=True)
+    def _batch_file_ids(self) -> Tuple[Optional[List[str]], Optional[Any]]:
+        """解析批量操作请求中的file_ids，返回 (文件ID列表, 错误响应)"""
+        data = request.get_json(silent=True)
+        if not data or 'file_ids' not in data:
+            return None, (jsonify({'status': 'error', 'message': '缺少文件ID列表'}), 400)
+        file_ids = data['file_ids']
+        if not isinstance(file_ids, list):
+            return None, (jsonify({'status': 'error', 'message': 'file_ids必须是数组'}), 400)
+        if len(file_ids) > self.config.max_batch_items:
+            return None, (jsonify({'status': 'error', 'message': f'单次最多操作{self.config.max_batch_items}个文件'}), 400)
+        # 去重并保持顺序
+        return list(dict.fromkeys(str(file_id) for file_id in file_ids)), None
+    
+    def _delete_files(self, file_ids: List[str]) -> List[Dict[str, Any]]:
+        """
+        批量删除文件：物理文件并行删除，元数据统一标记后一次性保存，返回每个文件的结果
+        """
+        results = {}
+        targets = []
+        for file_id in file_ids:
+            metadata = self.file_metadata.get(file_id)
+            if metadata is None:
+                results[file_id] = {'file_id': file_id, 'status': 'error', 'error': '文件不存在'}
+            else:
+                targets.append((file_id, metadata))
+        
+        def unlink(item):
+            file_id, metadata = item
+            try:
+                self.storage.delete(file_id, metadata.upload_time)
+                self.derived.remove(file_id)
+                return file_id, None
+            except (OSError, StorageError) as e:
+                return file_id, str(e)
+        
+        deleted = []
+        with ThreadPoolExecutor(max_workers=max(1, self.config.batch_workers)) as pool:
+            for file_id, error in pool.map(unlink, targets):
+                if error:
+                    results[file_id] = {'file_id': file_id, 'status': 'error', 'error': error}
+                else:
+                    self.file_metadata[file_id].is_deleted = True
+                    results[file_id] = {'file_id': file_id, 'status': 'deleted'}
+                    deleted.append(file_id)
+        
+        if deleted:
+            self._bump_generation()
+            self._save_metadata()
+            logger.info(f"批量删除文件: {len(deleted)} 个", extra={'event': 'file.delete'})
+            self.events.publish('file.deleted', {'file_ids': deleted})
+            self._publish_storage()
+        return [results[file_id] for file_id in file_ids]
+    
+    def _publish_storage(self):
+        """发布存储用量变化事件"""
+        storage_used = self._get_total_storage_size()
+        self.events.publish('storage', {
+            'storage_used': storage_used,
+            'storage_used_formatted': self._format_file_size(storage_used),
+            'storage_total_formatted': self._format_file_size(self.config.max_storage)
+        })
+    
+    def _file_info(self, file_id: str, metadata: FileMetadata) -> Dict[str, Any]:
+        """文件列表和批量查询返回的文件信息"""
+        return {
+            'file_id': file_id,
+            'original_name': metadata.original_name,
+            'file_size': metadata.file_size,
+            'file_size_formatted': self._format_file_size(metadata.file_size),
+            'file_type': metadata.file_type,
+            'upload_time': metadata.upload_time,
+            'upload_time_formatted': self._format_time(metadata.upload_time),
+            'expire_time_formatted': self._format_expire_time(metadata.expire_time),
+            'download_count': metadata.download_count,
+            'media': metadata.media,
+            'thumbnail_url': f'/api/thumbnail/{file_id}' if metadata.media and metadata.media.get('thumbnail') else None
+        }
+    
+    def _file_info_json(self, file_id: str, metadata: FileMetadata) -> str:
+        """文件信息的JSON片段，缓存在元数据对象上（“今天/昨天”随日期变化，按日期失效）"""
+        today = datetime.now().toordinal()
+        cached = metadata.info_json
+        if cached is None or cached[0] != today:
+            cached = (today, self.app.json.dumps(self._file_info(file_id, metadata)))
+            metadata.info_json = cached
+        return cached[1]
+    
+    def _queue_media(self, file_id: str, metadata: FileMetadata):
+        """登记上传后的媒体处理（只入队，不等待）"""
+        if self.media is not None:
+            self.media.submit(file_id, metadata.upload_time, metadata.file_type, metadata.file_size)
+    
+    def _apply_media_result(self, file_id: str, result: Dict[str, Any]):
+        """媒体处理完成：写回元数据并通知页面刷新；处理期间文件已被删除时丢弃缩略图"""
+        metadata = self.file_metadata.get(file_id)
+        if metadata is None or metadata.is_deleted:
+            self.derived.remove(file_id)
+            return
+        metadata.media = result
+        self._bump_generation()
+        self.events.publish('file.updated', self._file_info(file_id, metadata))
+    
+    @contextmanager
+    def _upload_info_locked(self, temp_dir: Path):
+        """串行化同一上传的 upload_info.json 读改写，并发上传的分片不会互相覆盖登记"""
+        with self._upload_info_lock:
+            with open(temp_dir / 'upload_info.lock', 'a') as lock_fp:
+                if fcntl is not None:
+                    fcntl.flock(lock_fp, fcntl.LOCK_EX)
+                yield
+    
+    def _save_chunk(self, stream, path: Path) -> Tuple[int, str]:
+        """写入分片并计算SHA-256，返回 (字节数, 十六进制摘要)"""
+        hash_sha256 = hashlib.sha256()
+        size = 0
+        with open(path, 'wb') as f:
+            for block in iter(lambda: stream.read(StorageBackend.BLOCK_SIZE), b''):
+                f.write(block)
+                hash_sha256.update(block)
+                size += len(block)
+        return size, hash_sha256.hexdigest()
+    
+    def _negotiate_chunk_size(self, file_size: int, throughput: float = 0, preferred: int = 0) -> Tuple[int, int, int]:
+        """
+        协商分片大小，返回 (初始分片大小, 下限, 上限)：
+        客户端提供了测得的上传速度时取目标上传时间内能传完的字节数，否则取客户端期望值或默认值；
+        下限同时保证分片数不超过 chunk_max_count，初始分片大小按64KB取整后限制在上下限之间
+        """
+        align = 64 * 1024
+        low = max(self.config.chunk_min_size, -(-file_size // max(self.config.chunk_max_count, 1)))
+        high = max(self.config.chunk_max_size, low)
+        if throughput > 0:
+            size = int(throughput * self.config.chunk_target_seconds)
+        else:
+            size = preferred or self.config.chunk_default_size
+        return min(max(size // align * align, low), high), low, high
+    
+    def _chunk_entries(self, upload_info: Dict[str, Any]) -> Dict[int, Tuple[int, int]]:
+        """已上传分片的 {序号: (偏移, 字节数)}；升级前创建的上传没有分片清单，按固定分片大小推算"""
+        if 'chunks' in upload_info:
+            return {int(index): (entry[0], entry[1]) for index, entry in upload_info['chunks'].items()}
+        chunk_size = upload_info['chunk_size']
+        return {index: (index * chunk_size, min(chunk_size, upload_info['file_size'] - index * chunk_size))
+                for index in upload_info['uploaded_chunks']}
+    
+    def _chunk_sequence(self, upload_info: Dict[str, Any]) -> Tuple[int, bool]:
+        """
+        从文件开头起首尾相接的分片数，以及它们是否覆盖了整个文件；
+        分片大小可变时，续传换了分片大小后留下的旧分片偏移对不上，不会被合并
+        """
+        entries = self._chunk_entries(upload_info)
+        position = 0
+        count = 0
+        while position < upload_info['file_size']:
+            entry = entries.get(count)
+            if entry is None or entry[0] != position or entry[1] <= 0:
+                return count, False
+            position += entry[1]
+            count += 1
+        return count, position == upload_info['file_size']
+    
+    def _upload_progress(self, upload_info: Dict[str, Any]) -> Dict[str, Any]:
+        """按字节计算的上传进度（分片大小可变时分片数不能反映进度）"""
+        uploaded_bytes = min(sum(size for _, size in self._chunk_entries(upload_info).values()), upload_info['file_size'])
+        return {
+            'uploaded_bytes': uploaded_bytes,
+            'progress': uploaded_bytes / upload_info['file_size'] if upload_info['file_size'] > 0 else 0
+        }
+    
+    def _chunk_hashes(self, temp_dir: Path, chunk_count: int) -> List[str]:
+        """
+        读取上传时记录的各分片摘要；缺失的（升级前上传的分片等）用线程池并行计算，
+        hashlib处理大块数据时释放GIL，可以利用多核
+        """
+        hashes: List[Optional[str]] = []
+        for i in range(chunk_count):
+            try:
+                hashes.append((temp_dir / f'chunk_{i}.sha256').read_text().strip())
+            except FileNotFoundError:
+                hashes.append(None)
+        
+        def compute(index):
+            hash_sha256 = hashlib.sha256()
+            with open(temp_dir / f'chunk_{index}', 'rb') as f:
+                for block in iter(lambda: f.read(StorageBackend.BLOCK_SIZE), b''):
+                    hash_sha256.update(block)
+            return index, hash_sha256.hexdigest()
         
-        return date_dir / f"{file_id}_{upload_time}"
+        missing = [i for i, value in enumerate(hashes) if value is None]
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(len(missing), os.cpu_count() or 1)) as pool:
+                for index, value in pool.map(compute, missing):
+                    hashes[index] = value
+        return hashes
     
     def _generate_file_id(self) -> str:
-        """生成文件ID"""
+        """生成文件ID（集群模式下带归属节点前缀）"""
+        if self.cluster is not None:
+            return self.cluster.new_id()
         return uuid.uuid4().hex[:8]
     
     def _secure_filename(self, filename: str) -> str:
@@ -368,14 +5038,6 @@ class JackDisk:
         
         return safe_name
     
-    def _calculate_md5(self, file_path: Path) -> str:
-        """计算文件MD5"""
-        hash_md5 = hashlib.md5()
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
-    
     def _get_file_type(self, file_path: Path) -> str:
         """获取文件MIME类型"""
         import mimetypes
@@ -400,30 +5062,220 @@ class JackDisk:
             return f(*args, **kwargs)
         return decorated_function
     
+    def _client_id(self) -> str:
+        """
+        获取客户端标识（IP），部署在反向代理后时取X-Forwarded-For的最后一个地址：
+        前面的地址由客户端自己填写，可以伪造，最后一个是受信任的代理实际看到的对端地址
+        """
+        remote_addr = request.remote_addr or 'unknown'
+        trusted_node = self.cluster is not None and self.cluster.is_trusted(request.headers)
+        if trusted_node or (self.config.trust_proxy and remote_addr in ('127.0.0.1', '::1')):
+            forwarded = request.headers.get('X-Forwarded-For', '') or request.headers.get('X-Real-IP', '')
+            if forwarded.strip():
+                return forwarded.split(',')[-1].strip()
+        return remote_addr
+    
+    def _too_many_requests(self, retry_after: float):
+        """返回429响应并附带Retry-After"""
+        response = jsonify({'status': 'error', 'message': '请求过于频繁，请稍后再试'})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response
+    
+    def _charge_bandwidth(self, direction: str, nbytes: int):
+        """按字节数扣除客户端带宽令牌，超限时返回429响应，否则返回None"""
+        if not self.config.rate_limit_enabled or self.config.client_bandwidth <= 0 or nbytes <= 0:
+            return None
+        rate = float(self.config.client_bandwidth)
+        retry_after = self.rate_limiter.acquire(f"{self._client_id()}:bytes-{direction}", rate, rate, nbytes)
+        if retry_after > 0:
+            return self._too_many_requests(retry_after)
+        return None
+    
+    @contextmanager
+    def _phase(self, name: str):
+        """记录请求内某个阶段的耗时，最终通过Server-Timing响应头返回"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            phases = g.setdefault('phases', [])
+            phases.append((name, (time.perf_counter() - start) * 1000))
+    
+    def _on_response_close(self, response, callback):
+        """在响应体发送完毕后执行回调
+        send_file返回的是direct_passthrough响应，WSGI服务器只会关闭文件包装器而不会触发call_on_close，
+        所以把回调挂到响应体的close上（Response.close也会调用它）"""
+        body = response.response
+        if not hasattr(body, 'close'):
+            response.call_on_close(callback)
+            return
+        original_close = body.close
+        
+        def close():
+            try:
+                original_close()
+            finally:
+                callback()
+        
+        body.close = close
+    
+    def _rate_limit(self, group: str):
+        """限流装饰器：按路由组限制每个客户端的请求速率，上传类路由同时限制入站带宽"""
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                if not self.config.rate_limit_enabled:
+                    return f(*args, **kwargs)
+                
+                rate, burst = self.config.rate_limits[group]
+                retry_after = self.rate_limiter.acquire(f"{self._client_id()}:{group}", rate, burst)
+                if retry_after > 0:
+                    return self._too_many_requests(retry_after)
+                
+                if group in ('upload', 'chunk') and request.content_length:
+                    limited = self._charge_bandwidth('in', request.content_length)
+                    if limited is not None:
+                        return limited
+                
+                return f(*args, **kwargs)
+            return decorated_function
+        return decorator
+    
     def _register_routes(self):
         """注册路由"""
         
+        upload_endpoints = {'upload_file', 'init_chunked_upload', 'upload_chunk', 'complete_chunked_upload'}
+        
+        @self.app.before_request
+        def start_request_timer():
+            g.request_start = time.perf_counter()
+            self._sync_shared_config()
+            if request.endpoint in upload_endpoints:
+                g.upload_in_flight = True
+                self.metrics.inc('jackdisk_uploads_in_flight')
+            
+            route = request.url_rule.rule if request.url_rule else None
+            if route and self.profiler.should_sample(route):
+                g.profile = cProfile.Profile()
+                g.profile.enable()
+        
+        @self.app.before_request
+        def route_cluster_request():
+            """集群模式：把属于其他节点的文件和上传请求转发（或重定向）到归属节点"""
+            if self._cluster_local():
+                return None
+            owner, body = self._request_owner()
+            if owner is None or owner == self.cluster.node_id:
+                return None
+            if self.config.cluster_routing == 'redirect' and request.method == 'GET':
+                return redirect(self.cluster.nodes[owner] + request.full_path.rstrip('?'), 307)
+            return self._proxy_to(owner, body)
+        
+        @self.app.after_request
+        def record_request_metrics(response):
+            start = g.get('request_start')
+            if start is not None:
+                route = request.url_rule.rule if request.url_rule else 'unmatched'
+                self.metrics.observe('jackdisk_http_request_duration_seconds', time.perf_counter() - start,
+                                     route=route, method=request.method)
+                self.metrics.inc('jackdisk_http_requests_total', route=route, method=request.method,
+                                 status=response.status_code)
+                if request.content_length:
+                    self.metrics.inc('jackdisk_http_received_bytes_total', request.content_length, route=route)
+                if response.content_length:
+                    self.metrics.inc('jackdisk_http_sent_bytes_total', response.content_length, route=route)
+                
+                profile = g.pop('profile', None)
+                if profile is not None:
+                    profile.disable()
+                    self.profiler.record(route, profile, time.perf_counter() - start)
+                
+                # 各阶段耗时通过Server-Timing返回，浏览器开发者工具可直接查看
+                timings = [f"{name};dur={dur:.2f}" for name, dur in g.get('phases', [])]
+                timings.append(f"total;dur={(time.perf_counter() - start) * 1000:.2f}")
+                response.headers['Server-Timing'] = ', '.join(timings)
+            return response
+        
+        @self.app.after_request
+        def compress_json_response(response):
+            """较大的JSON响应按客户端支持进行gzip压缩（用户上传的.json文件下载/预览不压缩，否则Range偏移和ETag对不上）"""
+            if (response.mimetype == 'application/json' and response.status_code == 200
+                    and not response.direct_passthrough and not response.is_streamed
+                    and 'Content-Encoding' not in response.headers
+                    and 'Content-Disposition' not in response.headers and 'Accept-Ranges' not in response.headers
+                    and request.accept_encodings['gzip']):
+                body = response.get_data()
+                if len(body) >= self.config.gzip_min_size:
+                    response.set_data(gzip.compress(body, compresslevel=6))
+                    response.headers['Content-Encoding'] = 'gzip'
+                    response.vary.add('Accept-Encoding')
+            return response
+        
+        @self.app.teardown_request
+        def finish_upload_in_flight(exc):
+            if g.pop('upload_in_flight', False):
+                self.metrics.inc('jackdisk_uploads_in_flight', -1)
+            # 请求异常时after_request不会执行，确保停止采样
+            profile = g.pop('profile', None)
+            if profile is not None:
+                profile.disable()
+        
+        @self.app.route('/metrics')
+        def metrics():
+            """Prometheus指标"""
+            try:
+                if self.config.metrics_token:
+                    if request.headers.get('Authorization', '') != f"Bearer {self.config.metrics_token}":
+                        return jsonify({'status': 'error', 'message': '无权访问'}), 403
+                
+                temp_dir = Path(self.config.upload_dir) / 'temp'
+                active_uploads = 0
+                if temp_dir.exists():
+                    with os.scandir(temp_dir) as entries:
+                        active_uploads = sum(1 for entry in entries if entry.is_dir())
+                
+                body = self.metrics.render(extra_gauges={'jackdisk_chunked_uploads_active': active_uploads})
+                return body, 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+                
+            except Exception as e:
+                logger.error(f"获取指标失败: {e}")
+                return jsonify({'status': 'error', 'message': '获取指标失败'}), 500
+        
         @self.app.route('/')
         def index():
-            """首页"""
-            return render_template('index.html')
+            """首页（启动时渲染一次并缓存）"""
+            return self.static_assets.response(self.static_assets.index)
         
         # 添加静态文件路由
         @self.app.route('/<path:filename>')
         def static_files(filename):
-            """提供静态文件服务"""
-            # 检查请求的文件是否存在
-            if Path(filename).exists() and filename in ['tailwind.css', 'main.js']:
-                return send_file(filename)
-            else:
+            """提供静态文件服务（只查内存中的资源表，不访问文件系统）"""
+            asset = self.static_assets.assets.get(filename)
+            if asset is None:
                 # 如果不是静态文件，返回404
                 return jsonify({'status': 'error', 'message': '文件不存在'}), 404
+            return self.static_assets.response(asset)
         
         @self.app.route('/api/upload', methods=['POST'])
+        @self._rate_limit('upload')
         def upload_file():
             """文件上传"""
+            reservation_key = None
             try:
-                if 'files' not in request.files:
+                # 在读取请求体之前按声明长度预留空间；没有Content-Length（分块传输）时无法预留，直接拒绝
+                declared_size = request.content_length
+                if declared_size is None:
+                    return jsonify({'status': 'error', 'message': '上传请求需要Content-Length'}), 411
+                if declared_size:
+                    reservation_key = f"upload-{uuid.uuid4().hex}"
+                    if not self._reserve_space(reservation_key, declared_size):
+                        reservation_key = None
+                        return self._insufficient_storage_response()
+                
+                with self._phase('parse'):
+                    has_files = 'files' in request.files
+                if not has_files:
                     return jsonify({'status': 'error', 'message': '没有文件'}), 400
                 
                 files = request.files.getlist('files')
@@ -464,18 +5316,14 @@ class JackDisk:
                         expire_time=expire_time
                     )
                     
-                    # 保存文件
-                    file_path = self._get_file_path(file_id, upload_time)
-                    file.save(file_path)
-                    
-                    # 计算MD5
-                    metadata.md5_hash = self._calculate_md5(file_path)
-                    
-                    # 保存元数据
-                    self.file_metadata[file_id] = metadata
+                    # 保存文件（写入时同时计算MD5）
+                    with self._phase('write'):
+                        _, metadata.md5_hash = self.storage.save(file_id, upload_time, file.stream)
                     
-                    # 检查存储空间限制
-                    self._check_storage_limit()
+                    # 保存元数据（空间已在接收前预留，不再事后清理其他文件）
+                    with self._phase('metadata'):
+                        self.file_metadata[file_id] = metadata
+                        self._bump_generation()
                     
                     uploaded_files.append({
                         'file_id': file_id,
@@ -486,10 +5334,15 @@ class JackDisk:
                     })
                     
                     # 更新统计
-                    self.stats['total_uploads'] += 1
+                    self.counters.incr(stat='total_uploads')
                     self.stats['total_files'] += 1
                     
-                    logger.info(f"文件上传成功: {file_id} - {original_name} ({file_size} bytes)")
+                    logger.info(f"文件上传成功: {file_id} - {original_name} ({file_size} bytes)", extra={'event': 'file.upload'})
+                    self.events.publish('file.added', self._file_info(file_id, metadata))
+                    self._queue_media(file_id, metadata)
+                
+                if uploaded_files:
+                    self._publish_storage()
                 
                 return jsonify({
                     'status': 'success',
@@ -500,18 +5353,41 @@ class JackDisk:
             except Exception as e:
                 logger.error(f"文件上传失败: {e}")
                 return jsonify({'status': 'error', 'message': '上传失败'}), 500
+            finally:
+                if reservation_key:
+                    self.reservations.release(reservation_key)
         
         @self.app.route('/api/upload/init', methods=['POST'])
+        @self._rate_limit('upload')
         def init_chunked_upload():
-            """初始化分片上传"""
+            """
+            初始化分片上传，按文件大小、服务器上下限和客户端测得的上传速度协商分片大小。
+            adaptive为True时客户端可在上下限内逐片调整分片大小（每片附带偏移和大小），
+            否则使用固定分片大小（须在上下限内）
+            """
             try:
                 data = request.get_json()
                 filename = data.get('filename')
                 file_size = data.get('file_size')
-                chunk_size = data.get('chunk_size', 1024 * 1024)  # 默认1MB
+                adaptive = bool(data.get('adaptive'))
                 
                 if not filename or not file_size:
                     return jsonify({'status': 'error', 'message': '缺少必要参数'}), 400
+                try:
+                    throughput = max(float(data.get('throughput') or 0), 0)
+                    preferred = int(data.get('chunk_size') or 0)
+                except (TypeError, ValueError):
+                    return jsonify({'status': 'error', 'message': '参数格式错误'}), 400
+                chunk_size, min_chunk_size, max_chunk_size = self._negotiate_chunk_size(file_size, throughput, preferred)
+                if not adaptive:
+                    chunk_size = preferred or chunk_size
+                    if not min_chunk_size <= chunk_size <= max_chunk_size:
+                        return jsonify({
+                            'status': 'error',
+                            'message': f'分片大小应在{self._format_file_size(min_chunk_size)}到{self._format_file_size(max_chunk_size)}之间',
+                            'min_chunk_size': min_chunk_size,
+                            'max_chunk_size': max_chunk_size
+                        }), 400
                 
                 # 检查文件大小
                 if file_size > self.config.max_file_size:
@@ -531,9 +5407,10 @@ class JackDisk:
                                 try:
                                     with open(info_file, 'r', encoding='utf-8') as f:
                                         existing_info = json.load(f)
-                                    # 检查是否为相同文件（文件名和大小相同）
+                                    # 检查是否为相同文件（文件名和大小相同，分片方式相同）
                                     if (existing_info.get('filename') == filename and 
-                                        existing_info.get('file_size') == file_size):
+                                        existing_info.get('file_size') == file_size and
+                                        bool(existing_info.get('adaptive')) == adaptive):
                                         existing_upload_id = existing_info.get('upload_id')
                                         break
                                 except Exception as e:
@@ -549,11 +5426,22 @@ class JackDisk:
                     with open(info_file, 'r', encoding='utf-8') as f:
                         upload_info = json.load(f)
                     
+                    # 续传时预留可能已超时，重新预留
+                    if self.reservations.get(upload_id) is None:
+                        if not self._reserve_space(upload_id, file_size):
+                            return self._insufficient_storage_response()
+                    
+                    if not adaptive:
+                        chunk_size = upload_info['chunk_size']
                     logger.info(f"继续分片上传: {upload_id} - {filename} (已上传 {len(upload_info.get('uploaded_chunks', []))}/{upload_info.get('chunk_count', 0)} 个分片)")
                 else:
                     # 生成新的上传ID
                     upload_id = self._generate_file_id()
                     
+                    # 预留空间，容量不足时直接拒绝，不再接收任何分片
+                    if not self._reserve_space(upload_id, file_size):
+                        return self._insufficient_storage_response()
+                    
                     # 创建临时目录
                     temp_dir = temp_base_dir / upload_id
                     temp_dir.mkdir(parents=True, exist_ok=True)
@@ -564,8 +5452,12 @@ class JackDisk:
                         'filename': filename,
                         'file_size': file_size,
                         'chunk_size': chunk_size,
-                        'chunk_count': (file_size + chunk_size - 1) // chunk_size,
+                        'chunk_count': (file_size + chunk_size - 1) // chunk_size,  # 分片大小可变时为按初始大小估算的值
+                        'adaptive': adaptive,
+                        'min_chunk_size': min_chunk_size,
+                        'max_chunk_size': max_chunk_size,
                         'uploaded_chunks': [],
+                        'chunks': {},  # 分片清单 {序号: [偏移, 字节数]}
                         'created_time': int(time.time())
                     }
                     
@@ -576,25 +5468,38 @@ class JackDisk:
                     
                     logger.info(f"初始化分片上传: {upload_id} - {filename}")
                 
-                return jsonify({
+                result = {
                     'status': 'success',
                     'upload_id': upload_id,
+                    'chunk_size': chunk_size,
                     'chunk_count': upload_info['chunk_count'],
-                    'uploaded_chunks': upload_info.get('uploaded_chunks', [])
-                })
+                    'adaptive': bool(upload_info.get('adaptive')),
+                    'uploaded_chunks': upload_info.get('uploaded_chunks', []),
+                    'chunks': [[index, offset, size] for index, (offset, size) in sorted(self._chunk_entries(upload_info).items())]
+                }
+                if result['adaptive']:
+                    result.update({
+                        'min_chunk_size': upload_info['min_chunk_size'],
+                        'max_chunk_size': upload_info['max_chunk_size'],
+                        'target_chunk_seconds': self.config.chunk_target_seconds
+                    })
+                return jsonify(result)
                 
             except Exception as e:
                 logger.error(f"初始化分片上传失败: {e}")
                 return jsonify({'status': 'error', 'message': '初始化失败'}), 500
         
         @self.app.route('/api/upload/chunk', methods=['POST'])
+        @self._rate_limit('chunk')
         def upload_chunk():
             """上传分片"""
             try:
                 # 获取参数
-                upload_id = request.form.get('upload_id')
-                chunk_index = int(request.form.get('chunk_index', 0))
-                chunk_data = request.files.get('chunk')
+                with self._phase('parse'):
+                    upload_id = request.form.get('upload_id')
+                    chunk_index = int(request.form.get('chunk_index', 0))
+                    chunk_data = request.files.get('chunk')
+                    expected_hash = (request.form.get('chunk_sha256') or '').lower()
                 
                 if not upload_id or not chunk_data:
                     return jsonify({'status': 'error', 'message': '缺少必要参数'}), 400
@@ -612,24 +5517,82 @@ class JackDisk:
                 with open(info_file, 'r', encoding='utf-8') as f:
                     upload_info = json.load(f)
                 
-                # 保存分片
-                chunk_file = temp_dir / f'chunk_{chunk_index}'
-                chunk_data.save(chunk_file)
+                file_size = upload_info['file_size']
+                if upload_info.get('adaptive'):
+                    # 可变大小的分片：客户端给出偏移和大小，除最后一片外不小于下限；
+                    # 此前每片至少为下限大小，据此限制序号范围
+                    try:
+                        chunk_offset = int(request.form.get('chunk_offset', ''))
+                        expected_size = int(request.form.get('chunk_size', ''))
+                    except ValueError:
+                        return jsonify({'status': 'error', 'message': '缺少分片偏移或大小'}), 400
+                    if (not 0 <= chunk_offset < file_size or chunk_offset + expected_size > file_size
+                            or not 0 < expected_size <= upload_info['max_chunk_size']
+                            or (expected_size < upload_info['min_chunk_size'] and chunk_offset + expected_size != file_size)
+                            or not 0 <= chunk_index <= chunk_offset // upload_info['min_chunk_size']):
+                        return jsonify({'status': 'error', 'message': '分片偏移或大小无效'}), 400
+                else:
+                    if not 0 <= chunk_index < upload_info['chunk_count']:
+                        return jsonify({'status': 'error', 'message': '分片序号无效'}), 400
+                    chunk_offset = chunk_index * upload_info['chunk_size']
+                    expected_size = min(upload_info['chunk_size'], file_size - chunk_offset)
                 
-                # 更新已上传分片列表
-                if chunk_index not in upload_info['uploaded_chunks']:
-                    upload_info['uploaded_chunks'].append(chunk_index)
-                    upload_info['uploaded_chunks'].sort()
+                # 保存分片：边写边计算SHA-256，大小和摘要校验通过后才改名为正式分片，损坏的分片不会被合并
+                chunk_file = temp_dir / f'chunk_{chunk_index}'
+                part_file = temp_dir / f'chunk_{chunk_index}.{uuid.uuid4().hex[:8]}.part'
+                with self._phase('write'):
+                    chunk_size, chunk_hash = self._save_chunk(chunk_data.stream, part_file)
+                if chunk_size != expected_size or (expected_hash and expected_hash != chunk_hash):
+                    part_file.unlink(missing_ok=True)
+                    self.metrics.inc('jackdisk_chunk_checksum_failures_total', stage='chunk')
+                    logger.warning(f"分片校验失败: {upload_id} 第{chunk_index}片 ({chunk_size}/{expected_size} bytes)",
+                                   extra={'event': 'upload.checksum'})
+                    return jsonify({
+                        'status': 'error',
+                        'message': f'分片{chunk_index}校验失败，请重新上传该分片',
+                        'checksum_mismatch': True,
+                        'chunk_index': chunk_index
+                    }), 400
+                hash_file = temp_dir / f'chunk_{chunk_index}.sha256'
+                hash_file.unlink(missing_ok=True)
+                os.replace(part_file, chunk_file)
+                hash_file.write_text(chunk_hash)
+                self.metrics.inc('jackdisk_chunks_total')
+                self.metrics.inc('jackdisk_chunk_bytes_total', chunk_size)
                 
-                # 更新上传信息
-                with open(info_file, 'w', encoding='utf-8') as f:
-                    json.dump(upload_info, f, ensure_ascii=False, indent=2)
+                # 更新已上传分片列表和分片清单（同一序号重传时以最后一次为准）
+                with self._phase('metadata'):
+                    with self._upload_info_locked(temp_dir):
+                        # 加锁后重新读取，保留同时上传的其他分片的登记
+                        with open(info_file, 'r', encoding='utf-8') as f:
+                            upload_info = json.load(f)
+                        if chunk_index not in upload_info['uploaded_chunks']:
+                            upload_info['uploaded_chunks'].append(chunk_index)
+                            upload_info['uploaded_chunks'].sort()
+                        if 'chunks' in upload_info:
+                            upload_info['chunks'][str(chunk_index)] = [chunk_offset, chunk_size]
+                        tmp_file = info_file.with_name(f"upload_info.json.{uuid.uuid4().hex[:8]}.tmp")
+                        with open(tmp_file, 'w', encoding='utf-8') as f:
+                            json.dump(upload_info, f, ensure_ascii=False, indent=2)
+                        os.replace(tmp_file, info_file)
+                        progress = self._upload_progress(upload_info)
+                        
+                        # 刷新空间预留心跳，并扣除已落盘的字节（在锁内写入，较早的进度不会覆盖较新的）
+                        pending_bytes = file_size - progress['uploaded_bytes']
+                        self.reservations.put(upload_id, upload_info['file_size'], pending_bytes)
                 
                 # 不再记录每个分片的上传信息，避免日志过多
+                self.events.publish('upload.progress', {
+                    'upload_id': upload_id,
+                    'uploaded_chunks': len(upload_info['uploaded_chunks']),
+                    'chunk_count': upload_info['chunk_count'],
+                    **progress
+                })
                 
                 return jsonify({
                     'status': 'success',
-                    'uploaded_chunks': upload_info['uploaded_chunks']
+                    'uploaded_chunks': upload_info['uploaded_chunks'],
+                    'uploaded_bytes': progress['uploaded_bytes']
                 })
                 
             except Exception as e:
@@ -637,6 +5600,7 @@ class JackDisk:
                 return jsonify({'status': 'error', 'message': '上传分片失败'}), 500
         
         @self.app.route('/api/upload/complete', methods=['POST'])
+        @self._rate_limit('upload')
         def complete_chunked_upload():
             """完成分片上传"""
             try:
@@ -659,10 +5623,13 @@ class JackDisk:
                 with open(info_file, 'r', encoding='utf-8') as f:
                     upload_info = json.load(f)
                 
-                # 检查是否所有分片都已上传
-                expected_chunks = list(range(upload_info['chunk_count']))
-                if sorted(upload_info['uploaded_chunks']) != expected_chunks:
-                    missing_chunks = [i for i in expected_chunks if i not in upload_info['uploaded_chunks']]
+                # 检查分片是否从头到尾首尾相接地覆盖了整个文件
+                chunk_count, complete = self._chunk_sequence(upload_info)
+                if not complete:
+                    if upload_info.get('adaptive'):
+                        missing_chunks = [chunk_count]
+                    else:
+                        missing_chunks = [i for i in range(upload_info['chunk_count']) if i not in upload_info['uploaded_chunks']]
                     return jsonify({
                         'status': 'error', 
                         'message': '分片不完整',
@@ -670,6 +5637,7 @@ class JackDisk:
                     }), 400
                 
                 # 合并分片
+                self.events.publish('upload.finalizing', {'upload_id': upload_id})
                 filename = upload_info['filename']
                 file_id = self._generate_file_id()
                 upload_time = int(time.time())
@@ -685,36 +5653,41 @@ class JackDisk:
                     expire_time=expire_time
                 )
                 
-                # 合并文件
-                file_path = self._get_file_path(file_id, upload_time)
-                with open(file_path, 'wb') as outfile:
-                    for i in range(upload_info['chunk_count']):
-                        chunk_file = temp_dir / f'chunk_{i}'
-                        with open(chunk_file, 'rb') as infile:
-                            outfile.write(infile.read())
+                # 由各分片摘要计算Merkle树根，客户端提供了树根时核对，不一致说明分片有误，不合并
+                with self._phase('hash'):
+                    metadata.tree_hash = merkle_root(self._chunk_hashes(temp_dir, chunk_count))
+                client_hash = str(data.get('tree_hash') or '').lower()
+                if client_hash and client_hash != metadata.tree_hash:
+                    self.metrics.inc('jackdisk_chunk_checksum_failures_total', stage='file')
+                    logger.warning(f"分片上传整体校验失败: {upload_id} - {filename}", extra={'event': 'upload.checksum'})
+                    return jsonify({'status': 'error', 'message': '文件校验失败，请重新上传', 'checksum_mismatch': True}), 400
                 
-                # 获取文件类型和大小
-                metadata.file_type = self._get_file_type(file_path)
-                metadata.file_size = file_path.stat().st_size
+                # 合并分片写入存储后端（分片已逐个校验，不再重新读取计算整体哈希）
+                with self._phase('write'):
+                    part_paths = [temp_dir / f'chunk_{i}' for i in range(chunk_count)]
+                    metadata.file_size = self.storage.save_parts(file_id, upload_time, part_paths)
                 
-                # 计算MD5
-                metadata.md5_hash = self._calculate_md5(file_path)
+                # 获取文件类型
+                metadata.file_type = self._get_file_type(Path(metadata.original_name))
                 
                 # 保存元数据
-                self.file_metadata[file_id] = metadata
+                with self._phase('metadata'):
+                    self.file_metadata[file_id] = metadata
+                    self._bump_generation()
                 
-                # 删除临时文件
-                import shutil
+                # 删除临时文件并释放空间预留（空间在初始化时已按文件大小预留，不再事后清理其他文件）
                 shutil.rmtree(temp_dir)
-                
-                # 检查存储空间限制
-                self._check_storage_limit()
+                self.reservations.release(upload_id)
                 
                 # 更新统计
-                self.stats['total_uploads'] += 1
+                self.counters.incr(stat='total_uploads')
                 self.stats['total_files'] += 1
                 
                 logger.info(f"完成分片上传: {file_id} - {filename} ({metadata.file_size} bytes)")
+                self.events.publish('upload.complete', {'upload_id': upload_id, 'file_id': file_id})
+                self.events.publish('file.added', self._file_info(file_id, metadata))
+                self._publish_storage()
+                self._queue_media(file_id, metadata)
                 
                 return jsonify({
                     'status': 'success',
@@ -722,11 +5695,13 @@ class JackDisk:
                     'original_name': metadata.original_name,
                     'file_size': metadata.file_size,
                     'file_size_formatted': self._format_file_size(metadata.file_size),
-                    'file_type': metadata.file_type
+                    'file_type': metadata.file_type,
+                    'tree_hash': metadata.tree_hash
                 })
                 
             except Exception as e:
                 logger.error(f"完成分片上传失败: {e}")
+                self.events.publish('upload.failed', {'upload_id': (request.get_json(silent=True) or {}).get('upload_id')})
                 return jsonify({'status': 'error', 'message': '完成上传失败'}), 500
         
         @self.app.route('/api/upload/status/<upload_id>', methods=['GET'])
@@ -753,77 +5728,85 @@ class JackDisk:
                     'file_size': upload_info['file_size'],
                     'uploaded_chunks': upload_info['uploaded_chunks'],
                     'chunk_count': upload_info['chunk_count'],
-                    'progress': len(upload_info['uploaded_chunks']) / upload_info['chunk_count'] if upload_info['chunk_count'] > 0 else 0
+                    'chunks': [[index, offset, size] for index, (offset, size) in sorted(self._chunk_entries(upload_info).items())],
+                    **self._upload_progress(upload_info)
                 })
                 
             except Exception as e:
                 logger.error(f"获取上传状态失败: {e}")
                 return jsonify({'status': 'error', 'message': '获取状态失败'}), 500
         
-        @self.app.route('/api/files')
-        def get_files():
-            """获取文件列表"""
-            try:
-                # 获取查询参数
-                sort_by = request.args.get('sort', 'upload_time')
-                search = request.args.get('search', '').lower()
-                page = int(request.args.get('page', 1))
-                per_page = int(request.args.get('per_page', 50))
-                
-                current_time = int(time.time())
-                
-                # 筛选未过期文件
-                active_files = []
-                for file_id, metadata in self.file_metadata.items():
-                    if not metadata.is_deleted and metadata.expire_time > current_time:
-                        # 搜索过滤
-                        if search and search not in metadata.original_name.lower():
+        @self.app.route('/api/events')
+        def event_stream():
+            """
+            Server-Sent Events事件流
+            连接保持 TEMPSTORE_EVENT_STREAM_SECONDS 秒后结束（避免长期占用同步工作进程），
+            浏览器EventSource会带Last-Event-ID自动重连并补齐期间的事件；可用upload_id参数只接收某个上传的事件
+            """
+            since = request.headers.get('Last-Event-ID') or request.args.get('since')
+            since = int(since) if since and since.isdigit() else None
+            upload_id = request.args.get('upload_id')
+            deadline = time.monotonic() + self.config.event_stream_seconds
+            
+            def generate(since):
+                yield 'retry: 1000\n\n'
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return
+                    events, since = self.events.wait(since, min(remaining, 15))
+                    sent = False
+                    for event_id, event_type, data in events:
+                        if upload_id and data.get('upload_id') != upload_id and event_type != 'reset':
                             continue
-                        
-                        active_files.append({
-                            'file_id': file_id,
-                            'original_name': metadata.original_name,
-                            'file_size': metadata.file_size,
-                            'file_size_formatted': self._format_file_size(metadata.file_size),
-                            'file_type': metadata.file_type,
-                            'upload_time': metadata.upload_time,
-                            'upload_time_formatted': self._format_time(metadata.upload_time),
-                            'expire_time_formatted': self._format_expire_time(metadata.expire_time),
-                            'download_count': metadata.download_count
-                        })
-                
-                # 排序 - 默认按上传时间倒序（最新的在前面）
-                if sort_by == 'name':
-                    active_files.sort(key=lambda x: x['original_name'])
-                elif sort_by == 'size':
-                    active_files.sort(key=lambda x: x['file_size'], reverse=True)
-                else:  # upload_time - 最新的文件排在前面
-                    active_files.sort(key=lambda x: x['upload_time'], reverse=True)
-                
-                # 分页
-                total_files = len(active_files)
-                total_pages = (total_files + per_page - 1) // per_page
-                start_idx = (page - 1) * per_page
-                end_idx = min(start_idx + per_page, total_files)
-                
-                files_page = active_files[start_idx:end_idx]
-                
+                        sent = True
+                        yield f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+                    if not sent:
+                        # 心跳，同时让客户端记住最新序号
+                        yield f"id: {since}\n: keepalive\n\n"
+            
+            return Response(generate(since), mimetype='text/event-stream', headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'
+            })
+        
+        @self.app.route('/api/events/poll')
+        def event_poll():
+            """长轮询：等待since之后的事件（最长timeout秒），供脚本等不支持SSE的客户端使用"""
+            try:
+                since = request.args.get('since')
+                since = int(since) if since is not None else None
+                timeout = min(max(float(request.args.get('timeout', 20)), 0), self.config.event_stream_seconds)
+                events, next_since = self.events.wait(since, timeout)
+                upload_id = request.args.get('upload_id')
                 return jsonify({
                     'status': 'success',
-                    'files': files_page,
-                    'pagination': {
-                        'page': page,
-                        'per_page': per_page,
-                        'total_files': total_files,
-                        'total_pages': total_pages
-                    }
+                    'events': [{'id': event_id, 'type': event_type, 'data': data}
+                               for event_id, event_type, data in events
+                               if not upload_id or data.get('upload_id') == upload_id or event_type == 'reset'],
+                    'since': next_since
                 })
+            except ValueError:
+                return jsonify({'status': 'error', 'message': '参数无效'}), 400
+            except Exception as e:
+                logger.error(f"获取事件失败: {e}")
+                return jsonify({'status': 'error', 'message': '获取事件失败'}), 500
+        
+        @self.app.route('/api/files')
+        def get_files():
+            """获取文件列表（元数据未变化时直接返回缓存，客户端缓存未过期时返回304）"""
+            try:
+                if not self._cluster_local():
+                    return jsonify(self._cluster_file_list())
+                # 集群节点只会收到其他节点转发的汇总查询，其每页条数上限不同，单独缓存
+                return self._cached_json('files' if self.cluster is None else 'files:node', self._build_file_list)
                 
             except Exception as e:
                 logger.error(f"获取文件列表失败: {e}")
                 return jsonify({'status': 'error', 'message': '获取文件列表失败'}), 500
         
         @self.app.route('/api/download/<file_id>')
+        @self._rate_limit('download')
         def download_file(file_id: str):
             """文件下载"""
             try:
@@ -839,23 +5822,46 @@ class JackDisk:
                 if metadata.expire_time <= current_time:
                     return jsonify({'status': 'error', 'message': '文件已过期'}), 404
                 
-                # 获取文件路径
-                file_path = self._get_file_path(file_id, metadata.upload_time)
-                if not file_path.exists():
+                # 限制每个客户端的并发下载数和出站带宽
+                lease = None
+                if self.config.rate_limit_enabled:
+                    lease = self.rate_limiter.enter(f"{self._client_id()}:download", self.config.max_concurrent_downloads)
+                    if lease is None:
+                        return self._too_many_requests(1)
+                
+                with self._phase('send'):
+                    try:
+                        response = self.storage.send(file_id, metadata.upload_time, metadata.original_name, metadata.file_type)
+                    except Exception:
+                        self.rate_limiter.leave(lease)
+                        raise
+                if response is None:
+                    self.rate_limiter.leave(lease)
                     return jsonify({'status': 'error', 'message': '文件不存在'}), 404
                 
+                # 按实际发送的字节数计入出站带宽（Range请求只计请求的区间，304/416不计）
+                if self.config.rate_limit_enabled:
+                    if response.status_code in (304, 416):
+                        served = 0
+                    else:
+                        served = response.content_length if response.content_length is not None else metadata.file_size
+                    limited = self._charge_bandwidth('out', served)
+                    if limited is not None:
+                        response.close()
+                        self.rate_limiter.leave(lease)
+                        return limited
+                
                 # 更新下载计数
+                # 只在内存中累加，由后台线程批量持久化
                 metadata.download_count += 1
-                self.stats['total_downloads'] += 1
+                self._bump_generation()
+                self.counters.incr(file_id=file_id, stat='total_downloads')
                 
-                logger.info(f"文件下载: {file_id} - {metadata.original_name}")
+                logger.info(f"文件下载: {file_id} - {metadata.original_name}", extra={'event': 'file.download'})
                 
-                return send_file(
-                    file_path,
-                    as_attachment=True,
-                    download_name=metadata.original_name,
-                    mimetype=metadata.file_type
-                )
+                # 响应发送完毕（或客户端断开）后释放并发登记
+                self._on_response_close(response, lambda: self.rate_limiter.leave(lease))
+                return response
                 
             except Exception as e:
                 logger.error(f"文件下载失败 {file_id}: {e}")
@@ -877,19 +5883,19 @@ class JackDisk:
                 if metadata.expire_time <= current_time:
                     return jsonify({'status': 'error', 'message': '文件已过期'}), 404
                 
-                # 获取文件路径
-                file_path = self._get_file_path(file_id, metadata.upload_time)
-                if not file_path.exists():
-                    return jsonify({'status': 'error', 'message': '文件不存在'}), 404
-                
                 # 检查文件类型是否支持预览
                 preview_types = ['text/', 'application/json', 'application/javascript', 'text/css', 'text/html']
                 if not any(metadata.file_type.startswith(t) for t in preview_types):
                     return jsonify({'status': 'error', 'message': '该文件类型不支持预览'}), 400
                 
                 # 读取文件内容
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
+                stream = self.storage.open(file_id, metadata.upload_time)
+                if stream is None:
+                    return jsonify({'status': 'error', 'message': '文件不存在'}), 404
+                try:
+                    content = stream.read().decode('utf-8')
+                finally:
+                    stream.close()
                 
                 return content, 200, {'Content-Type': 'text/plain; charset=utf-8'}
                 
@@ -897,36 +5903,74 @@ class JackDisk:
                 logger.error(f"文件预览失败 {file_id}: {e}")
                 return jsonify({'status': 'error', 'message': '预览失败'}), 500
         
+        @self.app.route('/api/thumbnail/<file_id>')
+        def thumbnail_file(file_id: str):
+            """图片缩略图（后台生成，内容不变，允许客户端长期缓存到文件过期）"""
+            try:
+                metadata = self.file_metadata.get(file_id)
+                current_time = int(time.time())
+                if metadata is None or metadata.is_deleted or metadata.expire_time <= current_time:
+                    return jsonify({'status': 'error', 'message': '文件不存在'}), 404
+                
+                path = self.derived.get(file_id)
+                if path is None:
+                    # 还没生成或已被淘汰，重新登记
+                    if thumbnails_supported() and metadata.file_type.startswith('image/'):
+                        self._queue_media(file_id, metadata)
+                    return jsonify({'status': 'error', 'message': '缩略图不存在'}), 404
+                
+                max_age = max(0, min(metadata.expire_time - current_time, 365 * 86400))
+                response = send_file(path, mimetype='image/jpeg', conditional=True, etag=True, max_age=max_age)
+                response.headers['Cache-Control'] = f'public, max-age={max_age}, immutable'
+                return response
+                
+            except Exception as e:
+                logger.error(f"获取缩略图失败 {file_id}: {e}")
+                return jsonify({'status': 'error', 'message': '获取缩略图失败'}), 500
+        
+        @self.app.route('/api/batch/info', methods=['POST'])
+        def batch_file_info():
+            """批量查询文件信息"""
+            try:
+                file_ids, error_response = self._batch_file_ids()
+                if error_response:
+                    return error_response
+                
+                def lookup(ids):
+                    current_time = int(time.time())
+                    results = []
+                    for file_id in ids:
+                        metadata = self.file_metadata.get(file_id)
+                        if metadata is None or metadata.is_deleted or metadata.expire_time <= current_time:
+                            results.append({'file_id': file_id, 'status': 'error', 'error': '文件不存在或已过期'})
+                        else:
+                            results.append(dict(self._file_info(file_id, metadata), status='ok'))
+                    return results
+                
+                return jsonify({'status': 'success', 'results': self._cluster_batch(file_ids, lookup)})
+                
+            except Exception as e:
+                logger.error(f"批量查询文件信息失败: {e}")
+                return jsonify({'status': 'error', 'message': '批量查询失败'}), 500
+        
         @self.app.route('/api/batch/delete', methods=['POST'])
         @self._require_admin_auth  # 添加管理员权限验证
         def batch_delete_files():
             """批量删除文件"""
             try:
-                data = request.get_json()
-                if not data or 'file_ids' not in data:
-                    return jsonify({'status': 'error', 'message': '缺少文件ID列表'}), 400
-                
-                file_ids = data['file_ids']
-                if not isinstance(file_ids, list):
-                    return jsonify({'status': 'error', 'message': 'file_ids必须是数组'}), 400
-                
-                deleted_count = 0
-                errors = []
+                file_ids, error_response = self._batch_file_ids()
+                if error_response:
+                    return error_response
                 
-                for file_id in file_ids:
-                    if file_id in self.file_metadata:
-                        try:
-                            self._delete_file(file_id)
-                            deleted_count += 1
-                        except Exception as e:
-                            errors.append({'file_id': file_id, 'error': str(e)})
-                    else:
-                        errors.append({'file_id': file_id, 'error': '文件不存在'})
+                results = self._cluster_batch(file_ids, self._delete_files)
+                deleted_count = sum(1 for item in results if item['status'] == 'deleted')
+                errors = [{'file_id': item['file_id'], 'error': item['error']} for item in results if item['status'] == 'error']
                 
                 return jsonify({
                     'status': 'success',
                     'deleted_count': deleted_count,
                     'errors': errors,
+                    'results': results,
                     'message': f'成功删除{deleted_count}个文件'
                 })
                 
@@ -934,40 +5978,66 @@ class JackDisk:
                 logger.error(f"批量删除失败: {e}")
                 return jsonify({'status': 'error', 'message': '批量删除失败'}), 500
         
-        @self.app.route('/api/stats')
-        def get_stats():
-            """获取统计信息"""
+        @self.app.route('/api/batch/extend', methods=['POST'])
+        @self._require_admin_auth
+        def batch_extend_files():
+            """批量延长文件有效期（从当前过期时间顺延，最长到当前时间之后48小时）"""
             try:
-                current_time = int(time.time())
+                file_ids, error_response = self._batch_file_ids()
+                if error_response:
+                    return error_response
+                try:
+                    hours = int(request.get_json().get('hours', 24))
+                except (TypeError, ValueError):
+                    return jsonify({'status': 'error', 'message': 'hours必须是整数'}), 400
+                if hours < 1:
+                    return jsonify({'status': 'error', 'message': 'hours必须大于0'}), 400
                 
-                # 计算活跃文件数
-                active_files = sum(1 for meta in self.file_metadata.values() 
-                                 if not meta.is_deleted and meta.expire_time > current_time)
-                
-                # 计算今日上传数
-                today_start = int(datetime.now().replace(hour=0, minute=0, second=0).timestamp())
-                today_uploads = sum(1 for meta in self.file_metadata.values() 
-                                  if meta.upload_time >= today_start)
-                
-                # 存储使用情况
-                storage_used = self._get_total_storage_size()
-                actual_disk_usage = self._get_actual_disk_usage()
-                storage_usage_percent = (storage_used / self.config.max_storage * 100) if self.config.max_storage > 0 else 0
-                
-                stats = {
-                    'total_uploads': self.stats['total_uploads'],
-                    'total_downloads': self.stats['total_downloads'],
-                    'active_files': active_files,
-                    'today_uploads': today_uploads,
-                    'storage_used': storage_used,
-                    'actual_disk_usage': actual_disk_usage,
-                    'storage_used_formatted': self._format_file_size(storage_used),
-                    'actual_disk_usage_formatted': self._format_file_size(actual_disk_usage),
-                    'storage_total_formatted': self._format_file_size(self.config.max_storage),
-                    'storage_usage_percent': round(storage_usage_percent, 2)
-                }
+                def extend(ids):
+                    current_time = int(time.time())
+                    max_expire_time = current_time + 48 * 3600
+                    results = []
+                    for file_id in ids:
+                        metadata = self.file_metadata.get(file_id)
+                        if metadata is None or metadata.is_deleted or metadata.expire_time <= current_time:
+                            results.append({'file_id': file_id, 'status': 'error', 'error': '文件不存在或已过期'})
+                            continue
+                        metadata.expire_time = min(metadata.expire_time + hours * 3600, max_expire_time)
+                        results.append({
+                            'file_id': file_id,
+                            'status': 'extended',
+                            'expire_time': metadata.expire_time,
+                            'expire_time_formatted': self._format_expire_time(metadata.expire_time)
+                        })
+                    
+                    extended = sum(1 for item in results if item['status'] == 'extended')
+                    if extended:
+                        self._bump_generation()
+                        self._save_metadata()
+                        logger.info(f"批量延长有效期: {extended} 个文件，{hours} 小时")
+                    return results
                 
-                return jsonify({'status': 'success', 'stats': stats})
+                results = self._cluster_batch(file_ids, extend)
+                extended_count = sum(1 for item in results if item['status'] == 'extended')
+                
+                return jsonify({
+                    'status': 'success',
+                    'extended_count': extended_count,
+                    'results': results,
+                    'message': f'成功延长{extended_count}个文件的有效期'
+                })
+                
+            except Exception as e:
+                logger.error(f"批量延长有效期失败: {e}")
+                return jsonify({'status': 'error', 'message': '批量延长有效期失败'}), 500
+        
+        @self.app.route('/api/stats')
+        def get_stats():
+            """获取统计信息（元数据未变化时直接返回缓存，客户端缓存未过期时返回304）"""
+            try:
+                if not self._cluster_local():
+                    return jsonify(self._cluster_stats())
+                return self._cached_json('stats', self._build_stats)
                 
             except Exception as e:
                 logger.error(f"获取统计信息失败: {e}")
@@ -989,10 +6059,10 @@ class JackDisk:
                 if password == self.config.admin_password:
                     session['admin_authenticated'] = True
                     session['auth_time'] = int(time.time())
-                    logger.info("管理员登录成功")
+                    logger.info("管理员登录成功", extra={'event': 'admin.login'})
                     return jsonify({'status': 'success', 'message': '登录成功'})
                 else:
-                    logger.warning(f"管理员登录失败: 密码错误")
+                    logger.warning("管理员登录失败: 密码错误", extra={'event': 'admin.login'})
                     return jsonify({'status': 'error', 'message': '密码错误'}), 403
                 
             except Exception as e:
@@ -1013,13 +6083,14 @@ class JackDisk:
         @self.app.route('/api/admin/config', methods=['POST'])
         @self._require_admin_auth
         def update_config():
-            """更新配置"""
+            """更新配置（保存到共享配置，所有工作进程在下一个请求时生效）"""
             try:
                 data = request.get_json()
                 if not data:
                     return jsonify({'status': 'error', 'message': '缺少配置数据'}), 400
                 
-                # 更新配置并验证范围
+                # 验证范围
+                changes = {}
                 if 'max_file_size' in data:
                     max_file_size = int(data['max_file_size'])
                     # 限制文件大小在1MB到10GB之间
@@ -1027,9 +6098,7 @@ class JackDisk:
                         max_file_size = 1 * 1024 * 1024
                     elif max_file_size > 10 * 1024 * 1024 * 1024:  # 10GB
                         max_file_size = 10 * 1024 * 1024 * 1024
-                    self.config.max_file_size = max_file_size
-                    # 同步更新Flask应用的MAX_CONTENT_LENGTH
-                    self.app.config['MAX_CONTENT_LENGTH'] = max_file_size + 100 * 1024 * 1024  # 增加100MB余量
+                    changes['max_file_size'] = max_file_size
                 
                 if 'file_expire_hours' in data:
                     file_expire_hours = int(data['file_expire_hours'])
@@ -1047,13 +6116,13 @@ class JackDisk:
                     # 最大值始终限制为48小时
                     if file_expire_hours > 48:
                         file_expire_hours = 48
-                    self.config.file_expire_hours = file_expire_hours
+                    changes['file_expire_hours'] = file_expire_hours
                 
                 if 'max_files_per_upload' in data:
-                    self.config.max_files_per_upload = int(data['max_files_per_upload'])
+                    changes['max_files_per_upload'] = int(data['max_files_per_upload'])
                 
                 if 'clean_interval' in data:
-                    self.config.clean_interval = int(data['clean_interval'])
+                    changes['clean_interval'] = int(data['clean_interval'])
                 
                 # 添加对max_storage的更新支持
                 if 'max_storage' in data:
@@ -1063,10 +6132,15 @@ class JackDisk:
                         max_storage = 1 * 1024 * 1024 * 1024
                     elif max_storage > 100 * 1024 * 1024 * 1024:  # 100GB
                         max_storage = 100 * 1024 * 1024 * 1024
-                    self.config.max_storage = max_storage
+                    changes['max_storage'] = max_storage
                 
-                logger.info(f"配置已更新: {data}")
-                return jsonify({'status': 'success', 'message': '配置更新成功'})
+                # 先持久化再推进代数，其他工作进程看到新代数时读到的一定是完整的新配置
+                values, generation = self.shared_config.save(changes)
+                self._apply_config(values)
+                self._config_generation = generation
+                
+                logger.info(f"配置已更新(代数{generation}): {changes}", extra={'event': 'config.update'})
+                return jsonify({'status': 'success', 'message': '配置更新成功', 'generation': generation})
                 
             except Exception as e:
                 logger.error(f"更新配置失败: {e}")
@@ -1077,26 +6151,29 @@ class JackDisk:
         def get_logs():
             """获取系统日志"""
             try:
-                level = request.args.get('level', 'INFO')
-                limit = int(request.args.get('limit', 100))
-                
-                # 读取日志文件
-                log_file = 'jack-disk.log'
-                if not Path(log_file).exists():
-                    return jsonify({'status': 'success', 'logs': []})
+                level = request.args.get('level', 'INFO').upper()
+                keyword = request.args.get('keyword', '').strip() or None
+                try:
+                    limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
+                    cursor = request.args.get('cursor')
+                    cursor = int(cursor) if cursor else None
+                    since = self._parse_log_time(request.args.get('since'))
+                    until = self._parse_log_time(request.args.get('until'))
+                except (ValueError, OverflowError, OSError):
+                    return jsonify({'status': 'error', 'message': '参数格式错误'}), 400
+                if cursor is not None and cursor < 0:
+                    return jsonify({'status': 'error', 'message': '参数格式错误'}), 400
                 
-                logs = []
-                with open(log_file, 'r', encoding='utf-8') as f:
-                    lines = f.readlines()
-                    
-                # 过滤和限制日志条数
-                for line in reversed(lines[-1000:]):  # 只处理最近1000条
-                    if level in line:
-                        logs.append(line.strip())
-                        if len(logs) >= limit:
-                            break
+                logs, next_cursor = self.log_reader.query(
+                    level=None if level == 'ALL' else level,
+                    keyword=keyword,
+                    since=since,
+                    until=until,
+                    cursor=cursor,
+                    limit=limit
+                )
                 
-                return jsonify({'status': 'success', 'logs': logs})
+                return jsonify({'status': 'success', 'logs': logs, 'next_cursor': next_cursor})
                 
             except Exception as e:
                 logger.error(f"获取日志失败: {e}")
@@ -1107,68 +6184,156 @@ class JackDisk:
         def clear_all_files():
             """清空所有文件"""
             try:
-                deleted_count = 0
                 errors = []
+                deleted_count = len(self.file_metadata)
                 
-                # 获取所有文件ID
-                file_ids = list(self.file_metadata.keys())
+                # 清空存储后端（包括未被元数据记录的文件）和派生资源
+                errors.extend(self.storage.clear())
+                self.derived.clear()
                 
-                # 删除所有元数据中的文件
-                for file_id in file_ids:
-                    if file_id in self.file_metadata:
-                        try:
-                            self._delete_file(file_id)
-                            deleted_count += 1
-                        except Exception as e:
-                            errors.append({'file_id': file_id, 'error': str(e)})
-                
-                # 清理上传目录中的所有文件（包括未被元数据记录的文件）
-                upload_path = Path(self.config.upload_dir)
-                if upload_path.exists():
-                    # 删除日期目录下的所有文件
-                    for date_dir in upload_path.iterdir():
-                        if date_dir.is_dir() and date_dir.name != 'temp' and date_dir.name.isdigit() and len(date_dir.name) == 8:
-                            try:
-                                # 删除目录中的所有文件
-                                for file_path in date_dir.iterdir():
-                                    if file_path.is_file():
-                                        file_path.unlink()
-                                # 如果目录为空，则删除目录
-                                if not any(date_dir.iterdir()):
-                                    date_dir.rmdir()
-                            except Exception as e:
-                                logger.error(f"清理日期目录失败 {date_dir}: {e}")
-                    
-                    # 清理临时目录
-                    temp_dir = upload_path / 'temp'
-                    if temp_dir.exists():
-                        try:
-                            import shutil
-                            shutil.rmtree(temp_dir)
-                            temp_dir.mkdir(exist_ok=True)
-                        except Exception as e:
-                            logger.error(f"清理临时目录失败: {e}")
+                # 临时分片目录移入回收目录，由后台删除引擎限速删除
+                temp_path = Path(self.config.upload_dir) / 'temp'
+                try:
+                    self.cleanup.discard(temp_path)
+                except Exception as e:
+                    logger.error(f"清理临时目录失败 {temp_path}: {e}")
+                    errors.append({'path': temp_path.name, 'error': str(e)})
+                temp_path.mkdir(parents=True, exist_ok=True)
+                self.reservations.clear()
                 
                 # 重置统计信息
                 self.stats['total_files'] = 0
                 self.stats['storage_used'] = 0
+                self.counters.reset_downloads()
                 
                 # 清空元数据
                 self.file_metadata.clear()
+                self._bump_generation()
                 self._save_metadata()
                 
-                logger.info(f"清空所有文件: 成功删除{deleted_count}个文件，清理了上传目录")
+                logger.info(f"清空所有文件: 成功删除{deleted_count}个文件，清理了上传目录", extra={'event': 'admin.clear_all'})
+                self.events.publish('reset', {})
                 
                 return jsonify({
                     'status': 'success',
                     'deleted_count': deleted_count,
                     'errors': errors,
+                    'cleanup': self.cleanup.status(),
                     'message': f'成功清空所有文件'
                 })
                 
             except Exception as e:
                 logger.error(f"清空所有文件失败: {e}")
                 return jsonify({'status': 'error', 'message': '清空文件失败'}), 500
+        
+        @self.app.route('/api/admin/cleanup')
+        @self._require_admin_auth
+        def cleanup_status():
+            """后台删除进度"""
+            try:
+                return jsonify({'status': 'success', 'cleanup': self.cleanup.status()})
+            except Exception as e:
+                logger.error(f"获取清理进度失败: {e}")
+                return jsonify({'status': 'error', 'message': '获取清理进度失败'}), 500
+        
+        @self.app.route('/api/admin/profiler', methods=['GET', 'POST', 'DELETE'])
+        @self._require_admin_auth
+        def profiler_settings():
+            """请求性能分析设置和采样结果列表"""
+            try:
+                if request.method == 'POST':
+                    data = request.get_json() or {}
+                    sample_rate = min(max(float(data.get('sample_rate', 0)), 0.0), 100.0)
+                    self.profiler.update_settings(
+                        enabled=bool(data.get('enabled', False)),
+                        sample_rate=sample_rate,
+                        route=str(data.get('route', '') or '')
+                    )
+                    logger.info(f"性能分析设置已更新: {self.profiler.settings}", extra={'event': 'config.update'})
+                elif request.method == 'DELETE':
+                    self.profiler.clear()
+                
+                return jsonify({
+                    'status': 'success',
+                    'settings': self.profiler.settings,
+                    'profiles': self.profiler.list_profiles()
+                })
+                
+            except Exception as e:
+                logger.error(f"性能分析设置失败: {e}")
+                return jsonify({'status': 'error', 'message': '性能分析设置失败'}), 500
+        
+        @self.app.route('/api/admin/profiler/<key>')
+        @self._require_admin_auth
+        def download_profile(key: str):
+            """下载合并后的性能分析结果（pstats格式，或format=text返回文本报告）"""
+            try:
+                stats = self.profiler.load(key)
+                if stats is None:
+                    return jsonify({'status': 'error', 'message': '性能分析结果不存在'}), 404
+                
+                if request.args.get('format') == 'text':
+                    stream = io.StringIO()
+                    stats.stream = stream
+                    stats.sort_stats(request.args.get('sort', 'cumulative')).print_stats(int(request.args.get('limit', 50)))
+                    return stream.getvalue(), 200, {'Content-Type': 'text/plain; charset=utf-8'}
+                
+                return send_file(
+                    io.BytesIO(marshal.dumps(stats.stats)),
+                    as_attachment=True,
+                    download_name=f"{key}.prof",
+                    mimetype='application/octet-stream'
+                )
+                
+            except Exception as e:
+                logger.error(f"下载性能分析结果失败: {e}")
+                return jsonify({'status': 'error', 'message': '下载性能分析结果失败'}), 500
+        
+        @self.app.route('/api/admin/migrate-layout', methods=['GET', 'POST'])
+        @self._require_admin_auth
+        def migrate_layout():
+            """在线迁移旧版日期目录到哈希分散目录"""
+            try:
+                running = self._migration_thread is not None and self._migration_thread.is_alive()
+                if request.method == 'GET':
+                    return jsonify({
+                        'status': 'success',
+                        'running': running,
+                        'result': self._migration_result
+                    })
+                
+                if running:
+                    return jsonify({'status': 'error', 'message': '迁移任务正在进行中'}), 409
+                
+                self._migration_thread = threading.Thread(
+                    target=self._run_layout_migration, name='migrate-layout', daemon=True
+                )
+                self._migration_thread.start()
+                return jsonify({'status': 'success', 'message': '迁移任务已启动'})
+                
+            except Exception as e:
+                logger.error(f"迁移存储布局失败: {e}")
+                return jsonify({'status': 'error', 'message': '迁移失败'}), 500
+    
+    def _run_layout_migration(self):
+        """后台执行存储布局迁移"""
+        try:
+            self._migration_result = None
+            self._migration_result = migrate_legacy_layout(
+                self.config.upload_dir,
+                is_deleted=lambda file_id: getattr(self.file_metadata.get(file_id), 'is_deleted', False)
+            )
+            logger.info(f"存储布局迁移完成: {self._migration_result}", extra={'event': 'storage.migrate'})
+        except Exception as e:
+            logger.error(f"迁移存储布局失败: {e}")
+    
+    def _parse_log_time(self, value: Optional[str]) -> Optional[str]:
+        """把时间参数（时间戳或日期时间字符串）转换为日志中的时间格式"""
+        if not value:
+            return None
+        if value.isdigit():
+            return datetime.fromtimestamp(int(value)).strftime('%Y-%m-%d %H:%M:%S')
+        return datetime.fromisoformat(value.replace('T', ' ')).strftime('%Y-%m-%d %H:%M:%S')
     
     def _format_file_size(self, size: int) -> str:
         """格式化文件大小"""
@@ -1178,6 +6343,89 @@ class JackDisk:
             size = int(size / 1024)  # 修复类型错误
         return f"{size:.1f}TB"
     
+    def _build_file_list(self, page: Optional[int] = None, per_page: Optional[int] = None) -> Tuple[str, float]:
+        """
+        生成文件列表响应，返回 (JSON字符串, 有效截止时间)
+        先按元数据排序分页，只为当前页的文件拼接缓存的JSON片段
+        """
+        # 获取查询参数
+        sort_by = request.args.get('sort', 'upload_time')
+        search = request.args.get('search', '').lower()
+        if page is None:
+            page = max(int(request.args.get('page', 1)), 1)
+        if per_page is None:
+            max_per_page = self.config.max_per_page
+            if self.cluster is not None and self.cluster.is_trusted(request.headers):
+                # 汇总查询需要各节点排序后的前 page*per_page 条（只对持有集群密钥的节点放宽）
+                max_per_page = max(max_per_page, self.config.cluster_max_window)
+            per_page = min(max(int(request.args.get('per_page', 50)), 1), max_per_page)
+        
+        current_time = int(time.time())
+        # 列表在最早一个文件过期或跨天（“今天/昨天”）时失效
+        valid_until = self._next_midnight()
+        first_expire = self.file_metadata.first_active_expire(current_time)
+        if first_expire is not None:
+            valid_until = min(valid_until, first_expire)
+        
+        # 筛选未过期文件并排序分页 - 默认按上传时间倒序（最新的在前面），只取当前页
+        if sort_by not in MetadataSnapshot.ORDERS:
+            sort_by = 'upload_time'
+        page_files, total_files = self.file_metadata.active_page(current_time, sort_by, search,
+                                                                 (page - 1) * per_page, per_page)
+        total_pages = (total_files + per_page - 1) // per_page
+        
+        files_json = ','.join(self._file_info_json(file_id, metadata) for file_id, metadata in page_files)
+        pagination = self.app.json.dumps({
+            'page': page,
+            'per_page': per_page,
+            'total_files': total_files,
+            'total_pages': total_pages
+        })
+        return f'{{"files":[{files_json}],"pagination":{pagination},"status":"success"}}', valid_until
+    
+    def _build_stats(self) -> Tuple[Dict[str, Any], float]:
+        """生成统计信息响应，返回 (响应数据, 有效截止时间)"""
+        current_time = int(time.time())
+        valid_until = self._next_midnight()
+        
+        # 计算活跃文件数
+        active_files = self.file_metadata.count_active(current_time)
+        first_expire = self.file_metadata.first_active_expire(current_time)
+        if first_expire is not None:
+            valid_until = min(valid_until, first_expire)
+        
+        # 计算今日上传数
+        today_start = int(datetime.now().replace(hour=0, minute=0, second=0).timestamp())
+        today_uploads = self.file_metadata.count_uploaded_since(today_start)
+        
+        # 存储使用情况
+        storage_used = self._get_total_storage_size()
+        actual_disk_usage = self._get_actual_disk_usage()
+        storage_usage_percent = (storage_used / self.config.max_storage * 100) if self.config.max_storage > 0 else 0
+        
+        stats = {
+            'total_uploads': self.counters.stat('total_uploads'),
+            'total_downloads': self.counters.stat('total_downloads'),
+            'active_files': active_files,
+            'today_uploads': today_uploads,
+            'storage_used': storage_used,
+            'actual_disk_usage': actual_disk_usage,
+            'storage_used_formatted': self._format_file_size(storage_used),
+            'actual_disk_usage_formatted': self._format_file_size(actual_disk_usage),
+            'storage_total': self.config.max_storage,
+            'storage_total_formatted': self._format_file_size(self.config.max_storage),
+            'storage_usage_percent': round(storage_usage_percent, 2)
+        }
+        if isinstance(self.storage, DedupStorage):
+            stats['dedup'] = self.storage.dedup_stats()
+        if self._tiered_storage() is not None:
+            stats['tiers'] = self._tiered_storage().tier_stats()
+        if isinstance(self.storage, PackedStorage):
+            stats['packs'] = self.storage.pack_stats()
+        stats['derived'] = self.derived.stats()
+        
+        return {'status': 'success', 'stats': stats}, valid_until
+    
     def _format_time(self, timestamp: int) -> str:
         """格式化时间"""
         dt = datetime.fromtimestamp(timestamp)
@@ -1212,7 +6460,7 @@ class JackDisk:
             return f"{days}天{hours}小时"
     
     def _cleanup_temp_files(self):
-        """清理临时文件"""
+        """清理临时文件（过期的分片目录移入回收目录，由后台删除引擎限速删除）"""
         try:
             temp_dir = Path(self.config.upload_dir) / 'temp'
             if not temp_dir.exists():
@@ -1224,33 +6472,26 @@ class JackDisk:
             temp_file_expire = 2 * 3600  # 修改为2小时
             
             # 遍历临时目录
-            for upload_dir in temp_dir.iterdir():
-                if upload_dir.is_dir():
-                    # 检查info文件
-                    info_file = upload_dir / 'upload_info.json'
-                    if info_file.exists():
-                        try:
-                            # 获取文件修改时间
-                            file_mtime = info_file.stat().st_mtime
-                            # 如果文件超过2小时未修改，则删除整个目录
-                            if current_time - file_mtime > temp_file_expire:
-                                import shutil
-                                shutil.rmtree(upload_dir)
-                                logger.info(f"清理过期临时文件目录: {upload_dir}")
-                        except Exception as e:
-                            logger.error(f"检查临时文件目录失败 {upload_dir}: {e}")
-                    else:
-                        # 如果没有info文件，检查目录创建时间
+            discarded = 0
+            with os.scandir(temp_dir) as entries:
+                for entry in entries:
+                    if not entry.is_dir(follow_symlinks=False):
+                        continue
+                    try:
+                        # 优先检查info文件的修改时间，没有info文件时使用目录的修改时间
                         try:
-                            dir_mtime = upload_dir.stat().st_mtime
-                            if current_time - dir_mtime > temp_file_expire:
-                                import shutil
-                                shutil.rmtree(upload_dir)
-                                logger.info(f"清理无信息的临时文件目录: {upload_dir}")
-                        except Exception as e:
-                            logger.error(f"检查临时目录失败 {upload_dir}: {e}")
+                            mtime = os.stat(os.path.join(entry.path, 'upload_info.json')).st_mtime
+                        except FileNotFoundError:
+                            mtime = entry.stat().st_mtime
+                        # 如果超过2小时未修改，则删除整个目录
+                        if current_time - mtime > temp_file_expire:
+                            if self.cleanup.discard(Path(entry.path)):
+                                discarded += 1
+                            self.reservations.release(entry.name)
+                    except Exception as e:
+                        logger.error(f"检查临时文件目录失败 {entry.path}: {e}")
             
-            logger.info("临时文件清理完成")
+            logger.info(f"临时文件清理完成: {discarded} 个过期目录已移入回收目录")
         except Exception as e:
             logger.error(f"清理临时文件失败: {e}")
 
@@ -1267,6 +6508,7 @@ class JackDisk:
         except KeyboardInterrupt:
             logger.info("服务正在关闭...")
             self.scheduler.shutdown()
+            self.counters.flush()
             self._save_metadata()
             logger.info("服务已关闭")
 
@@ -0,0 +1,605 @@
+#!/usr/bin/env python3
+"""
+Jack-Disk 基准测试与压测脚本
+在本机临时目录中启动独立的服务实例（不依赖网络），按不同元数据规模生成合成数据，
+测量上传、分片上传、下载、文件列表、统计接口、过期清理和冷启动的性能，
+以及块级去重存储的去重比和写入/读出吞吐，结果输出为JSON便于对比
+
+用法:
+    python benchmark.py                              # 默认 10k,100k 两种规模
+    python benchmark.py --sizes 10k,100k,1m -o result.json
+    python benchmark.py --compare baseline.json -o result.json
+    python benchmark.py --url http://127.0.0.1:5000  # 测试已运行的实例（不生成元数据）
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import socket
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+import urllib.error
+import urllib.request
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Any, Callable, Tuple
+
+APP_DIR = Path(__file__).resolve().parent
+
+
+def parse_count(value: str) -> int:
+    """解析 10k / 100k / 1m 形式的数量"""
+    value = value.strip().lower()
+    if value.endswith('k'):
+        return int(float(value[:-1]) * 1000)
+    if value.endswith('m'):
+        return int(float(value[:-1]) * 1000 * 1000)
+    return int(value)
+
+
+def parse_size(value: str) -> int:
+    """解析 256KB / 4MB 形式的字节数"""
+    value = value.strip().upper()
+    for unit, factor in (('GB', 1024 ** 3), ('MB', 1024 ** 2), ('KB', 1024)):
+        if value.endswith(unit):
+            return int(float(value[:-len(unit)]) * factor)
+    return int(value)
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """计算延迟分布（毫秒）"""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def percentile(p: float) -> float:
+        idx = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))
+        return round(ordered[idx] * 1000, 3)
+
+    return {
+        'count': len(ordered),
+        'mean_ms': round(statistics.mean(ordered) * 1000, 3),
+        'p50_ms': percentile(50),
+        'p90_ms': percentile(90),
+        'p99_ms': percentile(99),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+
+def generate_metadata(path: Path, count: int, expired_ratio: float = 0.1):
+    """生成合成元数据文件，约expired_ratio比例的文件已过期"""
+    now = int(time.time())
+    names = ['report', 'photo', 'backup', 'video', 'archive', '日志', '合同', 'notes']
+    exts = ['.pdf', '.jpg', '.zip', '.mp4', '.tar.gz', '.log', '.docx', '.txt']
+    expired_every = int(1 / expired_ratio) if expired_ratio > 0 else 0
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{')
+        for i in range(count):
+            file_id = f"{i:08x}"
+            upload_time = now - (i % 86400)
+            expire_time = now - 60 if expired_every and i % expired_every == 0 else upload_time + 86400
+            meta = {
+                'file_id': file_id,
+                'original_name': f"{names[i % len(names)]}_{i}{exts[i % len(exts)]}",
+                'file_size': 1024 + (i * 7919) % (8 * 1024 * 1024),
+                'file_type': 'application/octet-stream',
+                'upload_time': upload_time,
+                'expire_time': expire_time,
+                'md5_hash': '',
+                'download_count': i % 13,
+                'is_deleted': False
+            }
+            if i:
+                f.write(',')
+            f.write(json.dumps(file_id))
+            f.write(':')
+            f.write(json.dumps(meta, ensure_ascii=False))
+        f.write('}')
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def multipart_body(fields: Dict[str, str], files: Dict[str, tuple]) -> tuple:
+    """构造multipart/form-data请求体"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'.encode() + data + b'\r\n'
+        )
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class Client:
+    """基于urllib的简单HTTP客户端"""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method: str, path: str, body: Optional[bytes] = None,
+                content_type: Optional[str] = None, timeout: float = 300) -> tuple:
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        if content_type:
+            req.add_header('Content-Type', content_type)
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as resp:
+                return resp.status, resp.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def json(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None) -> tuple:
+        body = json.dumps(payload).encode() if payload is not None else None
+        status, data = self.request(method, path, body, 'application/json' if body else None)
+        try:
+            return status, json.loads(data)
+        except ValueError:
+            return status, {}
+
+
+class LocalServer:
+    """在临时目录中启动独立的Jack-Disk实例"""
+
+    def __init__(self, workdir: Path, port: int, env: Dict[str, str]):
+        self.workdir = workdir
+        self.port = port
+        self.env = env
+        self.process = None
+        self.startup_seconds = 0.0
+
+    def __enter__(self):
+        start = time.perf_counter()
+        self.process = subprocess.Popen(
+            [sys.executable, str(APP_DIR / 'app.py'), str(self.port)],
+            cwd=str(self.workdir), env=self.env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        client = Client(f"http://127.0.0.1:{self.port}")
+        deadline = time.time() + 600
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError('服务启动失败')
+            try:
+                status, _ = client.request('GET', '/api/admin/config', timeout=2)
+                if status == 200:
+                    self.startup_seconds = time.perf_counter() - start
+                    return self
+            except OSError:
+                pass
+            time.sleep(0.05)
+        raise RuntimeError('服务启动超时')
+
+    def __exit__(self, *exc):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+def timed(fn: Callable[[], Any]) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def bench_single_upload(client: Client, file_size: int, count: int, concurrency: int) -> Tuple[Dict[str, Any], List[str]]:
+    """单次上传接口吞吐，同时返回上传得到的文件ID（供下载测试使用）"""
+    payload = os.urandom(file_size)
+    file_ids = []
+
+    def one(i: int) -> float:
+        body, ctype = multipart_body({}, {'files': (f'bench_{uuid.uuid4().hex}.bin', payload)})
+        start = time.perf_counter()
+        status, data = client.request('POST', '/api/upload', body, ctype)
+        elapsed = time.perf_counter() - start
+        if status != 200:
+            raise RuntimeError(f'上传失败: {status} {data[:200]!r}')
+        file_ids.append(json.loads(data)['files'][0]['file_id'])
+        return elapsed
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(one, range(count)))
+    wall = time.perf_counter() - wall_start
+    result = summarize(samples)
+    result.update({
+        'file_size': file_size,
+        'concurrency': concurrency,
+        'throughput_mb_s': round(file_size * count / wall / 1024 / 1024, 2),
+        'requests_per_s': round(count / wall, 2),
+    })
+    return result, file_ids
+
+
+def bench_chunked_upload(client: Client, file_size: int, chunk_size: int, concurrency: int) -> Dict[str, Any]:
+    """分片上传吞吐：concurrency个文件并行上传，每个文件内部按顺序上传分片（与前端一致）"""
+    payload = os.urandom(file_size)
+
+    def one(i: int) -> float:
+        start = time.perf_counter()
+        status, init = client.json('POST', '/api/upload/init', {
+            'filename': f'bench_{uuid.uuid4().hex}.bin', 'file_size': file_size, 'chunk_size': chunk_size
+        })
+        if status != 200:
+            raise RuntimeError(f'初始化失败: {status} {init}')
+        upload_id = init['upload_id']
+        for index in range(init['chunk_count']):
+            chunk = payload[index * chunk_size:(index + 1) * chunk_size]
+            body, ctype = multipart_body({'upload_id': upload_id, 'chunk_index': str(index)},
+                                         {'chunk': (f'chunk_{index}', chunk)})
+            status, data = client.request('POST', '/api/upload/chunk', body, ctype)
+            if status != 200:
+                raise RuntimeError(f'上传分片失败: {status} {data[:200]!r}')
+        status, done = client.json('POST', '/api/upload/complete', {'upload_id': upload_id})
+        if status != 200:
+            raise RuntimeError(f'完成上传失败: {status} {done}')
+        return time.perf_counter() - start
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(one, range(concurrency)))
+    wall = time.perf_counter() - wall_start
+    result = summarize(samples)
+    result.update({
+        'file_size': file_size,
+        'chunk_size': chunk_size,
+        'concurrency': concurrency,
+        'throughput_mb_s': round(file_size * concurrency / wall / 1024 / 1024, 2),
+    })
+    return result
+
+
+def bench_download(client: Client, file_ids: List[str], file_size: int, count: int, concurrency: int) -> Dict[str, Any]:
+    """下载吞吐"""
+    def one(i: int) -> float:
+        start = time.perf_counter()
+        status, data = client.request('GET', f'/api/download/{file_ids[i % len(file_ids)]}')
+        if status != 200:
+            raise RuntimeError(f'下载失败: {status}')
+        return time.perf_counter() - start
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(one, range(count)))
+    wall = time.perf_counter() - wall_start
+    result = summarize(samples)
+    result.update({
+        'file_size': file_size,
+        'concurrency': concurrency,
+        'throughput_mb_s': round(file_size * count / wall / 1024 / 1024, 2),
+    })
+    return result
+
+
+def bench_get(client: Client, path: str, count: int) -> Dict[str, Any]:
+    """GET接口延迟"""
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        status, _ = client.request('GET', path)
+        samples.append(time.perf_counter() - start)
+        if status != 200:
+            raise RuntimeError(f'请求失败 {path}: {status}')
+    return summarize(samples)
+
+
+def bench_cleanup_sweep(count: int, workdir: Path) -> Dict[str, Any]:
+    """在进程内测量过期清理扫描耗时（约10%文件已过期，物理文件不存在）"""
+    upload_dir = workdir / 'sweep_uploads'
+    upload_dir.mkdir(parents=True, exist_ok=True)
+    generate_metadata(upload_dir / 'metadata.json', count)
+
+    cwd = os.getcwd()
+    os.environ['TEMPSTORE_UPLOAD_DIR'] = str(upload_dir)
+    os.chdir(workdir)
+    try:
+        sys.path.insert(0, str(APP_DIR))
+        import app as jack_disk_app
+        start = time.perf_counter()
+        jack_disk = jack_disk_app.JackDisk()
+        init_seconds = time.perf_counter() - start
+        jack_disk.scheduler.shutdown(wait=False)
+        # 清理任务只处理元数据，不需要输出每个文件的日志
+        jack_disk_app.logging.getLogger().setLevel(jack_disk_app.logging.WARNING)
+        sweep_seconds = timed(jack_disk._cleanup_expired_files)
+        second_sweep_seconds = timed(jack_disk._cleanup_expired_files)
+        jack_disk_app.logging.getLogger().setLevel(jack_disk_app.logging.INFO)
+        return {
+            'files': count,
+            'init_seconds': round(init_seconds, 4),
+            'sweep_seconds': round(sweep_seconds, 4),
+            'idle_sweep_seconds': round(second_sweep_seconds, 4),
+        }
+    finally:
+        os.chdir(cwd)
+        os.environ.pop('TEMPSTORE_UPLOAD_DIR', None)
+
+
+COLD_START_SCRIPT = """
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+import_start = time.perf_counter()
+import app as jack_disk_app
+import_seconds = time.perf_counter() - import_start
+jack_disk_app.logging.getLogger().setLevel(jack_disk_app.logging.WARNING)
+start = time.perf_counter()
+jack_disk = jack_disk_app.JackDisk()
+init_seconds = time.perf_counter() - start
+status = jack_disk.app.test_client().get('/api/files?per_page=50').status_code
+startup_seconds = time.perf_counter() - start
+jack_disk.scheduler.shutdown(wait=False)
+print(json.dumps({'import_seconds': round(import_seconds, 4), 'init_seconds': round(init_seconds, 4),
+                  'startup_seconds': round(startup_seconds, 4), 'status': status}))
+"""
+
+
+def bench_cold_start(count: int, workdir: Path) -> Dict[str, Any]:
+    """
+    冷启动耗时：在新进程中从构造JackDisk到第一个文件列表请求（/api/files 第一页）成功返回的时间，不含解释器和模块导入
+    第一次启动只有metadata.json（解析JSON并生成快照），第二次直接映射快照
+    """
+    upload_dir = workdir / 'coldstart_uploads'
+    upload_dir.mkdir(parents=True, exist_ok=True)
+    generate_metadata(upload_dir / 'metadata.json', count)
+    env = dict(os.environ)
+    env.update({'TEMPSTORE_UPLOAD_DIR': str(upload_dir), 'TEMPSTORE_RATE_LIMIT': 'false'})
+
+    results = {}
+    for label in ('json', 'snapshot'):
+        output = subprocess.check_output(
+            [sys.executable, '-c', COLD_START_SCRIPT, str(APP_DIR)],
+            cwd=str(workdir), env=env, stderr=subprocess.DEVNULL
+        )
+        result = json.loads(output.decode().strip().splitlines()[-1])
+        if result['status'] != 200:
+            raise RuntimeError(f"冷启动后的文件列表请求失败: {result['status']}")
+        results[f'cold_start_{label}'] = result
+    results['cold_start_snapshot']['target_met'] = results['cold_start_snapshot']['startup_seconds'] < 0.2
+    return results
+
+
+def mutate(data: bytes, rnd: random.Random, edits: int = 8) -> bytes:
+    """模拟一次修改后重新上传：随机插入、覆盖、删除若干4KB片段，并在末尾追加数据"""
+    buffer = bytearray(data)
+    for _ in range(edits):
+        offset = rnd.randrange(len(buffer))
+        action = rnd.choice(('insert', 'overwrite', 'delete'))
+        if action == 'insert':
+            buffer[offset:offset] = rnd.randbytes(4096)
+        elif action == 'overwrite':
+            buffer[offset:offset + 4096] = rnd.randbytes(4096)
+        else:
+            del buffer[offset:offset + 4096]
+    buffer += rnd.randbytes(64 * 1024)
+    return bytes(buffer)
+
+
+def bench_dedup(workdir: Path, file_size: int, revisions: int, avg_block: int) -> Dict[str, Any]:
+    """
+    在进程内对比本地存储和块级去重存储：依次写入一个文件及其多个修改版本，
+    测量写入（含分块和哈希）与读出（去重存储走下载时的预读路径）的吞吐，以及去重比
+    """
+    sys.path.insert(0, str(APP_DIR))
+    import app as jack_disk_app
+
+    rnd = random.Random(46)
+    versions = [rnd.randbytes(file_size)]
+    for _ in range(revisions):
+        versions.append(mutate(versions[-1], rnd))
+    logical_bytes = sum(len(data) for data in versions)
+    mb = logical_bytes / 1024 / 1024
+
+    backends = {
+        'local': jack_disk_app.LocalStorage(workdir / 'dedup_local', None),
+        'blocks': jack_disk_app.DedupStorage(workdir / 'dedup_blocks', None, avg_block),
+    }
+    results: Dict[str, Any] = {}
+    for label, storage in backends.items():
+        file_ids = [uuid.uuid4().hex[:8] for _ in versions]
+        ingest_seconds = timed(lambda: [storage.save(file_id, 0, io.BytesIO(data))
+                                        for file_id, data in zip(file_ids, versions)])
+
+        def read_all():
+            for file_id, data in zip(file_ids, versions):
+                if label == 'blocks':
+                    entries = storage.read_manifest(file_id)
+                    size = sum(len(chunk) for chunk in jack_disk_app.BlockStream(storage, entries, 0, len(data)))
+                else:
+                    with storage.open(file_id, 0) as f:
+                        size = sum(len(chunk) for chunk in iter(lambda: f.read(storage.BLOCK_SIZE), b''))
+                if size != len(data):
+                    raise RuntimeError(f'读出大小不一致 {label}/{file_id}: {size} != {len(data)}')
+
+        egress_seconds = timed(read_all)
+        results[f'dedup_ingest_{label}'] = {'seconds': round(ingest_seconds, 4),
+                                             'throughput_mb_s': round(mb / ingest_seconds, 2)}
+        results[f'dedup_egress_{label}'] = {'seconds': round(egress_seconds, 4),
+                                             'throughput_mb_s': round(mb / egress_seconds, 2)}
+
+    stats = backends['blocks'].dedup_stats()
+    results['dedup_ratio'] = {
+        'files': len(versions),
+        'logical_bytes': logical_bytes,
+        'stored_bytes': stats['stored_bytes'],
+        'blocks': stats['blocks'],
+        'avg_block_bytes': round(stats['stored_bytes'] / stats['blocks']) if stats['blocks'] else 0,
+        'dedup_ratio': stats['dedup_ratio'],
+    }
+    return results
+
+
+def run_scenarios(client: Client, args) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+
+    upload_size = parse_size(args.upload_size)
+    single, file_ids = bench_single_upload(client, upload_size, args.requests, 1)
+    results['upload_single'] = single
+    results[f'upload_single_c{args.concurrency}'], more_ids = bench_single_upload(
+        client, upload_size, args.requests, args.concurrency)
+    file_ids += more_ids
+
+    chunked_file_size = parse_size(args.chunked_file_size)
+    for chunk_size in [parse_size(v) for v in args.chunk_sizes.split(',')]:
+        for concurrency in [int(v) for v in args.chunk_concurrency.split(',')]:
+            key = f'upload_chunked_{chunk_size // 1024}k_c{concurrency}'
+            results[key] = bench_chunked_upload(client, chunked_file_size, chunk_size, concurrency)
+
+    results['download'] = bench_download(client, file_ids, upload_size, args.requests, 1)
+    results[f'download_c{args.concurrency}'] = bench_download(client, file_ids, upload_size, args.requests, args.concurrency)
+
+    results['files_page1'] = bench_get(client, '/api/files?page=1&per_page=50', args.requests)
+    results['files_page_deep'] = bench_get(client, '/api/files?page=100&per_page=50', args.requests)
+    results['files_sort_name'] = bench_get(client, '/api/files?sort=name&per_page=50', args.requests)
+    results['files_search'] = bench_get(client, '/api/files?search=backup&per_page=50', args.requests)
+    results['stats'] = bench_get(client, '/api/stats', args.requests)
+    return results
+
+
+def compare(previous: Dict[str, Any], current: Dict[str, Any], threshold: float) -> List[str]:
+    """对比两次结果，返回回归项描述"""
+    regressions = []
+    lower_is_better = ('mean_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'sweep_seconds', 'init_seconds', 'startup_seconds')
+    higher_is_better = ('throughput_mb_s', 'requests_per_s')
+    print(f"\n{'场景':<48}{'指标':<18}{'之前':>12}{'现在':>12}{'变化':>10}")
+    for dataset, scenarios in current.get('results', {}).items():
+        for scenario, metrics in scenarios.items():
+            old_metrics = previous.get('results', {}).get(dataset, {}).get(scenario)
+            if not isinstance(metrics, dict) or not isinstance(old_metrics, dict):
+                continue
+            for metric in lower_is_better + higher_is_better:
+                if metric not in metrics or not old_metrics.get(metric):
+                    continue
+                old, new = old_metrics[metric], metrics[metric]
+                change = (new - old) / old * 100
+                worse = change > threshold if metric in lower_is_better else change < -threshold
+                flag = ' !' if worse else ''
+                print(f"{dataset + '/' + scenario:<48}{metric:<18}{old:>12}{new:>12}{change:>9.1f}%{flag}")
+                if worse:
+                    regressions.append(f"{dataset}/{scenario} {metric}: {old} -> {new} ({change:+.1f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Jack-Disk 基准测试')
+    parser.add_argument('--sizes', default='10k,100k', help='元数据规模，例如 10k,100k,1m')
+    parser.add_argument('--url', help='测试已运行的实例，不生成元数据也不启动服务')
+    parser.add_argument('--requests', type=int, default=50, help='每个场景的请求数')
+    parser.add_argument('--concurrency', type=int, default=4, help='并发场景的并发数')
+    parser.add_argument('--upload-size', default='1MB', help='单次上传和下载的文件大小')
+    parser.add_argument('--chunked-file-size', default='32MB', help='分片上传的文件大小')
+    parser.add_argument('--chunk-sizes', default='256KB,2MB,8MB', help='分片大小列表')
+    parser.add_argument('--chunk-concurrency', default='1,4', help='分片上传的并发文件数列表')
+    parser.add_argument('--skip-sweep', action='store_true', help='跳过进程内清理扫描测试')
+    parser.add_argument('--skip-cold-start', action='store_true', help='跳过冷启动测试')
+    parser.add_argument('--skip-dedup', action='store_true', help='跳过块级去重存储测试')
+    parser.add_argument('--dedup-file-size', default='16MB', help='去重测试的初始文件大小')
+    parser.add_argument('--dedup-revisions', type=int, default=4, help='去重测试中修改后重新上传的版本数')
+    parser.add_argument('--dedup-avg-block', default='64KB', help='去重存储的平均块大小')
+    parser.add_argument('-o', '--output', help='结果JSON输出路径（默认输出到标准输出）')
+    parser.add_argument('--compare', help='与之前的结果JSON对比')
+    parser.add_argument('--threshold', type=float, default=10.0, help='对比时视为回归的变化百分比')
+    args = parser.parse_args()
+
+    report: Dict[str, Any] = {
+        'meta': {
+            'timestamp': int(time.time()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': vars(args),
+        },
+        'results': {}
+    }
+    try:
+        report['meta']['git_commit'] = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=str(APP_DIR), stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+
+    if args.url:
+        report['results']['external'] = run_scenarios(Client(args.url), args)
+    else:
+        for size_label in args.sizes.split(','):
+            count = parse_count(size_label)
+            workdir = Path(tempfile.mkdtemp(prefix=f'jackdisk_bench_{size_label}_'))
+            try:
+                upload_dir = workdir / 'uploads'
+                upload_dir.mkdir()
+                gen_seconds = timed(lambda: generate_metadata(upload_dir / 'metadata.json', count))
+                print(f"[{size_label}] 生成 {count} 条元数据用时 {gen_seconds:.2f}s", file=sys.stderr)
+
+                env = dict(os.environ)
+                env.update({
+                    'TEMPSTORE_UPLOAD_DIR': str(upload_dir),
+                    'TEMPSTORE_RATE_LIMIT': 'false',
+                    'TEMPSTORE_MAX_STORAGE': '1000GB',
+                    'TEMPSTORE_MAX_FILE_SIZE': '10GB',
+                    'TEMPSTORE_MIN_FREE_SPACE': '0',
+                })
+                with LocalServer(workdir, free_port(), env) as server:
+                    print(f"[{size_label}] 服务启动用时 {server.startup_seconds:.2f}s", file=sys.stderr)
+                    results = run_scenarios(Client(f"http://127.0.0.1:{server.port}"), args)
+                    results['server_startup'] = {'startup_seconds': round(server.startup_seconds, 4)}
+
+                if not args.skip_sweep:
+                    results['cleanup_sweep'] = bench_cleanup_sweep(count, workdir)
+                if not args.skip_cold_start:
+                    results.update(bench_cold_start(count, workdir))
+                    print(f"[{size_label}] 快照冷启动到首个请求用时 "
+                          f"{results['cold_start_snapshot']['startup_seconds']:.3f}s", file=sys.stderr)
+                report['results'][size_label] = results
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    if not args.skip_dedup:
+        workdir = Path(tempfile.mkdtemp(prefix='jackdisk_bench_dedup_'))
+        try:
+            dedup = bench_dedup(workdir, parse_size(args.dedup_file_size), args.dedup_revisions,
+                                parse_size(args.dedup_avg_block))
+            report['results']['dedup'] = dedup
+            print(f"[dedup] 去重比 {dedup['dedup_ratio']['dedup_ratio']}, 写入 "
+                  f"{dedup['dedup_ingest_blocks']['throughput_mb_s']}MB/s (本地 {dedup['dedup_ingest_local']['throughput_mb_s']}MB/s), "
+                  f"读出 {dedup['dedup_egress_blocks']['throughput_mb_s']}MB/s (本地 {dedup['dedup_egress_local']['throughput_mb_s']}MB/s)",
+                  file=sys.stderr)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+        print(f"结果已写入 {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+        regressions = compare(previous, report, args.threshold)
+        if regressions:
+            print(f"\n发现 {len(regressions)} 项性能回归:", file=sys.stderr)
+            for item in regressions:
+                print(f"  {item}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
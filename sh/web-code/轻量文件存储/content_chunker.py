@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Jack-Disk 内容定义分块（FastCDC）
+块级去重存储用它把上传内容切分为内容定义的块。查找切点是逐字节的纯Python循环，
+Web进程把它交给进程池执行（请求线程等待结果时释放GIL），因此本模块只依赖标准库，进程池子进程不需要加载Web应用
+"""
+
+import hashlib
+from typing import List
+
+
+class ContentChunker:
+    """
+    FastCDC内容定义分块：用Gear滚动哈希（影响范围为最近64字节）在哈希命中掩码处切分。
+    前 min_size 字节内不切分，到 avg_size 之前用更严格的掩码、之后用更宽松的掩码（归一化分块），
+    使块大小集中在平均值附近；在文件中间插入或删除数据只改变附近一两个块，其余块仍能去重
+    """
+
+    GEAR = tuple(int.from_bytes(hashlib.md5(bytes([i])).digest()[:8], 'little') for i in range(256))
+    MASK64 = (1 << 64) - 1
+    WINDOW = 64
+    BATCH_BLOCKS = 16  # 每次交给进程池查找切点的数据量（最大块大小的倍数）
+
+    def __init__(self, avg_size: int = 64 * 1024):
+        bits = max(8, avg_size.bit_length() - 1)
+        self.avg_size = 1 << bits
+        self.min_size = self.avg_size // 4
+        self.max_size = self.avg_size * 4
+        # 取哈希高位判断切点：左移后高位由最近的64个字节决定
+        self.mask_strict = ((1 << (bits + 2)) - 1) << (64 - bits - 2)
+        self.mask_loose = ((1 << (bits - 2)) - 1) << (64 - bits + 2)
+
+    def _cut(self, data, start: int, end: int) -> int:
+        """在 data[start:end] 中查找第一个切点，返回块的结束位置"""
+        if end - start <= self.min_size:
+            return end
+        gear, limit = self.GEAR, self.MASK64
+        h = 0
+        # 先滚入切点判断区之前的一个窗口，使切点只取决于附近内容，与块起点无关
+        for b in data[start + self.min_size - self.WINDOW:start + self.min_size]:
+            h = ((h << 1) + gear[b]) & limit
+        normal = min(start + self.avg_size, end)
+        mask = self.mask_strict
+        for position, b in enumerate(data[start + self.min_size:normal], start + self.min_size + 1):
+            h = ((h << 1) + gear[b]) & limit
+            if not h & mask:
+                return position
+        mask = self.mask_loose
+        for position, b in enumerate(data[normal:end], normal + 1):
+            h = ((h << 1) + gear[b]) & limit
+            if not h & mask:
+                return position
+        return end
+
+    def cuts(self, data: bytes, final: bool) -> List[int]:
+        """
+        返回 data 中各块的结束位置。final为False时只切出之后至少还有一个最大块数据的块
+        （切点需要看到最多一个最大块的内容），剩余部分等更多数据到达后再切
+        """
+        ends = []
+        start = 0
+        while len(data) - start >= self.max_size or (final and start < len(data)):
+            start = self._cut(data, start, min(start + self.max_size, len(data)))
+            ends.append(start)
+        return ends
+
+    def split(self, blocks, executor=None):
+        """
+        把任意大小的数据块序列重新切分为内容定义的块。
+        指定executor（进程池）时切点在子进程中查找，调用线程只负责切片
+        """
+        batch = self.max_size * self.BATCH_BLOCKS
+        buffer = bytearray()
+        for block in blocks:
+            buffer += block
+            if len(buffer) >= batch:
+                yield from self._emit(buffer, executor, final=False)
+        yield from self._emit(buffer, executor, final=True)
+
+    def _emit(self, buffer: bytearray, executor, final: bool):
+        data = bytes(buffer)
+        if executor is None:
+            ends = self.cuts(data, final)
+        else:
+            ends = executor.submit(find_cuts, self.avg_size, data, final).result()
+        start = 0
+        for end in ends:
+            yield data[start:end]
+            start = end
+        del buffer[:start]
+
+
+def find_cuts(avg_size: int, data: bytes, final: bool) -> List[int]:
+    """进程池入口：查找切点"""
+    return ContentChunker(avg_size).cuts(data, final)
@@ -7,8 +7,13 @@ bind = "127.0.0.1:5000"
 # 工作进程数
 workers = multiprocessing.cpu_count() * 2 + 1
 
-# 工作进程类
-worker_class = "sync"
+# 工作进程类：gthread在每个进程内用线程处理请求。
+# 页面上的事件流（/api/events）是长连接，使用sync时每条会占住整个进程，打开的页面数达到进程数后上传和下载全部阻塞；
+# gthread下每条事件流只占一个线程
+worker_class = "gthread"
+
+# 每个工作进程的线程数，应大于单个进程上同时打开的页面数（每个页面一条事件流）与并发上传/下载数之和
+threads = 16
 
 # 工作进程超时时间（秒）
 timeout = 30
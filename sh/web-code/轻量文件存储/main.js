@@ -1,10 +1,41 @@
 class JackDiskUI {
     constructor() {
         this.isAdmin = false;
+        this.maxChunkRetries = 3; // 分片校验失败时的最多重传次数
+        this.uploadThroughput = 0; // 最近测得的分片上传速度（字节/秒），初始化分片上传时用于协商分片大小
         this.initializeEventListeners();
         this.loadFiles();
         this.loadStats();
         this.loadConfig(); // 确保在初始化时加载配置信息
+        this.initEventStream();
+    }
+
+    // 订阅服务器推送的事件（其他用户上传、删除文件时自动刷新，无需轮询）
+    initEventStream() {
+        if (!window.EventSource) {
+            return;
+        }
+        let refreshTimeout;
+        const scheduleRefresh = () => {
+            // 合并短时间内的多个事件，只刷新一次
+            clearTimeout(refreshTimeout);
+            refreshTimeout = setTimeout(() => {
+                this.loadFiles();
+                this.loadStats();
+            }, 500);
+        };
+        const source = new EventSource('/api/events');
+        source.addEventListener('file.added', () => scheduleRefresh());
+        source.addEventListener('file.deleted', () => scheduleRefresh());
+        source.addEventListener('file.updated', () => scheduleRefresh()); // 缩略图和媒体信息生成完成
+        source.addEventListener('reset', () => scheduleRefresh());
+        source.addEventListener('storage', (e) => {
+            const data = JSON.parse(e.data);
+            const storageElement = document.getElementById('stats-storage');
+            if (storageElement) {
+                storageElement.textContent = `存储: ${data.storage_used_formatted}/${data.storage_total_formatted}`;
+            }
+        });
     }
 
     initializeEventListeners() {
@@ -211,6 +242,14 @@ class JackDiskUI {
             });
         }
         
+        // 日志级别筛选
+        const logLevelFilter = document.getElementById('log-level-filter');
+        if (logLevelFilter) {
+            logLevelFilter.addEventListener('change', () => {
+                this.loadLogs();
+            });
+        }
+        
         // 内联保存配置
         const saveConfigInlineBtn = document.getElementById('save-config-inline-btn');
         if (saveConfigInlineBtn) {
@@ -398,15 +437,12 @@ class JackDiskUI {
     }
 
     async handleChunkedUpload(file) {
-        const chunkSize = 2 * 1024 * 1024; // 2MB per chunk
-        const chunks = Math.ceil(file.size / chunkSize);
-        
         // 用于计算上传速度的变量
         let startTime = Date.now();
         let uploadedBytes = 0;
         
         try {
-            // 1. 初始化分片上传
+            // 1. 初始化分片上传，由服务器按文件大小和上次测得的上传速度协商初始分片大小及上下限
             const initResponse = await fetch('/api/upload/init', {
                 method: 'POST',
                 headers: {
@@ -415,7 +451,8 @@ class JackDiskUI {
                 body: JSON.stringify({
                     filename: file.name,
                     file_size: file.size,
-                    chunk_size: chunkSize
+                    adaptive: true,
+                    throughput: this.uploadThroughput ? Math.round(this.uploadThroughput) : undefined
                 })
             });
             
@@ -425,64 +462,105 @@ class JackDiskUI {
             }
             
             const uploadId = initResult.upload_id;
-            let uploadedChunks = 0;
+            // 续传旧的固定分片上传时上下限都等于分片大小，即不调整
+            let chunkSize = initResult.chunk_size;
+            const minChunkSize = initResult.adaptive ? initResult.min_chunk_size : chunkSize;
+            const maxChunkSize = initResult.adaptive ? initResult.max_chunk_size : chunkSize;
+            const targetSeconds = initResult.target_chunk_seconds || 3;
+            const alignChunk = (size) => Math.min(maxChunkSize, Math.max(minChunkSize, Math.floor(size / 65536) * 65536));
             
-            // 如果服务器返回了已上传的分片信息，则使用这些信息
-            if (initResult.uploaded_chunks) {
-                uploadedChunks = initResult.uploaded_chunks.length;
-                uploadedBytes = uploadedChunks * chunkSize;
-                // 更新进度显示
-                const progress = (uploadedChunks / chunks) * 100;
-                this.updateChunkedUploadProgress(file, uploadedChunks, chunks, progress, 0, 0);
-                
-                // 如果有已上传的分片，自动继续上传，无需用户确认
-                if (initResult.uploaded_chunks.length > 0) {
-                    console.log(`检测到文件 "${file.name}" 已上传了 ${initResult.uploaded_chunks.length}/${chunks} 个分片，自动继续上传。`);
-                }
+            // 服务器已保存的分片 序号 -> [偏移, 大小]，从文件开头首尾相接的部分可以跳过
+            const uploaded = new Map((initResult.chunks || []).map(([index, offset, size]) => [index, [offset, size]]));
+            if (uploaded.size > 0) {
+                console.log(`检测到文件 "${file.name}" 已上传了 ${uploaded.size} 个分片，自动继续上传。`);
             }
             
-            // 2. 逐个上传分片（跳过已上传的分片）
-            for (let i = 0; i < chunks; i++) {
-                // 如果分片已上传，跳过
-                if (initResult.uploaded_chunks && initResult.uploaded_chunks.includes(i)) {
+            // 2. 逐个上传分片（跳过已上传的分片），每个分片附带SHA-256，服务器校验失败时只重传该分片；
+            // 每片上传后按测得的速度在上下限内调整下一片的大小，使每片耗时接近目标时间
+            const chunkHashes = [];
+            let offset = 0;
+            for (let i = 0; offset < file.size; i++) {
+                const previous = uploaded.get(i);
+                if (previous && previous[0] === offset) {
+                    // 分片已上传，跳过（仍需计算摘要用于整体校验）
+                    const end = Math.min(file.size, offset + previous[1]);
+                    chunkHashes.push(await this.sha256Hex(file.slice(offset, end)));
+                    uploadedBytes += end - offset;
+                    offset = end;
+                    this.updateChunkedUploadProgress(file, uploadedBytes, (uploadedBytes / file.size) * 100, 0, 0);
                     continue;
                 }
                 
-                const start = i * chunkSize;
-                const end = Math.min(file.size, start + chunkSize);
-                const chunk = file.slice(start, end);
-                const chunkBytes = chunk.size;
-                
-                const formData = new FormData();
-                formData.append('upload_id', uploadId);
-                formData.append('chunk_index', i);
-                formData.append('chunk', chunk, `chunk_${i}`);
-                
-                const chunkStartTime = Date.now();
-                const chunkResponse = await fetch('/api/upload/chunk', {
-                    method: 'POST',
-                    body: formData
-                });
+                let chunk = null;
+                let chunkHash = null;
+                let chunkResult;
+                let chunkStartTime;
+                for (let attempt = 1; ; attempt++) {
+                    const size = Math.min(file.size - offset, chunkSize);
+                    if (!chunk || chunk.size !== size) {
+                        chunk = file.slice(offset, offset + size);
+                        chunkHash = await this.sha256Hex(chunk);
+                    }
+                    const formData = new FormData();
+                    formData.append('upload_id', uploadId);
+                    formData.append('chunk_index', i);
+                    formData.append('chunk_offset', offset);
+                    formData.append('chunk_size', chunk.size);
+                    if (chunkHash) {
+                        formData.append('chunk_sha256', chunkHash);
+                    }
+                    formData.append('chunk', chunk, `chunk_${i}`);
+                    
+                    chunkStartTime = Date.now();
+                    try {
+                        const chunkResponse = await fetch('/api/upload/chunk', {
+                            method: 'POST',
+                            body: formData
+                        });
+                        chunkResult = await chunkResponse.json();
+                    } catch (error) {
+                        // 网络中断：缩小分片后重试，弱网下每次失败只需重传较小的分片
+                        if (attempt >= this.maxChunkRetries) {
+                            throw error;
+                        }
+                        chunkSize = alignChunk(chunkSize / 4);
+                        this.uploadThroughput = 0;
+                        console.warn(`分片 ${i} 上传中断，缩小到 ${chunkSize} 字节后重试（第 ${attempt} 次重试）`);
+                        continue;
+                    }
+                    if (chunkResult.status === 'success' || !chunkResult.checksum_mismatch || attempt >= this.maxChunkRetries) {
+                        break;
+                    }
+                    console.warn(`分片 ${i} 校验失败，重新上传（第 ${attempt} 次重试）`);
+                }
                 
                 const chunkEndTime = Date.now();
                 const chunkDuration = (chunkEndTime - chunkStartTime) / 1000; // 转换为秒
+                const chunkBytes = chunk.size;
                 const chunkSpeed = chunkDuration > 0 ? chunkBytes / chunkDuration : 0;
                 
-                const chunkResult = await chunkResponse.json();
                 if (chunkResult.status !== 'success') {
                     throw new Error(chunkResult.message || `上传分片 ${i} 失败`);
                 }
                 
-                uploadedChunks++;
+                chunkHashes.push(chunkHash);
                 uploadedBytes += chunkBytes;
+                offset += chunkBytes;
+                
+                // 按平滑后的速度调整下一片大小，每次最多放大一倍或缩小一半，避免单次测量偏差引起大幅波动
+                if (chunkSpeed > 0) {
+                    this.uploadThroughput = this.uploadThroughput ? this.uploadThroughput * 0.5 + chunkSpeed * 0.5 : chunkSpeed;
+                    const ideal = this.uploadThroughput * targetSeconds;
+                    chunkSize = alignChunk(Math.min(chunkSize * 2, Math.max(chunkSize / 2, ideal)));
+                }
                 
                 // 计算平均上传速度
                 const elapsedTime = (Date.now() - startTime) / 1000; // 转换为秒
                 const avgSpeed = elapsedTime > 0 ? uploadedBytes / elapsedTime : 0;
                 
                 // 更新进度显示
-                const progress = (uploadedChunks / chunks) * 100;
-                this.updateChunkedUploadProgress(file, uploadedChunks, chunks, progress, avgSpeed, chunkSpeed);
+                const progress = (uploadedBytes / file.size) * 100;
+                this.updateChunkedUploadProgress(file, uploadedBytes, progress, avgSpeed, chunkSpeed);
             }
             
             // 3. 完成分片上传
@@ -492,7 +570,9 @@ class JackDiskUI {
                     'Content-Type': 'application/json'
                 },
                 body: JSON.stringify({
-                    upload_id: uploadId
+                    upload_id: uploadId,
+                    // 浏览器支持时附带Merkle树根，由服务器与各分片摘要核对
+                    tree_hash: chunkHashes.length > 0 && chunkHashes.every(Boolean) ? await this.merkleRoot(chunkHashes) : undefined
                 })
             });
             
@@ -518,7 +598,37 @@ class JackDiskUI {
         }
     }
 
-    updateChunkedUploadProgress(file, uploadedChunks, totalChunks, percentComplete, avgSpeed, chunkSpeed) {
+    // 计算SHA-256（十六进制）；非安全上下文（用http访问非本机地址）没有crypto.subtle，返回null，此时服务器只校验分片大小
+    async sha256Hex(data) {
+        if (!window.crypto || !window.crypto.subtle) {
+            return null;
+        }
+        const buffer = data instanceof Blob ? await data.arrayBuffer() : data;
+        const digest = await window.crypto.subtle.digest('SHA-256', buffer);
+        return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+    }
+
+    // 由分片摘要计算Merkle树根，算法与服务器 merkle_root 一致：相邻两个拼接后取SHA-256，奇数个时最后一个直接上移
+    async merkleRoot(hexHashes) {
+        let level = hexHashes;
+        while (level.length > 1) {
+            const next = [];
+            for (let i = 0; i < level.length; i += 2) {
+                if (i + 1 < level.length) {
+                    const joined = new Uint8Array(64);
+                    joined.set(level[i].match(/../g).map(b => parseInt(b, 16)));
+                    joined.set(level[i + 1].match(/../g).map(b => parseInt(b, 16)), 32);
+                    next.push(await this.sha256Hex(joined));
+                } else {
+                    next.push(level[i]);
+                }
+            }
+            level = next;
+        }
+        return level[0];
+    }
+
+    updateChunkedUploadProgress(file, uploadedBytes, percentComplete, avgSpeed, chunkSpeed) {
         const progressContainer = document.getElementById('upload-progress');
         if (!progressContainer) return;
         
@@ -548,8 +658,7 @@ class JackDiskUI {
             }
         };
         
-        // 计算已上传字节数和剩余时间
-        const uploadedBytes = (uploadedChunks * file.size) / totalChunks;
+        // 计算剩余时间
         const remainingBytes = file.size - uploadedBytes;
         const remainingTime = avgSpeed > 0 ? remainingBytes / avgSpeed : 0;
         
@@ -769,15 +878,19 @@ class JackDiskUI {
                     <div class="flex items-center space-x-3">
                         <input type="checkbox" class="custom-checkbox file-checkbox" data-file-id="${file.file_id}">
                         <div class="flex-shrink-0">
+                            ${file.thumbnail_url ? `
+                            <img src="${file.thumbnail_url}" alt="" loading="lazy" class="w-10 h-10 rounded-lg object-cover bg-gray-100">
+                            ` : `
                             <div class="w-10 h-10 bg-blue-100 rounded-lg flex items-center justify-center">
                                 <svg class="w-5 h-5 text-blue-500" fill="none" stroke="currentColor" viewBox="0 0 24 24">
                                     <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M9 12h6m-6 4h6m2 5H7a2 2 0 01-2-2V5a2 2 0 012-2h5.586a1 1 0 01.707.293l5.414 5.414a1 1 0 01.293.707V19a2 2 0 01-2 2z"></path>
                                 </svg>
                             </div>
+                            `}
                         </div>
                         <div class="min-w-0 flex-1 cursor-pointer" onclick="tempStoreUI.downloadFile('${file.file_id}')">
                             <p class="text-sm font-medium text-gray-900 truncate">${file.original_name}</p>
-                            <p class="text-xs text-gray-500">${this.formatFileSize(file.file_size)} • ${file.upload_time_formatted} • 过期时间: ${file.expire_time_formatted}</p>
+                            <p class="text-xs text-gray-500">${this.formatFileSize(file.file_size)}${this.formatMedia(file.media)} • ${file.upload_time_formatted} • 过期时间: ${file.expire_time_formatted}</p>
                         </div>
                     </div>
                     <div class="flex items-center space-x-2">
@@ -805,6 +918,21 @@ class JackDiskUI {
         this.updateDeleteButtonsVisibility();
     }
 
+    // 媒体信息摘要：分辨率、时长
+    formatMedia(media) {
+        if (!media) return '';
+        const parts = [];
+        if (media.width && media.height) {
+            parts.push(`${media.width}×${media.height}`);
+        }
+        if (media.duration) {
+            const seconds = Math.round(media.duration);
+            const minutes = Math.floor(seconds / 60);
+            parts.push(`${minutes}:${String(seconds % 60).padStart(2, '0')}`);
+        }
+        return parts.length ? ` • ${parts.join(' • ')}` : '';
+    }
+
     updateDeleteButtonsVisibility() {
         const deleteButtons = document.querySelectorAll('.delete-btn');
         deleteButtons.forEach(btn => {
@@ -1505,7 +1633,12 @@ class JackDiskUI {
 
     async loadLogs() {
         try {
-            const response = await fetch('/api/admin/logs');
+            const levelFilter = document.getElementById('log-level-filter');
+            const params = new URLSearchParams({
+                level: levelFilter ? levelFilter.value : 'all',
+                limit: 200
+            });
+            const response = await fetch(`/api/admin/logs?${params.toString()}`);
             const result = await response.json();
             
             if (result.status === 'success') {
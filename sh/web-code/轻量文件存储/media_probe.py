@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Jack-Disk 媒体处理（在独立的进程池中运行）
+从文件头读取图片格式和尺寸，生成JPEG缩略图（需要安装Pillow），
+系统中有ffprobe时提取音视频的时长、编码和分辨率。只依赖标准库和可选的Pillow，进程池子进程不需要加载Web应用
+
+    python media_probe.py photo.jpg --thumbnail thumb.jpg
+"""
+
+import os
+import sys
+import json
+import uuid
+import struct
+import shutil
+import argparse
+import subprocess
+from typing import Dict, Any, Optional, BinaryIO
+
+try:
+    from PIL import Image, ImageOps  # 可选依赖，安装Pillow后生成缩略图
+except ImportError:
+    Image = None
+    ImageOps = None
+
+FFPROBE = shutil.which('ffprobe')
+PROBE_TIMEOUT = 30
+THUMBNAIL_QUALITY = 80
+# JPEG的帧起始标记（SOF），其中0xC4/0xC8/0xCC不是帧头
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def thumbnails_supported() -> bool:
+    return Image is not None
+
+
+def probe_supported(file_type: str) -> bool:
+    """该类型的文件能否提取到信息"""
+    if file_type.startswith('image/'):
+        return True
+    return FFPROBE is not None and file_type.startswith(('video/', 'audio/'))
+
+
+def image_size(f: BinaryIO) -> Optional[Dict[str, Any]]:
+    """从文件头读取图片格式和尺寸（PNG/GIF/BMP/WebP/JPEG），不解码像素"""
+    head = f.read(32)
+    if head.startswith(b'\x89PNG\r\n\x1a\n') and head[12:16] == b'IHDR':
+        width, height = struct.unpack('>II', head[16:24])
+        return {'format': 'png', 'width': width, 'height': height}
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        width, height = struct.unpack('<HH', head[6:10])
+        return {'format': 'gif', 'width': width, 'height': height}
+    if head[:2] == b'BM' and len(head) >= 26:
+        width, height = struct.unpack('<ii', head[18:26])
+        return {'format': 'bmp', 'width': width, 'height': abs(height)}
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP' and len(head) >= 30:
+        chunk = head[12:16]
+        if chunk == b'VP8 ':
+            width, height = struct.unpack('<HH', head[26:30])
+            return {'format': 'webp', 'width': width & 0x3FFF, 'height': height & 0x3FFF}
+        if chunk == b'VP8L':
+            bits = int.from_bytes(head[21:25], 'little')
+            return {'format': 'webp', 'width': (bits & 0x3FFF) + 1, 'height': ((bits >> 14) & 0x3FFF) + 1}
+        if chunk == b'VP8X':
+            return {'format': 'webp', 'width': int.from_bytes(head[24:27], 'little') + 1,
+                    'height': int.from_bytes(head[27:30], 'little') + 1}
+        return None
+    if head[:2] == b'\xff\xd8':
+        # 逐段跳过JPEG的标记段，直到帧头
+        f.seek(2)
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return None
+            code = marker[1]
+            if code == 0xFF:
+                f.seek(-1, os.SEEK_CUR)  # 填充字节
+                continue
+            if code == 0x01 or 0xD0 <= code <= 0xD8:
+                continue  # 没有长度字段的独立标记
+            length = f.read(2)
+            if len(length) < 2:
+                return None
+            if code in JPEG_SOF_MARKERS:
+                frame = f.read(5)
+                if len(frame) < 5:
+                    return None
+                height, width = struct.unpack('>HH', frame[1:5])
+                return {'format': 'jpeg', 'width': width, 'height': height}
+            f.seek(struct.unpack('>H', length)[0] - 2, os.SEEK_CUR)
+    return None
+
+
+def make_thumbnail(source: str, target: str, max_edge: int) -> Dict[str, Any]:
+    """生成不超过 max_edge 的JPEG缩略图（按EXIF方向旋转，透明背景填白），写临时文件后原子替换"""
+    with Image.open(source) as image:
+        info = {'format': (image.format or '').lower(), 'width': image.width, 'height': image.height}
+        # JPEG可以在解码时直接按比例缩小，大图省去大部分解码开销
+        image.draft('RGB', (max_edge, max_edge))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_edge, max_edge))
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        tmp_path = f"{target}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            image.save(tmp_path, 'JPEG', quality=THUMBNAIL_QUALITY, optimize=True)
+            os.replace(tmp_path, target)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+    return info
+
+
+def probe_av(source: str) -> Dict[str, Any]:
+    """用ffprobe读取音视频的时长、容器、编码和分辨率"""
+    output = subprocess.run(
+        [FFPROBE, '-v', 'error', '-of', 'json',
+         '-show_entries', 'format=duration,format_name:stream=codec_type,codec_name,width,height', source],
+        capture_output=True, timeout=PROBE_TIMEOUT, check=True
+    ).stdout
+    data = json.loads(output or b'{}')
+    info: Dict[str, Any] = {}
+    fmt = data.get('format') or {}
+    if fmt.get('format_name'):
+        info['format'] = fmt['format_name'].split(',')[0]
+    try:
+        info['duration'] = round(float(fmt['duration']), 2)
+    except (KeyError, TypeError, ValueError):
+        pass
+    for stream in data.get('streams') or []:
+        kind = stream.get('codec_type')
+        if kind == 'video' and 'video_codec' not in info:
+            info['video_codec'] = stream.get('codec_name')
+            if stream.get('width') and stream.get('height'):
+                info['width'], info['height'] = stream['width'], stream['height']
+        elif kind == 'audio' and 'audio_codec' not in info:
+            info['audio_codec'] = stream.get('codec_name')
+    return info
+
+
+def process_media(source: str, file_type: str, thumbnail: Optional[str], max_edge: int = 256) -> Dict[str, Any]:
+    """
+    提取媒体信息，thumbnail不为空时为图片生成缩略图，返回可写入元数据的字典；
+    出错时只在结果中记录 error，不抛出异常（一个坏文件不影响进程池）
+    """
+    result: Dict[str, Any] = {}
+    try:
+        if file_type.startswith('image/'):
+            with open(source, 'rb') as f:
+                result.update(image_size(f) or {})
+            if thumbnail and Image is not None:
+                result.update(make_thumbnail(source, thumbnail, max_edge))
+                result['thumbnail'] = True
+        elif FFPROBE and file_type.startswith(('video/', 'audio/')):
+            result.update(probe_av(source))
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"[:200]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='提取媒体信息并生成缩略图')
+    parser.add_argument('source', help='媒体文件路径')
+    parser.add_argument('--type', default='', help='MIME类型（默认按扩展名推断）')
+    parser.add_argument('--thumbnail', help='缩略图输出路径（需要Pillow）')
+    parser.add_argument('--size', type=int, default=256, help='缩略图最长边')
+    args = parser.parse_args()
+
+    file_type = args.type
+    if not file_type:
+        import mimetypes
+        file_type = mimetypes.guess_type(args.source)[0] or 'application/octet-stream'
+    print(json.dumps(process_media(args.source, file_type, args.thumbnail, args.size), ensure_ascii=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
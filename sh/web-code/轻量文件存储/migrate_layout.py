@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+"""
+Jack-Disk 存储布局迁移工具
+把旧版 uploads/YYYYMMDD/<file_id>_<upload_time> 文件迁移到两级哈希分散目录 uploads/ab/cd/<file_id>
+服务运行期间可直接执行，读取路径会同时兼容新旧两种布局
+"""
+
+import os
+import sys
+import argparse
+
+from app import migrate_legacy_layout
+
+
+def main():
+    parser = argparse.ArgumentParser(description='迁移Jack-Disk旧版日期目录到哈希分散目录')
+    parser.add_argument('--upload-dir', default=os.getenv('TEMPSTORE_UPLOAD_DIR', './uploads'),
+                        help='上传目录（默认读取 TEMPSTORE_UPLOAD_DIR）')
+    parser.add_argument('--batch-size', type=int, default=500, help='每批迁移的文件数')
+    parser.add_argument('--pause', type=float, default=0.05, help='每批之间暂停的秒数')
+    args = parser.parse_args()
+
+    result = migrate_legacy_layout(args.upload_dir, batch_size=args.batch_size, pause=args.pause)
+    print(f"迁移完成: 移动 {result['moved']} 个, 跳过 {result['skipped']} 个, 失败 {result['failed']} 个")
+    return 1 if result['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
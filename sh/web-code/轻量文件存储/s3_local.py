@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Jack-Disk 本地S3兼容服务（开发和联调用）
+在内存中实现 S3Storage 用到的接口子集：PutObject、GetObject（含Range）、HeadObject、DeleteObject、
+ListObjectsV2 和 Multipart Upload（创建/上传分段/完成/中止），路径风格地址 /bucket/key。
+只校验请求携带的AccessKey，不校验签名；数据在进程退出后丢失，不要用于生产环境
+
+    python s3_local.py --port 9000 --access-key jackdisk --secret-key jackdisk-secret
+    TEMPSTORE_STORAGE_BACKEND=s3 TEMPSTORE_S3_ENDPOINT=http://127.0.0.1:9000 \\
+        TEMPSTORE_S3_ACCESS_KEY=jackdisk TEMPSTORE_S3_SECRET_KEY=jackdisk-secret python app.py
+"""
+
+import sys
+import uuid
+import hashlib
+import argparse
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import unquote, urlsplit, parse_qs
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+MIN_PART_SIZE = 5 * 1024 * 1024  # 与S3一致：除最后一段外每段至少5MB
+MAX_KEYS = 1000
+
+
+class ObjectStore:
+    """内存中的对象和未完成的分段上传"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.objects: Dict[Tuple[str, str], Tuple[bytes, str, str]] = {}  # (bucket, key) -> (数据, ETag, 修改时间)
+        self.uploads: Dict[str, Dict] = {}
+
+
+class S3Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # 支持keep-alive，配合客户端连接池
+    server_version = 'JackDiskS3/1.0'
+
+    def log_message(self, format, *args):
+        pass
+
+    # ---- 工具方法 ----
+
+    def _parse(self) -> Tuple[str, str, Dict[str, str]]:
+        parts = urlsplit(self.path)
+        path = unquote(parts.path).lstrip('/')
+        bucket, _, key = path.partition('/')
+        query = {k: v[0] for k, v in parse_qs(parts.query, keep_blank_values=True).items()}
+        return bucket, key, query
+
+    def _body(self) -> bytes:
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _send(self, status: int, body: bytes = b'', headers: Optional[Dict[str, str]] = None,
+              content_length: Optional[int] = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body) if content_length is None else content_length))
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _xml(self, status: int, xml: str):
+        body = ('<?xml version="1.0" encoding="UTF-8"?>\n' + xml).encode('utf-8')
+        self._send(status, body, {'Content-Type': 'application/xml'})
+
+    def _error(self, status: int, code: str, message: str):
+        if self.command == 'HEAD':
+            self._send(status)
+            return
+        self._xml(status, f"<Error><Code>{code}</Code><Message>{escape(message)}</Message></Error>")
+
+    def _authorized(self) -> bool:
+        auth = self.headers.get('Authorization', '')
+        if not auth.startswith('AWS4-HMAC-SHA256 '):
+            self._error(403, 'AccessDenied', '缺少SigV4签名')
+            return False
+        access_key = self.server.access_key
+        if access_key and f"Credential={access_key}/" not in auth:
+            self._error(403, 'InvalidAccessKeyId', 'AccessKey不匹配')
+            return False
+        return True
+
+    @property
+    def store(self) -> ObjectStore:
+        return self.server.store
+
+    # ---- 请求处理 ----
+
+    def do_PUT(self):
+        if not self._authorized():
+            return
+        bucket, key, query = self._parse()
+        data = self._body()
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        if 'uploadId' in query:
+            with self.store.lock:
+                upload = self.store.uploads.get(query['uploadId'])
+                if upload is None:
+                    self._error(404, 'NoSuchUpload', '分段上传不存在')
+                    return
+                upload['parts'][int(query.get('partNumber', '0'))] = (data, etag)
+        elif key:
+            with self.store.lock:
+                self.store.objects[(bucket, key)] = (data, etag, formatdate(usegmt=True))
+        self._send(200, headers={'ETag': etag})
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        bucket, key, query = self._parse()
+        body = self._body()
+        if 'uploads' in query:
+            upload_id = uuid.uuid4().hex
+            with self.store.lock:
+                self.store.uploads[upload_id] = {'bucket': bucket, 'key': key, 'parts': {}}
+            self._xml(200, f"<InitiateMultipartUploadResult><Bucket>{escape(bucket)}</Bucket>"
+                           f"<Key>{escape(key)}</Key><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>")
+            return
+        if 'uploadId' not in query:
+            self._error(400, 'InvalidRequest', '不支持的POST请求')
+            return
+
+        try:
+            root = ElementTree.fromstring(body)
+        except ElementTree.ParseError:
+            self._error(400, 'MalformedXML', 'XML格式错误')
+            return
+        requested = []
+        for part in root.iter():
+            if part.tag.rsplit('}', 1)[-1] != 'Part':
+                continue
+            fields = {child.tag.rsplit('}', 1)[-1]: (child.text or '') for child in part}
+            requested.append((int(fields.get('PartNumber', '0')), fields.get('ETag', '')))
+
+        with self.store.lock:
+            upload = self.store.uploads.get(query['uploadId'])
+            if upload is None:
+                self._error(404, 'NoSuchUpload', '分段上传不存在')
+                return
+            chunks = []
+            digests = b''
+            for index, (number, etag) in enumerate(requested):
+                stored = upload['parts'].get(number)
+                if stored is None or stored[1] != etag:
+                    self._error(400, 'InvalidPart', f'分段{number}不存在或ETag不匹配')
+                    return
+                if index < len(requested) - 1 and len(stored[0]) < MIN_PART_SIZE:
+                    self._error(400, 'EntityTooSmall', f'分段{number}小于5MB')
+                    return
+                chunks.append(stored[0])
+                digests += bytes.fromhex(etag.strip('"'))
+            data = b''.join(chunks)
+            etag = f'"{hashlib.md5(digests).hexdigest()}-{len(requested)}"'
+            self.store.objects[(bucket, key)] = (data, etag, formatdate(usegmt=True))
+            del self.store.uploads[query['uploadId']]
+        self._xml(200, f"<CompleteMultipartUploadResult><Bucket>{escape(bucket)}</Bucket>"
+                       f"<Key>{escape(key)}</Key><ETag>{escape(etag)}</ETag></CompleteMultipartUploadResult>")
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        bucket, key, query = self._parse()
+        if not key:
+            self._list(bucket, query)
+            return
+        with self.store.lock:
+            stored = self.store.objects.get((bucket, key))
+        if stored is None:
+            self._error(404, 'NoSuchKey', '对象不存在')
+            return
+        data, etag, modified = stored
+        headers = {'ETag': etag, 'Last-Modified': modified, 'Accept-Ranges': 'bytes',
+                   'Content-Type': 'application/octet-stream'}
+
+        range_header = self.headers.get('Range', '')
+        if range_header.startswith('bytes=') and ',' not in range_header:
+            start_text, _, end_text = range_header[6:].partition('-')
+            size = len(data)
+            if start_text:
+                start = int(start_text)
+                end = min(int(end_text), size - 1) if end_text else size - 1
+            else:
+                start = max(0, size - int(end_text))
+                end = size - 1
+            if start >= size or start > end:
+                self._send(416, headers={'Content-Range': f'bytes */{size}'})
+                return
+            headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+            self._send(206, data[start:end + 1], headers)
+            return
+        self._send(200, data, headers)
+
+    def do_HEAD(self):
+        if not self._authorized():
+            return
+        bucket, key, _ = self._parse()
+        with self.store.lock:
+            stored = self.store.objects.get((bucket, key))
+        if stored is None:
+            self._send(404)
+            return
+        data, etag, modified = stored
+        self._send(200, headers={'ETag': etag, 'Last-Modified': modified}, content_length=len(data))
+
+    def do_DELETE(self):
+        if not self._authorized():
+            return
+        bucket, key, query = self._parse()
+        with self.store.lock:
+            if 'uploadId' in query:
+                self.store.uploads.pop(query['uploadId'], None)
+            else:
+                self.store.objects.pop((bucket, key), None)
+        self._send(204)
+
+    def _list(self, bucket: str, query: Dict[str, str]):
+        if query.get('list-type') != '2':
+            self._error(400, 'InvalidRequest', '仅支持ListObjectsV2')
+            return
+        prefix = query.get('prefix', '')
+        after = query.get('continuation-token') or query.get('start-after', '')
+        max_keys = min(int(query.get('max-keys', MAX_KEYS)), MAX_KEYS)
+        with self.store.lock:
+            keys = sorted((key, len(value[0]), value[1]) for (b, key), value in self.store.objects.items()
+                          if b == bucket and key.startswith(prefix) and key > after)
+        page = keys[:max_keys]
+        truncated = len(keys) > max_keys
+        contents = ''.join(
+            f"<Contents><Key>{escape(key)}</Key><Size>{size}</Size><ETag>{escape(etag)}</ETag></Contents>"
+            for key, size, etag in page
+        )
+        token = f"<NextContinuationToken>{escape(page[-1][0])}</NextContinuationToken>" if truncated else ''
+        self._xml(200, f'<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+                       f"<Name>{escape(bucket)}</Name><Prefix>{escape(prefix)}</Prefix><KeyCount>{len(page)}</KeyCount>"
+                       f"<MaxKeys>{max_keys}</MaxKeys><IsTruncated>{'true' if truncated else 'false'}</IsTruncated>"
+                       f"{token}{contents}</ListBucketResult>")
+
+
+def start_server(host: str = '127.0.0.1', port: int = 0, access_key: str = '') -> ThreadingHTTPServer:
+    """在后台线程启动服务，port为0时自动分配端口（server.server_address[1]）"""
+    server = ThreadingHTTPServer((host, port), S3Handler)
+    server.daemon_threads = True
+    server.store = ObjectStore()
+    server.access_key = access_key
+    threading.Thread(target=server.serve_forever, name='s3-local', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Jack-Disk 本地S3兼容服务（内存存储，仅用于开发测试）')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址')
+    parser.add_argument('--port', type=int, default=9000, help='监听端口')
+    parser.add_argument('--access-key', default='', help='要求请求携带的AccessKey，为空时不校验')
+    parser.add_argument('--secret-key', default='', help='仅为与客户端配置对应，服务端不校验签名')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), S3Handler)
+    server.daemon_threads = True
+    server.store = ObjectStore()
+    server.access_key = args.access_key
+    print(f"本地S3服务已启动: http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
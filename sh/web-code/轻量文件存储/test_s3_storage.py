@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+S3Storage 与本地S3兼容服务（s3_local.py）的联调测试：
+直接上传与分段上传的边界、Range下载、删除、usage() 统计和AccessKey错误
+
+    python -m pytest -q test_s3_storage.py
+"""
+
+import io
+import unittest
+
+from flask import Flask
+
+import s3_local
+from app import S3Client, S3Storage, StorageError
+
+ACCESS_KEY = 'jackdisk'
+SECRET_KEY = 'jackdisk-secret'
+
+
+class S3StorageTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = s3_local.start_server(port=0, access_key=ACCESS_KEY)
+        cls.endpoint = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        cls.web = Flask(__name__)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        with self.server.store.lock:
+            self.server.store.objects.clear()
+            self.server.store.uploads.clear()
+        self.client = S3Client(self.endpoint, 'jack-disk', ACCESS_KEY, SECRET_KEY, pool_size=4)
+        self.storage = S3Storage(self.client, 'files', part_size=S3Storage.MIN_PART_SIZE, workers=2)
+
+    def _payload(self, size: int) -> bytes:
+        return bytes(range(251)) * (size // 251) + bytes(range(size % 251))
+
+    def _etag(self, file_id: str) -> str:
+        status, headers, _ = self.client.request('HEAD', self.storage.key_for(file_id))
+        self.assertEqual(status, 200)
+        return headers['etag'].strip('"')
+
+    def _read(self, file_id: str) -> bytes:
+        body = self.storage.open(file_id, 0)
+        try:
+            return body.read()
+        finally:
+            body.close()
+
+    def test_put_below_part_size(self):
+        data = self._payload(self.storage.part_size - 1)
+        size, md5 = self.storage.save('small', 0, io.BytesIO(data))
+        self.assertEqual(size, len(data))
+        # PutObject 的ETag是内容MD5，分段上传的ETag带 -<分段数> 后缀
+        self.assertEqual(self._etag('small'), md5)
+        self.assertEqual(self._read('small'), data)
+        self.assertFalse(self.server.store.uploads)
+
+    def test_multipart_at_part_size(self):
+        for file_id, size, parts in (('exact', self.storage.part_size, 1), ('over', self.storage.part_size + 1, 2)):
+            data = self._payload(size)
+            saved, _ = self.storage.save(file_id, 0, io.BytesIO(data))
+            self.assertEqual(saved, size)
+            self.assertTrue(self._etag(file_id).endswith(f'-{parts}'))
+            self.assertEqual(self._read(file_id), data)
+        # 分段上传完成后不留下未完成的上传
+        self.assertFalse(self.server.store.uploads)
+
+    def test_ranged_get(self):
+        data = self._payload(100000)
+        self.storage.save('ranged', 0, io.BytesIO(data))
+        with self.web.test_request_context(headers={'Range': 'bytes=1000-1999'}):
+            response = self.storage.send('ranged', 0, 'ranged.bin', 'application/octet-stream')
+            body = b''.join(response.response)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.headers['Content-Range'], f'bytes 1000-1999/{len(data)}')
+        self.assertEqual(body, data[1000:2000])
+
+        with self.web.test_request_context(headers={'Range': f'bytes={len(data)}-'}):
+            response = self.storage.send('ranged', 0, 'ranged.bin', 'application/octet-stream')
+        self.assertEqual(response.status_code, 416)
+
+    def test_delete(self):
+        self.storage.save('gone', 0, io.BytesIO(b'jack-disk'))
+        self.assertTrue(self.storage.exists('gone', 0))
+        self.storage.delete('gone', 0)
+        self.assertFalse(self.storage.exists('gone', 0))
+        self.assertIsNone(self.storage.open('gone', 0))
+        # 删除不存在的对象不报错
+        self.storage.delete('gone', 0)
+
+    def test_usage(self):
+        self.assertEqual(self.storage.usage(), 0)
+        sizes = [10, 4096, self.storage.part_size + 1]
+        for index, size in enumerate(sizes):
+            self.storage.save(f'usage{index}', 0, io.BytesIO(self._payload(size)))
+        # 前缀之外的对象不计入
+        other = S3Storage(self.client, 'other')
+        other.save('usage0', 0, io.BytesIO(b'x' * 123))
+        self.assertEqual(self.storage.usage(), sum(sizes))
+        self.storage.delete('usage1', 0)
+        self.assertEqual(self.storage.usage(), sizes[0] + sizes[2])
+
+    def test_auth_failure(self):
+        client = S3Client(self.endpoint, 'jack-disk', 'wrong-key', SECRET_KEY)
+        storage = S3Storage(client, 'files')
+        with self.assertRaises(StorageError) as context:
+            storage.save('denied', 0, io.BytesIO(b'jack-disk'))
+        self.assertIn('403', str(context.exception))
+        with self.assertRaises(StorageError):
+            storage.usage()
+        self.assertFalse(self.storage.exists('denied', 0))
+
+
+if __name__ == '__main__':
+    unittest.main()